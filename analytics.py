@@ -0,0 +1,65 @@
+import math
+from typing import Any, Dict, Optional
+
+
+def _number(row: Dict[str, Any], column: str) -> float:
+    value = row.get(column)
+    return float(value) if value is not None else 0.0
+
+
+def _optional(row: Dict[str, Any], column: str) -> Optional[float]:
+    value = row.get(column)
+    return float(value) if value is not None else None
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 4)
+
+
+def _stddev(count: float, total: float, total_sq: float) -> Optional[float]:
+    # Sample standard deviation from running sums
+    if count < 2:
+        return None
+    variance = (total_sq - total * total / count) / (count - 1)
+    return math.sqrt(max(variance, 0.0))
+
+
+def summarize(user_id: str, row: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Derive performance metrics from a user_analytics row (None = no trades).
+    Everything is O(1): the row already holds the running sums.
+    """
+    row = row or {}
+    trades = _number(row, "trades")
+    wins = _number(row, "wins")
+    pnl_sum = _number(row, "pnl_sum")
+    gross_profit = _number(row, "gross_profit")
+    gross_loss = _number(row, "gross_loss")
+    r_trades = _number(row, "r_trades")
+    r_sum = _number(row, "r_sum")
+    equity = _number(row, "equity")
+    max_equity = _number(row, "max_equity")
+
+    return {
+        "user_id": user_id,
+        "trades": int(trades),
+        "wins": int(wins),
+        "losses": int(_number(row, "losses")),
+        "win_rate": _round(wins / trades * 100) if trades else None,
+        "total_pnl": _round(pnl_sum),
+        "average_pnl": _round(pnl_sum / trades) if trades else None,
+        "pnl_stddev": _round(_stddev(trades, pnl_sum, _number(row, "pnl_sum_sq"))),
+        "best_trade": _round(_optional(row, "best_trade")),
+        "worst_trade": _round(_optional(row, "worst_trade")),
+        "profit_factor": _round(gross_profit / -gross_loss) if gross_loss < 0 else None,
+        "average_r": _round(r_sum / r_trades) if r_trades else None,
+        "r_stddev": _round(_stddev(r_trades, r_sum, _number(row, "r_sum_sq"))),
+        "equity": _round(equity),
+        "max_equity": _round(max_equity),
+        "current_drawdown": _round(max_equity - equity),
+        "max_drawdown": _round(_number(row, "max_drawdown")),
+        "stop_loss_closes": int(_number(row, "stop_loss_closes")),
+        "take_profit_closes": int(_number(row, "take_profit_closes")),
+        "first_closed_at": row.get("first_closed_at"),
+        "last_closed_at": row.get("last_closed_at"),
+    }
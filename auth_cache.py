@@ -0,0 +1,188 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+# Supabase signs access tokens with the project's JWT secret (HS256)
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET", "")
+JWT_AUDIENCE = os.getenv("SUPABASE_JWT_AUDIENCE", "authenticated")
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+CLOCK_SKEW_SECONDS = 30
+
+
+class TokenError(Exception):
+    """
+    Raised when a token is malformed, badly signed or expired
+    """
+
+
+class AuthenticatedUser:
+    """
+    User identity taken from verified JWT claims
+    """
+
+    def __init__(self, claims: Dict[str, Any]):
+        self.claims = claims
+        self.id = claims.get("sub")
+        self.email = claims.get("email")
+        self.role = claims.get("role")
+        self.user_metadata = claims.get("user_metadata", {})
+        self.app_metadata = claims.get("app_metadata", {})
+
+    def __repr__(self):
+        return f"AuthenticatedUser(id={self.id!r}, email={self.email!r})"
+
+
+def _b64decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def decode_unverified(token: str) -> Tuple[Dict[str, Any], Dict[str, Any], bytes, bytes]:
+    """
+    Split a JWT into (header, claims, signing_input, signature) without
+    checking the signature
+    """
+    try:
+        header_segment, payload_segment, signature_segment = token.split(".")
+        header = json.loads(_b64decode(header_segment))
+        claims = json.loads(_b64decode(payload_segment))
+        signature = _b64decode(signature_segment)
+    except Exception:
+        raise TokenError("Malformed token")
+    signing_input = f"{header_segment}.{payload_segment}".encode()
+    return header, claims, signing_input, signature
+
+
+def verify_hs256(token: str, secret: str) -> Dict[str, Any]:
+    """
+    Verify an HS256 token locally and return its claims
+    """
+    header, claims, signing_input, signature = decode_unverified(token)
+    if header.get("alg") != "HS256":
+        raise TokenError(f"Unsupported algorithm: {header.get('alg')}")
+
+    expected = hmac.new(secret.encode(), signing_input, hashlib.sha256).digest()
+    if not hmac.compare_digest(expected, signature):
+        raise TokenError("Invalid signature")
+
+    check_claims(claims)
+    return claims
+
+
+def can_verify_locally(token: str) -> bool:
+    """
+    True when we hold the key for this token's algorithm; anything else
+    (e.g. asymmetric JWKS-signed tokens) is verified by the auth server
+    """
+    if not SUPABASE_JWT_SECRET:
+        return False
+    try:
+        header = json.loads(_b64decode(token.split(".")[0]))
+    except Exception:
+        return False
+    return header.get("alg") == "HS256"
+
+
+def check_claims(claims: Dict[str, Any]):
+    now = time.time()
+    if "exp" not in claims or claims["exp"] + CLOCK_SKEW_SECONDS < now:
+        raise TokenError("Token expired")
+    if "nbf" in claims and claims["nbf"] - CLOCK_SKEW_SECONDS > now:
+        raise TokenError("Token not yet valid")
+    audience = claims.get("aud")
+    if JWT_AUDIENCE and audience is not None:
+        audiences = audience if isinstance(audience, list) else [audience]
+        if JWT_AUDIENCE not in audiences:
+            raise TokenError("Invalid audience")
+
+
+class TokenCache:
+    """
+    LRU cache of verified users keyed by token hash.
+
+    Entries never outlive the token's own expiry, and can be evicted per
+    token or per user through revoke_token/revoke_user.
+    """
+
+    def __init__(self, max_entries: int = AUTH_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Any, float, Optional[str]]]" = OrderedDict()
+        self._by_user: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "revocations": 0}
+
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> Any:
+        key = self.key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            user, expires_at, user_id = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return user
+
+    def put(self, token: str, user: Any, expires_at: float, user_id: Optional[str]):
+        key = self.key(token)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (user, expires_at, user_id)
+            if user_id:
+                self._by_user.setdefault(user_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+
+    def _remove(self, key: str):
+        _, _, user_id = self._entries.pop(key)
+        if user_id and user_id in self._by_user:
+            self._by_user[user_id].discard(key)
+            if not self._by_user[user_id]:
+                del self._by_user[user_id]
+
+    def revoke_token(self, token: str):
+        key = self.key(token)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                self.stats["revocations"] += 1
+
+    def revoke_user(self, user_id: str):
+        with self._lock:
+            for key in list(self._by_user.get(user_id, ())):
+                self._remove(key)
+                self.stats["revocations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def status(self) -> Dict[str, Any]:
+        return {**self.stats, "entries": len(self._entries), "local_verification": bool(SUPABASE_JWT_SECRET)}
+
+
+token_cache = TokenCache()
+
+
+def revoke_token(token: str):
+    token_cache.revoke_token(token)
+
+
+def revoke_user(user_id: str):
+    token_cache.revoke_user(user_id)
@@ -0,0 +1,135 @@
+from typing import Any, Dict, List
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+MAX_BACKTEST_LEVELS = 100        # per side of the grid, so up to 10,000 combinations
+MAX_BACKTEST_CELLS = 4_000_000   # entries x horizon candles held in memory
+
+
+class BacktestError(ValueError):
+    pass
+
+
+def _first_reach(paths: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+    """
+    For every row of `paths` (non-decreasing along axis 1) and every
+    threshold, the first column where the row reaches it; the row length
+    if it never does. Shape (len(thresholds), rows).
+
+    All rows are searched in one np.searchsorted call by shifting row r by
+    r * span, which keeps the flattened array sorted.
+    """
+    rows, width = paths.shape
+    low = min(float(paths.min()), float(thresholds.min()))
+    span = max(float(paths.max()), float(thresholds.max())) - low + 1.0
+    offsets = np.arange(rows, dtype=np.float64) * span
+    flat = (paths - low + offsets[:, None]).ravel()
+    queries = (thresholds[:, None] - low) + offsets[None, :]
+    positions = np.searchsorted(flat, queries.ravel(), side="left").reshape(len(thresholds), rows)
+    return np.minimum(positions - np.arange(rows) * width, width)
+
+
+def run(candles: List[Dict[str, Any]], side: str, entry_price: float, stop_losses: List[float], take_profits: List[float], horizon: int,
+        step_seconds: int) -> Dict[str, Any]:
+    """
+    Replay an SL/TP grid over historical candles (oldest first).
+
+    Every candle close is treated as an entry, with the stop and target
+    placed at the same percentage distance from it as the requested
+    levels are from `entry_price`. The following `horizon` candles decide
+    the outcome: target first, stop first, or neither (marked to the last
+    close). A candle that touches both levels counts as a stop, since the
+    order inside a candle is unknown.
+
+    Favorable and adverse excursions are cumulative maxima per entry, so
+    the first-hit time of every level comes from one searchsorted call and
+    each stop-loss row of the grid is evaluated with array operations.
+    """
+    long = side == "long"
+    entry_price = float(entry_price)
+    if entry_price <= 0:
+        raise BacktestError("entry_price must be positive")
+    stops = np.asarray(sorted(set(stop_losses)), dtype=np.float64)
+    targets = np.asarray(sorted(set(take_profits)), dtype=np.float64)
+    if not len(stops) or not len(targets):
+        raise BacktestError("Pass at least one stop_loss and one take_profit")
+    if len(stops) > MAX_BACKTEST_LEVELS or len(targets) > MAX_BACKTEST_LEVELS:
+        raise BacktestError(f"At most {MAX_BACKTEST_LEVELS} stop_loss and take_profit levels")
+
+    # Distances as positive fractions of the entry price
+    stop_distance = (entry_price - stops) / entry_price if long else (stops - entry_price) / entry_price
+    target_distance = (targets - entry_price) / entry_price if long else (entry_price - targets) / entry_price
+    if (stop_distance <= 0).any() or (stop_distance >= 1).any():
+        raise BacktestError("stop_loss levels must be on the losing side of entry_price")
+    if (target_distance <= 0).any():
+        raise BacktestError("take_profit levels must be on the winning side of entry_price")
+
+    high, low, close = (
+        np.fromiter((candle[name] for candle in candles), dtype=np.float64, count=len(candles))
+        for name in ("high", "low", "close")
+    )
+    entries = len(close) - horizon
+    if horizon < 1 or entries < 1:
+        raise BacktestError(f"Need more than {horizon} candles of history, have {len(close)}")
+    # Keep the most recent entries that fit the memory budget
+    entries = min(entries, MAX_BACKTEST_CELLS // horizon)
+    first = len(close) - horizon - entries
+
+    entry = close[first:first + entries]
+    forward_high = sliding_window_view(high[first + 1:], horizon)[:entries]
+    forward_low = sliding_window_view(low[first + 1:], horizon)[:entries]
+    rise = np.maximum.accumulate(forward_high / entry[:, None] - 1.0, axis=1)
+    fall = np.maximum.accumulate(1.0 - forward_low / entry[:, None], axis=1)
+    favorable, adverse = (rise, fall) if long else (fall, rise)
+    final = close[first + horizon:first + horizon + entries] / entry - 1.0
+    final = final if long else -final
+
+    target_hit = _first_reach(favorable, target_distance)  # (targets, entries)
+    stop_hit = _first_reach(adverse, stop_distance)        # (stops, entries)
+
+    results = []
+    for s, stop in enumerate(stops):
+        stopped_at = stop_hit[s][None, :]
+        stopped = (stopped_at <= target_hit) & (stopped_at < horizon)
+        reached = (target_hit < stopped_at) & (target_hit < horizon)
+        ambiguous = (target_hit == stopped_at) & (target_hit < horizon)
+        returns = np.where(reached, target_distance[:, None], np.where(stopped, -stop_distance[s], final[None, :])) * 100
+        # Candles until the deciding hit; NaN for entries still open at the horizon
+        hit_time = np.where(reached, target_hit, np.where(stopped, stopped_at, np.nan)) + 1.0
+        hits = np.count_nonzero(reached | stopped, axis=1)
+        # np.sort puts NaN last, so each row's median sits among its first `hits` values
+        ordered = np.sort(hit_time, axis=1)
+        middle = np.stack([np.maximum(hits - 1, 0) // 2, hits // 2], axis=1)
+        median_time = np.take_along_axis(ordered, middle, axis=1).mean(axis=1)
+        mean_time = np.nansum(hit_time, axis=1) / np.maximum(hits, 1)
+        target_rate = reached.mean(axis=1)
+        stop_rate = stopped.mean(axis=1)
+        ambiguous_rate = ambiguous.mean(axis=1)
+        expected = returns.mean(axis=1)
+        percentiles = np.percentile(returns, [10, 25, 50, 75, 90], axis=1)
+        for t, target in enumerate(targets):
+            results.append({
+                "stop_loss": float(stop),
+                "take_profit": float(target),
+                "stop_loss_pct": round(float(stop_distance[s]) * 100, 4),
+                "take_profit_pct": round(float(target_distance[t]) * 100, 4),
+                "take_profit_rate": round(float(target_rate[t]), 4),
+                "stop_loss_rate": round(float(stop_rate[t]), 4),
+                "open_rate": round(float(1.0 - target_rate[t] - stop_rate[t]), 4),
+                "ambiguous_rate": round(float(ambiguous_rate[t]), 4),
+                "median_candles_to_hit": float(median_time[t]) if hits[t] else None,
+                "mean_seconds_to_hit": round(float(mean_time[t] * step_seconds), 1) if hits[t] else None,
+                "expected_return_pct": round(float(expected[t]), 4),
+                "return_pct": {
+                    name: round(float(percentiles[q, t]), 4)
+                    for q, name in enumerate(("p10", "p25", "p50", "p75", "p90"))
+                },
+            })
+    return {
+        "samples": int(entries),
+        "horizon": horizon,
+        "combinations": len(results),
+        "best": max(results, key=lambda result: result["expected_return_pct"]),
+        "results": results,
+    }
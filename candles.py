@@ -0,0 +1,277 @@
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+# Supported resolutions (seconds) and how many candles each ring buffer keeps
+RESOLUTIONS = {
+    "1m": 60,
+    "10m": 600,
+    "1h": 3600,
+    "1d": 86400,
+}
+CAPACITIES = {
+    "1m": int(os.getenv("CANDLES_1M_CAPACITY", "10080")),   # 7 days
+    "10m": int(os.getenv("CANDLES_10M_CAPACITY", "4320")),  # 30 days
+    "1h": int(os.getenv("CANDLES_1H_CAPACITY", "8760")),    # 1 year
+    "1d": int(os.getenv("CANDLES_1D_CAPACITY", "3650")),    # 10 years
+}
+
+# Binance kline interval each resolution is backfilled from; Binance has
+# no 10m interval, so 5m klines are merged pairwise
+BACKFILL_INTERVALS = {
+    "1m": "1m",
+    "10m": "5m",
+    "1h": "1h",
+    "1d": "1d",
+}
+
+
+class CandleRing:
+    """
+    Fixed-size ring buffer of OHLCV candles in open_time order.
+
+    Columns are stored separately; appending past capacity overwrites the
+    oldest candle. Range lookups binary-search on open_time.
+    """
+
+    __slots__ = ("capacity", "size", "head", "open_time", "open", "high", "low", "close", "volume")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.size = 0
+        self.head = 0  # physical index of the oldest candle
+        self.open_time = [0] * capacity
+        self.open = [0.0] * capacity
+        self.high = [0.0] * capacity
+        self.low = [0.0] * capacity
+        self.close = [0.0] * capacity
+        self.volume = [0.0] * capacity
+
+    def __len__(self):
+        return self.size
+
+    def _physical(self, index: int) -> int:
+        return (self.head + index) % self.capacity
+
+    def last_open_time(self) -> Optional[int]:
+        if not self.size:
+            return None
+        return self.open_time[self._physical(self.size - 1)]
+
+    def merge(self, open_time: int, open_: float, high: float, low: float, close: float, volume: float):
+        """
+        Fold a candle or tick into the buffer: update the newest candle if it
+        has the same open_time, append if newer, ignore if older
+        """
+        last = self.last_open_time()
+        if last == open_time:
+            i = self._physical(self.size - 1)
+            if high > self.high[i]:
+                self.high[i] = high
+            if low < self.low[i]:
+                self.low[i] = low
+            self.close[i] = close
+            self.volume[i] += volume
+            return
+        if last is not None and open_time < last:
+            return
+
+        if self.size < self.capacity:
+            i = self._physical(self.size)
+            self.size += 1
+        else:
+            # Full, overwrite the oldest candle
+            i = self.head
+            self.head = (self.head + 1) % self.capacity
+        self.open_time[i] = open_time
+        self.open[i] = open_
+        self.high[i] = high
+        self.low[i] = low
+        self.close[i] = close
+        self.volume[i] = volume
+
+    def replace(self, open_time: int, open_: float, high: float, low: float, close: float, volume: float):
+        """
+        Overwrite the candle with this open_time (e.g. one built from ticks
+        with exchange data); append it if newer, ignore it if older
+        """
+        index = self._bisect_left(open_time)
+        if index < self.size and self.open_time[self._physical(index)] == open_time:
+            i = self._physical(index)
+            self.open[i] = open_
+            self.high[i] = high
+            self.low[i] = low
+            self.close[i] = close
+            self.volume[i] = volume
+            return
+        self.merge(open_time, open_, high, low, close, volume)
+
+    def _bisect_left(self, open_time: int) -> int:
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.open_time[self._physical(mid)] < open_time:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def range(self, start: Optional[int] = None, end: Optional[int] = None,
+              limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Candles with start <= open_time < end (seconds), oldest first; when
+        `limit` cuts the range, the most recent candles are kept
+        """
+        first = self._bisect_left(start) if start is not None else 0
+        last = self._bisect_left(end) if end is not None else self.size
+        if limit is not None and last - first > limit:
+            first = last - limit
+
+        candles = []
+        for index in range(first, last):
+            i = self._physical(index)
+            candles.append({
+                "open_time": self.open_time[i],
+                "open": self.open[i],
+                "high": self.high[i],
+                "low": self.low[i],
+                "close": self.close[i],
+                "volume": self.volume[i],
+            })
+        return candles
+
+
+class CandleStore:
+    """
+    In-memory OHLCV history per symbol at every supported resolution.
+    Ticks update the open candle of each resolution as they arrive.
+    """
+
+    def __init__(self):
+        self._rings: Dict[str, Dict[str, CandleRing]] = {}
+        self.backfilled: Dict[str, set] = {}
+        # open_time of the newest closed candle that holds exchange data;
+        # candles after it were built from ticks (no volume, and the first
+        # one starts partway through its bucket)
+        self.exact: Dict[str, Dict[str, int]] = {}
+
+    def rings(self, symbol: str) -> Dict[str, CandleRing]:
+        rings = self._rings.get(symbol)
+        if rings is None:
+            rings = self._rings[symbol] = {
+                resolution: CandleRing(CAPACITIES[resolution]) for resolution in RESOLUTIONS
+            }
+        return rings
+
+    def last_open_time(self, symbol: str, resolution: str) -> Optional[int]:
+        rings = self._rings.get(symbol)
+        if rings is None:
+            return None
+        return rings[resolution].last_open_time()
+
+    def add_tick(self, symbol: str, price: float, timestamp: float, quantity: float = 0.0):
+        """
+        Incrementally roll a trade/tick into every resolution
+        """
+        seconds = int(timestamp)
+        for resolution, ring in self.rings(symbol).items():
+            step = RESOLUTIONS[resolution]
+            ring.merge(seconds - seconds % step, price, price, price, price, quantity)
+
+    def add_klines(self, symbol: str, resolution: str, klines: List[list]):
+        """
+        Load Binance klines ([open_time_ms, o, h, l, c, v, ...]) into one
+        resolution; finer klines are merged into the matching bucket
+        """
+        self.load(symbol, resolution, _buckets(resolution, klines))
+
+    def update_klines(self, symbol: str, resolution: str, klines: List[list]):
+        """
+        Overwrite the newest candles of a resolution with Binance klines,
+        replacing the tick-built versions
+        """
+        candles = _buckets(resolution, klines)
+        ring = self.rings(symbol)[resolution]
+        for candle in candles:
+            ring.replace(*candle)
+        if candles:
+            self._mark_exact(symbol, resolution, candles[-1][0])
+
+    def exact_until(self, symbol: str, resolution: str) -> Optional[int]:
+        return self.exact.get(symbol, {}).get(resolution)
+
+    def _mark_exact(self, symbol: str, resolution: str, open_time: int):
+        # The bucket that is still open is never exact
+        now = int(time.time())
+        step = RESOLUTIONS[resolution]
+        self.exact.setdefault(symbol, {})[resolution] = min(open_time, now - now % step - step)
+
+    def load(self, symbol: str, resolution: str, candles: Iterable[tuple]):
+        """
+        Replace a resolution with exchange (open_time, o, h, l, c, v)
+        candles, oldest first. Newer candles built from live ticks are kept
+        on top.
+        """
+        rings = self.rings(symbol)
+        previous = rings[resolution]
+        ring = CandleRing(previous.capacity)
+        step = RESOLUTIONS[resolution]
+        for open_time, open_, high, low, close, volume in candles:
+            ring.merge(open_time - open_time % step, open_, high, low, close, volume)
+
+        last_loaded = ring.last_open_time()
+        newer = previous.range(start=last_loaded + 1) if last_loaded is not None else previous.range()
+        for candle in newer:
+            ring.merge(candle["open_time"], candle["open"], candle["high"],
+                       candle["low"], candle["close"], candle["volume"])
+
+        rings[resolution] = ring
+        self.backfilled.setdefault(symbol, set()).add(resolution)
+        if last_loaded is not None:
+            self._mark_exact(symbol, resolution, last_loaded)
+
+    def oldest_open_time(self, symbol: str, resolution: str) -> Optional[int]:
+        rings = self._rings.get(symbol)
+        if rings is None or not len(rings[resolution]):
+            return None
+        ring = rings[resolution]
+        return ring.open_time[ring.head]
+
+    def get(self, symbol: str, resolution: str, start: Optional[int] = None,
+            end: Optional[int] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        rings = self._rings.get(symbol)
+        if rings is None:
+            return []
+        return rings[resolution].range(start, end, limit)
+
+    def symbols(self) -> List[str]:
+        return list(self._rings.keys())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            symbol: {resolution: len(ring) for resolution, ring in rings.items()}
+            for symbol, rings in self._rings.items()
+        }
+
+
+def _buckets(resolution: str, klines: List[list]) -> List[list]:
+    """
+    Binance klines as [open_time, o, h, l, c, v] candles of `resolution`.
+    Finer klines are merged per bucket; leading klines that start partway
+    into a bucket are dropped so no candle is missing its first part.
+    """
+    step = RESOLUTIONS[resolution]
+    candles: List[list] = []
+    for kline in klines:
+        open_time = int(kline[0]) // 1000
+        bucket = open_time - open_time % step
+        open_, high, low, close, volume = (float(value) for value in kline[1:6])
+        if candles and candles[-1][0] == bucket:
+            candle = candles[-1]
+            candle[2] = max(candle[2], high)
+            candle[3] = min(candle[3], low)
+            candle[4] = close
+            candle[5] += volume
+        elif candles or bucket == open_time:
+            candles.append([bucket, open_, high, low, close, volume])
+    return candles
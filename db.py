@@ -0,0 +1,382 @@
+import asyncio
+import base64
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
+
+from supabase import Client
+
+# supabase-py is synchronous, so every PostgREST/auth round trip runs on
+# this bounded pool instead of blocking the event loop
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "16"))
+
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="supabase")
+_client: Optional[Client] = None
+
+
+def configure(client: Client):
+    """
+    Register the Supabase client used by the repository functions
+    """
+    global _client
+    _client = client
+
+
+def get_client() -> Client:
+    if _client is None:
+        raise RuntimeError("Supabase client not configured")
+    return _client
+
+
+async def run(fn: Callable, *args, **kwargs) -> Any:
+    """
+    Run a blocking Supabase call on the DB thread pool
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(_executor, partial(fn, *args, **kwargs))
+
+
+async def execute(query) -> Any:
+    """
+    Execute a prepared query builder on the DB thread pool
+    """
+    return await run(query.execute)
+
+
+def shutdown():
+    _executor.shutdown(wait=False)
+
+
+# Keyset pagination
+
+ORDER_COLUMNS = [
+    "id", "user_id", "symbol", "entry_price", "stop_loss", "take_profit",
+    "position_type", "status", "market_type", "is_public", "created_at", "updated_at",
+    "order_type", "trail_amount", "trail_percent", "trail_extreme"
+]
+HISTORY_COLUMNS = [
+    "id", "order_id", "user_id", "symbol", "entry_price", "stop_loss", "take_profit",
+    "position_type", "close_price", "profit_loss", "close_reason", "created_at", "closed_at"
+]
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(row: Dict[str, Any], time_column: str) -> str:
+    raw = f"{row[time_column]}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """
+    Return (timestamp, id) from a cursor, raising ValueError if it is invalid
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, row_id = raw.rsplit("|", 1)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not timestamp or not row_id:
+        raise ValueError("Invalid cursor")
+    parse_cursor_values(timestamp, row_id)
+    return timestamp, row_id
+
+
+def parse_cursor_values(timestamp: str, row_id: str):
+    """
+    Return the cursor position as (datetime, UUID), raising ValueError if
+    either part isn't one
+    """
+    try:
+        return datetime.fromisoformat(timestamp), uuid.UUID(row_id)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+
+def project(columns: Optional[List[str]], allowed: List[str], time_column: str) -> str:
+    """
+    Build the select list, always keeping the columns the cursor needs
+    """
+    if not columns:
+        columns = allowed
+    unknown = [column for column in columns if column not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    selected = list(dict.fromkeys(["id", time_column] + list(columns)))
+    return ",".join(selected)
+
+
+async def fetch_page(table: str, time_column: str, columns: str, filters: Dict[str, Any],
+                     limit: int, cursor: Optional[str] = None,
+                     start: Optional[str] = None, end: Optional[str] = None):
+    """
+    One page of rows ordered by (time_column, id) descending.
+
+    Returns (rows, next_cursor). The cursor condition is
+    (time < t) OR (time = t AND id < i), which PostgREST serves from an
+    index on (user_id, time_column, id) however deep the page is.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    query = get_client().table(table).select(columns)
+    for column, value in filters.items():
+        if value is not None:
+            query = query.eq(column, value)
+    if start:
+        query = query.gte(time_column, start)
+    if end:
+        query = query.lt(time_column, end)
+    if cursor:
+        # Rebuilt from the parsed values, so nothing from the client reaches the filter
+        parsed_time, parsed_id = parse_cursor_values(*decode_cursor(cursor))
+        timestamp, row_id = parsed_time.isoformat(), str(parsed_id)
+        query = query.or_(
+            f'{time_column}.lt."{timestamp}",'
+            f'and({time_column}.eq."{timestamp}",id.lt."{row_id}")'
+        )
+
+    # Fetch one extra row to know whether there is a next page
+    query = query.order(time_column, desc=True).order('id', desc=True).limit(limit + 1)
+    rows = (await execute(query)).data
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1], time_column)
+    return rows, next_cursor
+
+
+async def fetch_all(build_query: Callable[[], Any], batch_size: int = 1000) -> List[Dict[str, Any]]:
+    """
+    Every row a query matches, read in batches with range(); the query
+    must be ordered on a unique column for the batches to line up
+    """
+    rows: List[Dict[str, Any]] = []
+    while True:
+        batch = (await execute(build_query().range(len(rows), len(rows) + batch_size - 1))).data
+        rows.extend(batch)
+        if len(batch) < batch_size:
+            return rows
+
+
+# Users
+
+async def get_user(user_id: str) -> Optional[Dict[str, Any]]:
+    response = await execute(get_client().table('users').select('*').eq('id', user_id))
+    return response.data[0] if response.data else None
+
+
+async def get_users(user_ids: List[str]) -> List[Dict[str, Any]]:
+    if not user_ids:
+        return []
+    response = await execute(get_client().table('users').select('id').in_('id', user_ids))
+    return response.data
+
+
+async def get_nicknames(user_ids: List[str]) -> Dict[str, Optional[str]]:
+    if not user_ids:
+        return {}
+    response = await execute(get_client().table('users').select('id,nickname').in_('id', user_ids))
+    return {str(user["id"]): user.get("nickname") for user in response.data}
+
+
+async def list_users() -> List[Dict[str, Any]]:
+    response = await execute(get_client().table('users').select('*'))
+    return response.data
+
+
+async def insert_user(user: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    response = await execute(get_client().table('users').insert(user))
+    return response.data[0] if response.data else None
+
+
+async def insert_users(users: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    response = await execute(get_client().table('users').insert(users))
+    return response.data
+
+
+async def update_user(user_id: str, update_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    response = await execute(get_client().table('users').update(update_data).eq('id', user_id))
+    return response.data[0] if response.data else None
+
+
+# Orders
+
+async def get_order(order_id: str) -> Optional[Dict[str, Any]]:
+    response = await execute(get_client().table('orders').select('*').eq('id', order_id))
+    return response.data[0] if response.data else None
+
+
+async def list_orders(user_id: str, limit: int = 100, cursor: Optional[str] = None,
+                      symbol: Optional[str] = None, status: Optional[str] = None,
+                      start: Optional[str] = None, end: Optional[str] = None,
+                      fields: Optional[List[str]] = None):
+    """
+    A page of a user's orders, newest first. Returns (orders, next_cursor).
+    """
+    return await fetch_page(
+        'orders', 'created_at', project(fields, ORDER_COLUMNS, 'created_at'),
+        {"user_id": user_id, "symbol": symbol, "status": status},
+        limit, cursor, start, end
+    )
+
+
+async def list_open_orders() -> List[Dict[str, Any]]:
+    response = await execute(get_client().table('orders').select('*').eq('status', 'open'))
+    return response.data
+
+
+async def list_all_orders(batch_size: int = 1000) -> List[Dict[str, Any]]:
+    """
+    Every row of the orders table, read in id order in batches (PostgREST
+    caps a single response at its max-rows setting)
+    """
+    return await fetch_all(lambda: get_client().table('orders').select('*').order('id'), batch_size)
+
+
+async def list_open_orders_for_users(user_ids: List[str]) -> List[Dict[str, Any]]:
+    if not user_ids:
+        return []
+    response = await execute(get_client().table('orders').select('*').eq('status', 'open').in_('user_id', user_ids))
+    return response.data
+
+
+async def list_public_open_orders() -> List[Dict[str, Any]]:
+    response = await execute(get_client().table('orders').select('*').eq('status', 'open').eq('is_public', True))
+    return response.data
+
+
+async def insert_order(order: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    response = await execute(get_client().table('orders').insert(order))
+    return response.data[0] if response.data else None
+
+
+async def insert_orders(orders: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Multi-row insert, one round trip for the whole batch
+    """
+    response = await execute(get_client().table('orders').insert(orders))
+    return response.data
+
+
+async def upsert_order(order: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Insert an order, or overwrite the row with the same id (safe to repeat)
+    """
+    response = await execute(get_client().table('orders').upsert(order, on_conflict='id'))
+    return response.data[0] if response.data else None
+
+
+async def update_order(order_id: str, update_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    response = await execute(get_client().table('orders').update(update_data).eq('id', order_id))
+    return response.data[0] if response.data else None
+
+
+async def delete_order(order_id: str):
+    return await execute(get_client().table('orders').delete().eq('id', order_id))
+
+
+async def update_trail_extremes(extremes: Dict[str, float]) -> Any:
+    """
+    Store the running best price of trailing orders in one round trip
+    """
+    return await rpc('update_trail_extremes', {
+        "updates": [{"id": order_id, "trail_extreme": extreme} for order_id, extreme in extremes.items()]
+    })
+
+
+# Order history
+
+async def history_exists(order_id: str) -> bool:
+    response = await execute(get_client().table('order_history').select('id').eq('order_id', order_id).limit(1))
+    return bool(response.data)
+
+
+async def list_history(user_id: str, limit: int = 100, cursor: Optional[str] = None,
+                       symbol: Optional[str] = None, close_reason: Optional[str] = None,
+                       start: Optional[str] = None, end: Optional[str] = None,
+                       fields: Optional[List[str]] = None):
+    """
+    A page of a user's order history, most recently closed first.
+    Returns (history, next_cursor).
+    """
+    return await fetch_page(
+        'order_history', 'closed_at', project(fields, HISTORY_COLUMNS, 'closed_at'),
+        {"user_id": user_id, "symbol": symbol, "close_reason": close_reason},
+        limit, cursor, start, end
+    )
+
+
+async def list_history_since(since: str, batch_size: int = 1000) -> List[Dict[str, Any]]:
+    """
+    Every trade closed at or after `since` (id, user, P/L and close time)
+    """
+    return await fetch_all(
+        lambda: get_client().table('order_history')
+        .select('id,user_id,profit_loss,closed_at')
+        .gte('closed_at', since)
+        .order('id'),
+        batch_size
+    )
+
+
+async def close_order(order_id: str, close_price: float, close_reason: str = "manual",
+                      profit_loss: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """
+    Close an order with the close_order_transaction function: one
+    transactional round trip that returns the order_history row
+    """
+    data = await rpc('close_order_transaction', {
+        "order_id": str(order_id),
+        "close_price": close_price,
+        "profit_loss": profit_loss,
+        "close_reason": close_reason
+    })
+    if isinstance(data, list):
+        return data[0] if data else None
+    return data
+
+
+async def close_orders(closes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Close many orders in one transaction; orders that no longer exist are
+    skipped. Returns the order_history rows that were written.
+    """
+    data = await rpc('close_orders_transaction', {"closes": closes})
+    if isinstance(data, dict):
+        return [data]
+    return data or []
+
+
+# Analytics
+
+async def get_user_analytics(user_id: str) -> Optional[Dict[str, Any]]:
+    """
+    The user's user_analytics row (kept current by a trigger on order_history)
+    """
+    response = await execute(get_client().table('user_analytics').select('*').eq('user_id', user_id))
+    return response.data[0] if response.data else None
+
+
+async def list_analytics_totals(batch_size: int = 1000) -> List[Dict[str, Any]]:
+    """
+    All-time trade count, wins and P/L sum for every user
+    """
+    return await fetch_all(
+        lambda: get_client().table('user_analytics').select('user_id,trades,wins,pnl_sum').order('user_id'),
+        batch_size
+    )
+
+
+# Prices
+
+async def upsert_prices(rows: List[Dict[str, Any]]):
+    """
+    Multi-row upsert of {symbol, price, timestamp} rows, keyed by symbol
+    """
+    return await execute(get_client().table('prices').upsert(rows, on_conflict='symbol'))
+
+
+async def rpc(function: str, params: Dict[str, Any]) -> Any:
+    response = await execute(get_client().rpc(function, params))
+    return response.data
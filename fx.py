@@ -0,0 +1,85 @@
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import http_client
+
+OPEN_EXCHANGE_RATES_API_KEY = os.getenv("OPEN_EXCHANGE_RATES_API_KEY", "")
+FX_REFRESH_INTERVAL = float(os.getenv("FX_REFRESH_INTERVAL", "300"))
+
+
+class FxMatrix:
+    """
+    Full cross-rate matrix built from one USD-based rates snapshot.
+
+    rates[i] is units of currency i per USD, so the price of XXX in YYY is
+    rates[YYY] / rates[XXX]; the whole N x N matrix is one broadcast divide.
+    """
+
+    def __init__(self, usd_rates: Dict[str, float], timestamp: Optional[float] = None, source: str = ""):
+        rates = {"USD": 1.0, **{code.upper(): float(rate) for code, rate in usd_rates.items() if rate}}
+        self.currencies: List[str] = sorted(rates)
+        self.index: Dict[str, int] = {code: i for i, code in enumerate(self.currencies)}
+        self.rates = np.array([rates[code] for code in self.currencies], dtype=np.float64)
+        self.matrix = self.rates[np.newaxis, :] / self.rates[:, np.newaxis]
+        self.timestamp = timestamp or time.time()
+        self.source = source
+
+    def rate(self, base: str, quote: str) -> float:
+        return float(self.matrix[self.index[base.upper()], self.index[quote.upper()]])
+
+    def rates_for(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        """
+        Look up many pairs with one fancy-indexing gather
+        """
+        rows = np.fromiter((self.index[base] for base, _ in pairs), dtype=np.intp, count=len(pairs))
+        cols = np.fromiter((self.index[quote] for _, quote in pairs), dtype=np.intp, count=len(pairs))
+        return self.matrix[rows, cols]
+
+    def __contains__(self, currency: str) -> bool:
+        return currency.upper() in self.index
+
+
+def parse_pair(pair: str) -> Tuple[str, str]:
+    """
+    Accept EUR/USD, EUR-USD, EUR_USD or EURUSD
+    """
+    cleaned = pair.strip().upper()
+    for separator in ("/", "-", "_"):
+        if separator in cleaned:
+            base, _, quote = cleaned.partition(separator)
+            break
+    else:
+        if len(cleaned) != 6:
+            raise ValueError(f"Invalid currency pair: {pair}")
+        base, quote = cleaned[:3], cleaned[3:]
+    if len(base) != 3 or len(quote) != 3 or not base.isalpha() or not quote.isalpha():
+        raise ValueError(f"Invalid currency pair: {pair}")
+    return base, quote
+
+
+async def fetch_snapshot() -> FxMatrix:
+    """
+    Pull one USD-based rates snapshot and build the cross-rate matrix
+    """
+    if OPEN_EXCHANGE_RATES_API_KEY:
+        data = await http_client.get_json(
+            "https://openexchangerates.org/api/latest.json",
+            params={"app_id": OPEN_EXCHANGE_RATES_API_KEY, "base": "USD"}
+        )
+        return FxMatrix(data["rates"], data.get("timestamp"), "openexchangerates")
+
+    data = await http_client.get_json("https://open.er-api.com/v6/latest/USD")
+    if data.get("result") != "success":
+        raise http_client.UpstreamError(f"FX snapshot failed: {data.get('error-type', 'unknown error')}")
+    return FxMatrix(data["rates"], data.get("time_last_update_unix"), "exchangerate-api")
+
+
+def describe(matrix: FxMatrix) -> Dict[str, Any]:
+    return {
+        "currencies": len(matrix.currencies),
+        "source": matrix.source,
+        "timestamp": matrix.timestamp,
+    }
@@ -0,0 +1,205 @@
+import asyncio
+import os
+import random
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+import rate_limits
+from rate_limits import NORMAL, RateLimited
+
+# Connection pool settings, shared by every outbound market data call
+MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+
+# Timeouts (seconds)
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "5"))
+
+# Retry settings
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.2"))
+BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "2"))
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_client: Optional[httpx.AsyncClient] = None
+_host_limits: Dict[str, asyncio.Semaphore] = {}
+_inflight: Dict[tuple, "_SharedRequest"] = {}
+_merged = 0
+
+
+class UpstreamError(Exception):
+    """
+    Raised when an upstream request fails after all retries
+    """
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _SharedRequest:
+    __slots__ = ("task", "ticket", "waiters")
+
+    def __init__(self, task: asyncio.Task, ticket: Optional[rate_limits.Ticket]):
+        self.task = task
+        self.ticket = ticket
+        self.waiters = 0
+
+
+async def start():
+    """
+    Create the application-lifetime client (called on startup)
+    """
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            headers={"Accept": "application/json"},
+        )
+        print("HTTP client pool started")
+
+
+async def close():
+    """
+    Close the pooled client (called on shutdown)
+    """
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        print("HTTP client pool closed")
+
+
+def get_client() -> httpx.AsyncClient:
+    if _client is None:
+        raise RuntimeError("HTTP client not started")
+    return _client
+
+
+def _host_semaphore(url: str) -> asyncio.Semaphore:
+    host = urlsplit(url).netloc
+    semaphore = _host_limits.get(host)
+    if semaphore is None:
+        semaphore = _host_limits[host] = asyncio.Semaphore(MAX_CONNECTIONS_PER_HOST)
+    return semaphore
+
+
+def _backoff_delay(attempt: int, response: Optional[httpx.Response] = None) -> float:
+    # Honour Retry-After when the upstream tells us how long to wait
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), BACKOFF_MAX)
+    delay = min(BACKOFF_BASE * (2 ** attempt), BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1.0)
+
+
+async def request(method: str, url: str, priority: int = NORMAL,
+                  ticket: Optional[rate_limits.Ticket] = None, **kwargs) -> httpx.Response:
+    """
+    Send a request through the shared pool, retrying transient failures
+    with exponential backoff. 4xx responses (other than 429) are returned
+    to the caller as-is.
+
+    Requests to known providers first take tokens from the provider's
+    rate limiter, in `priority` order when the budget is short.
+    """
+    client = get_client()
+    semaphore = _host_semaphore(url)
+    limiter = rate_limits.limiter_for(url)
+    if ticket is None and limiter is not None:
+        ticket = limiter.ticket(url, kwargs.get("params"), priority)
+    last_error: Optional[Exception] = None
+
+    for attempt in range(MAX_RETRIES + 1):
+        response = None
+        try:
+            if limiter is not None:
+                await limiter.acquire(ticket)
+            async with semaphore:
+                response = await client.request(method, url, **kwargs)
+            if limiter is not None:
+                limiter.observe(response.status_code, response.headers)
+            if response.status_code not in RETRY_STATUS_CODES:
+                return response
+            last_error = UpstreamError(
+                f"{method} {url} returned {response.status_code}",
+                status_code=response.status_code,
+            )
+        except RateLimited as e:
+            raise UpstreamError(str(e), status_code=429)
+        except (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError) as e:
+            last_error = e
+
+        if attempt < MAX_RETRIES:
+            delay = _backoff_delay(attempt, response)
+            print(f"Retrying {method} {url} in {delay:.2f}s ({str(last_error)})")
+            await asyncio.sleep(delay)
+
+    if isinstance(last_error, UpstreamError):
+        raise last_error
+    raise UpstreamError(f"{method} {url} failed: {str(last_error)}")
+
+
+async def _get_json(url: str, params: Optional[Dict[str, Any]], ticket: Optional[rate_limits.Ticket]) -> Any:
+    response = await request("GET", url, ticket=ticket, params=params)
+    if response.status_code >= 400:
+        raise UpstreamError(
+            f"GET {url} returned {response.status_code}",
+            status_code=response.status_code,
+        )
+    return response.json()
+
+
+async def get_json(url: str, params: Optional[Dict[str, Any]] = None, priority: int = NORMAL) -> Any:
+    """
+    GET a JSON document, raising UpstreamError on non-2xx responses.
+
+    Identical GETs already queued or in flight are merged: callers share
+    one upstream request (and its result), which runs at the highest
+    priority of anyone waiting on it.
+    """
+    global _merged
+    key = (url, tuple(sorted((params or {}).items())))
+    shared = _inflight.get(key)
+    if shared is None:
+        limiter = rate_limits.limiter_for(url)
+        ticket = limiter.ticket(url, params, priority) if limiter is not None else None
+        shared = _inflight[key] = _SharedRequest(asyncio.ensure_future(_get_json(url, params, ticket)), ticket)
+
+        def release(_, done=shared):
+            if _inflight.get(key) is done:
+                del _inflight[key]
+        shared.task.add_done_callback(release)
+    else:
+        _merged += 1
+        if shared.ticket is not None:
+            shared.ticket.boost(priority)
+
+    shared.waiters += 1
+    try:
+        return await asyncio.shield(shared.task)
+    except asyncio.CancelledError:
+        # Only abandon the upstream call once nobody is waiting for it
+        if shared.waiters == 1 and not shared.task.done():
+            shared.task.cancel()
+        raise
+    finally:
+        shared.waiters -= 1
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "in_flight": len(_inflight),
+        "merged": _merged,
+        "providers": rate_limits.stats(),
+    }
@@ -0,0 +1,353 @@
+import asyncio
+import json
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+JOURNAL_ENABLED = os.getenv("JOURNAL_ENABLED", "true").lower() == "true"
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", os.path.join("data", "journal"))
+JOURNAL_SEGMENT_BYTES = int(os.getenv("JOURNAL_SEGMENT_BYTES", str(8 * 1024 * 1024)))
+JOURNAL_CHECKPOINT_EVERY = int(os.getenv("JOURNAL_CHECKPOINT_EVERY", "100"))
+JOURNAL_DRAIN_TIMEOUT = float(os.getenv("JOURNAL_DRAIN_TIMEOUT", "5"))
+
+# Record framing: payload length and CRC32, then the JSON payload
+_HEADER = struct.Struct("<II")
+_SEGMENT_PREFIX = "journal-"
+_SEGMENT_SUFFIX = ".log"
+
+
+class PermanentError(Exception):
+    """
+    Raised by an apply callback for an entry that can never succeed; the
+    entry is moved to the dead-letter file instead of being retried
+    """
+
+
+def _encode(entry: Dict[str, Any]) -> bytes:
+    payload = json.dumps(entry, separators=(",", ":"), default=str).encode()
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def fold(order: Optional[Dict[str, Any]], entries: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    An order as it looks after the given journal entries (oldest first);
+    None once it has been closed or deleted
+    """
+    for entry in entries:
+        if entry["op"] == "create":
+            order = dict(entry["data"])
+        elif entry["op"] == "update" and order is not None:
+            order = {**order, **entry["data"]}
+        elif entry["op"] in ("close", "delete"):
+            order = None
+    return order
+
+
+def read_segment(path: str) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Entries of a segment file and the offset just past the last intact
+    record (anything after it is a torn write)
+    """
+    entries: List[Dict[str, Any]] = []
+    with open(path, "rb") as handle:
+        data = handle.read()
+    offset = 0
+    while offset + _HEADER.size <= len(data):
+        length, checksum = _HEADER.unpack_from(data, offset)
+        payload = data[offset + _HEADER.size:offset + _HEADER.size + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            break
+        entries.append(json.loads(payload))
+        offset += _HEADER.size + length
+    return entries, offset
+
+
+class OrderJournal:
+    """
+    Append-only, fsynced local log of order mutations.
+
+    append() returns once the entry is on disk. Concurrent appends are
+    group-committed: whatever arrived while the previous fsync ran goes
+    out in a single write + fsync. A drainer replays entries in order
+    through `apply(entry)` (which must be idempotent), retrying with
+    backoff while the database is unavailable. Progress is checkpointed,
+    so entries not yet replayed are recovered on restart; segments that
+    have been fully replayed are deleted.
+    """
+
+    def __init__(self, directory: str, apply: Callable[[Dict[str, Any]], Awaitable[Any]],
+                 segment_bytes: int = JOURNAL_SEGMENT_BYTES, max_backoff: float = 30.0):
+        self.directory = directory
+        self.apply = apply
+        self.segment_bytes = segment_bytes
+        self.max_backoff = max_backoff
+        self.pending: Deque[Dict[str, Any]] = deque()
+        self._pending_by_order: Dict[str, List[Dict[str, Any]]] = {}
+        self.applied_seq = 0
+        self._next_seq = 1
+        self._segments: List[Tuple[int, str]] = []  # (first seq, path), oldest first
+        self._file = None
+        self._file_size = 0
+        self._buffer: List[Tuple[Dict[str, Any], bytes, asyncio.Future]] = []
+        self._commit_wake: Optional[asyncio.Event] = None
+        self._drain_wake: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._unsaved_checkpoint = 0
+        self.stats = {
+            "appended": 0,
+            "commits": 0,
+            "bytes_written": 0,
+            "applied": 0,
+            "apply_errors": 0,
+            "dead_lettered": 0,
+            "recovered": 0,
+        }
+
+    # Recovery
+
+    def _checkpoint_path(self) -> str:
+        return os.path.join(self.directory, "checkpoint")
+
+    def _segment_path(self, first_seq: int) -> str:
+        return os.path.join(self.directory, f"{_SEGMENT_PREFIX}{first_seq:020d}{_SEGMENT_SUFFIX}")
+
+    def open(self):
+        """
+        Load the checkpoint, re-read every segment (cutting off a torn last
+        record) and queue the entries that were never replayed
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(self._checkpoint_path()) as handle:
+                self.applied_seq = int(handle.read().strip() or 0)
+        except FileNotFoundError:
+            self.applied_seq = 0
+
+        names = sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX)
+        )
+        last_seq = self.applied_seq
+        for name in names:
+            path = os.path.join(self.directory, name)
+            entries, valid_bytes = read_segment(path)
+            if valid_bytes < os.path.getsize(path):
+                print(f"Journal: truncating torn record at {name}:{valid_bytes}")
+                with open(path, "r+b") as handle:
+                    handle.truncate(valid_bytes)
+            self._segments.append((int(name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)]), path))
+            for entry in entries:
+                last_seq = max(last_seq, entry["seq"])
+                if entry["seq"] > self.applied_seq:
+                    self._track(entry)
+        self._next_seq = last_seq + 1
+        self.stats["recovered"] = len(self.pending)
+
+        if self._segments and os.path.getsize(self._segments[-1][1]) < self.segment_bytes:
+            path = self._segments[-1][1]
+        else:
+            path = self._segment_path(self._next_seq)
+            self._segments.append((self._next_seq, path))
+        self._file = open(path, "ab")
+        self._file_size = self._file.tell()
+        self._collect_segments()
+        if self.pending:
+            print(f"Journal: recovered {len(self.pending)} unreplayed entries")
+
+    # Group commit
+
+    async def append(self, op: str, order_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Durably record one mutation; returns the entry once it is fsynced
+        """
+        if not self._tasks:
+            raise RuntimeError("Order journal is not running")
+        entry = {"seq": self._next_seq, "op": op, "order_id": str(order_id), "data": data, "ts": time.time()}
+        self._next_seq += 1
+        future = asyncio.get_running_loop().create_future()
+        self._buffer.append((entry, _encode(entry), future))
+        self._commit_wake.set()
+        await future
+        return entry
+
+    def _write(self, data: bytes, first_seq: int):
+        if self._file_size and self._file_size + len(data) > self.segment_bytes:
+            self._file.close()
+            path = self._segment_path(first_seq)
+            self._segments.append((first_seq, path))
+            self._file = open(path, "ab")
+            self._file_size = 0
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file_size += len(data)
+
+    async def _commit_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._commit_wake.wait()
+            self._commit_wake.clear()
+            batch, self._buffer = self._buffer, []
+            if not batch:
+                continue
+            data = b"".join(encoded for _, encoded, _ in batch)
+            try:
+                # One write and one fsync for the whole batch, off the event loop
+                await loop.run_in_executor(None, self._write, data, batch[0][0]["seq"])
+            except Exception as e:
+                print(f"Journal write failed: {str(e)}")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.stats["commits"] += 1
+            self.stats["appended"] += len(batch)
+            self.stats["bytes_written"] += len(data)
+            for entry, _, future in batch:
+                self._track(entry)
+                if not future.done():
+                    future.set_result(None)
+            self._drain_wake.set()
+
+    # Pending state
+
+    def _track(self, entry: Dict[str, Any]):
+        self.pending.append(entry)
+        self._pending_by_order.setdefault(entry["order_id"], []).append(entry)
+
+    def pending_for(self, order_id: str) -> List[Dict[str, Any]]:
+        """
+        Entries for one order that the database hasn't seen yet, oldest first
+        """
+        return self._pending_by_order.get(str(order_id), [])
+
+    def overlay(self, orders: List[Dict[str, Any]], entries: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """
+        A snapshot of the orders table with the pending entries (or the
+        given ones) applied on top
+        """
+        by_id = {str(order["id"]): order for order in orders}
+        for entry in (self.pending if entries is None else entries):
+            order = fold(by_id.get(entry["order_id"]), [entry])
+            if order is None:
+                by_id.pop(entry["order_id"], None)
+            else:
+                by_id[entry["order_id"]] = order
+        return list(by_id.values())
+
+    # Replay
+
+    def _save_checkpoint(self):
+        path = self._checkpoint_path()
+        with open(f"{path}.tmp", "w") as handle:
+            handle.write(str(self.applied_seq))
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(f"{path}.tmp", path)
+        self._unsaved_checkpoint = 0
+        self._collect_segments()
+
+    def _collect_segments(self):
+        # A segment is done once the next one starts at or before the
+        # first unreplayed entry; the active segment is always kept
+        while len(self._segments) > 1 and self._segments[1][0] <= self.applied_seq + 1:
+            _, path = self._segments.pop(0)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _dead_letter(self, entry: Dict[str, Any], error: Exception):
+        with open(os.path.join(self.directory, "dead-letter.jsonl"), "a") as handle:
+            handle.write(json.dumps({**entry, "error": str(error)}, default=str) + "\n")
+        self.stats["dead_lettered"] += 1
+        print(f"Journal: entry {entry['seq']} ({entry['op']} {entry['order_id']}) dead-lettered: {str(error)}")
+
+    def _advance(self, entry: Dict[str, Any]):
+        self.pending.popleft()
+        entries = self._pending_by_order[entry["order_id"]]
+        entries.pop(0)
+        if not entries:
+            del self._pending_by_order[entry["order_id"]]
+        self.applied_seq = entry["seq"]
+        self._unsaved_checkpoint += 1
+
+    async def drain_once(self) -> bool:
+        """
+        Replay the oldest pending entry; False if it failed and should be
+        retried later
+        """
+        entry = self.pending[0]
+        try:
+            await self.apply(entry)
+        except PermanentError as e:
+            self._dead_letter(entry, e)
+        except Exception as e:
+            self.stats["apply_errors"] += 1
+            print(f"Journal replay of entry {entry['seq']} failed: {str(e)}")
+            return False
+        else:
+            self.stats["applied"] += 1
+        self._advance(entry)
+        if self._unsaved_checkpoint >= JOURNAL_CHECKPOINT_EVERY or not self.pending:
+            await asyncio.get_running_loop().run_in_executor(None, self._save_checkpoint)
+        return True
+
+    async def _drain_loop(self):
+        backoff = 0.5
+        while True:
+            if not self.pending:
+                await self._drain_wake.wait()
+                self._drain_wake.clear()
+                continue
+            if await self.drain_once():
+                backoff = 0.5
+            else:
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def start(self):
+        if self._tasks:
+            return
+        if self._file is None:
+            self.open()
+        self._commit_wake = asyncio.Event()
+        self._drain_wake = asyncio.Event()
+        self._tasks.append(asyncio.ensure_future(self._commit_loop()))
+        self._tasks.append(asyncio.ensure_future(self._drain_loop()))
+
+    async def stop(self, drain_timeout: float = JOURNAL_DRAIN_TIMEOUT):
+        """
+        Give the drainer a moment to catch up, then stop; anything left is
+        replayed after the next start
+        """
+        if not self._tasks:
+            return
+        deadline = time.monotonic() + drain_timeout
+        while (self.pending or self._buffer) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for _, _, future in self._buffer:
+            if not future.done():
+                future.set_exception(RuntimeError("Order journal stopped before the entry was written"))
+        self._buffer = []
+        if self._unsaved_checkpoint:
+            self._save_checkpoint()
+        self._file.close()
+        self._file = None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "pending": len(self.pending),
+            "applied_seq": self.applied_seq,
+            "next_seq": self._next_seq,
+            "segments": len(self._segments),
+            "oldest_pending_age": round(time.time() - self.pending[0]["ts"], 3) if self.pending else None,
+        }
@@ -1,16 +1,45 @@
-from fastapi import FastAPI, Request, HTTPException, Depends, Form, BackgroundTasks
+from fastapi import FastAPI, Request, HTTPException, Depends, Form, BackgroundTasks, WebSocket, WebSocketDisconnect
 from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from supabase import create_client, Client
 from dotenv import load_dotenv
 import os
+import asyncio
 from datetime import datetime
 from typing import Optional, List, Dict, Any
-import requests
 import uuid
 import stripe
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from market_cache import MarketDataCache
+import http_client
+import db
+import json
+from sltp_engine import SLTPEngine, calculate_profit_loss
+import sltp_engine
+from price_stream import PriceBoard, PriceIngestor, ReplaySource, create_source, PRICE_REPLAY_LOOP
+from pubsub import Hub
+import auth_cache
+from auth_cache import AuthenticatedUser, TokenError
+from candles import CandleStore, RESOLUTIONS, BACKFILL_INTERVALS, CAPACITIES
+import price_history
+from price_history import PriceHistoryStore
+from price_sources import PriceAggregator, PriceUnavailable, SymbolNotFound, default_sources
+import fx
+import symbol_registry
+import rate_limits
+from price_persister import PricePersister
+import order_store
+from portfolio import PositionBatch
+import backtest
+import analytics
+from order_store import OrderMirror, OrderMirrorSync, RealtimeChanges
+import leaderboard
+from leaderboard import Leaderboard, LeaderboardSync
+import price_persister
+import time
+import journal
+from journal import OrderJournal, PermanentError
 
 # Load environment variables
 load_dotenv()
@@ -72,6 +101,7 @@ try:
         raise ValueError("Supabase service key appears to be invalid (too short)")
         
     supabase = create_client(supabase_url, supabase_service_key)
+    db.configure(supabase)
     
     # Test the connection with a simple query
     test = supabase.table('users').select("count").limit(1).execute()
@@ -93,17 +123,28 @@ except Exception as e:
     print(f"Supabase Error: {str(e)}")
     raise HTTPException(status_code=500, detail=f"Database connection failed: {str(e)}")
 
+BINANCE_API_URL = os.getenv("BINANCE_API_URL", "https://api.binance.com/api/v3")
+
+@app.on_event("startup")
+async def startup_http_client():
+    # One pooled client for all outbound market data calls
+    await http_client.start()
+
+@app.on_event("shutdown")
+async def shutdown_http_client():
+    await http_client.close()
+
 # Add this to your startup code to verify the connection
 @app.on_event("startup")
 async def startup_db_client():
     try:
         # Test the connection with a simple query
-        test = supabase.table('orders').select("count").limit(1).execute()
+        test = await db.execute(supabase.table('orders').select("count").limit(1))
         print("Supabase orders table connection successful!")
         
         # Test order_history table
         try:
-            test_history = supabase.table('order_history').select("count").limit(1).execute()
+            test_history = await db.execute(supabase.table('order_history').select("count").limit(1))
             print("Supabase order_history table connection successful!")
         except Exception as e:
             print(f"WARNING: order_history table may not exist: {str(e)}")
@@ -113,6 +154,37 @@ async def startup_db_client():
     except Exception as e:
         print(f"ERROR: Database connection failed: {str(e)}")
 
+# Exchange symbols, used to normalize order/request symbols to Binance pairs
+exchange_symbols = symbol_registry.SymbolRegistry()
+
+# Price sources for single-symbol lookups, queried with hedged requests
+price_aggregator = PriceAggregator(default_sources(BINANCE_API_URL, exchange_symbols.normalize))
+
+# Shared market data cache for the price endpoints
+market_cache = MarketDataCache(
+    ttl=float(os.getenv("MARKET_CACHE_TTL", "5")),
+    stale_ttl=float(os.getenv("MARKET_CACHE_STALE_TTL", "60"))
+)
+
+async def load_exchange_symbols() -> symbol_registry.SymbolRegistry:
+    exchange_symbols.load(await symbol_registry.fetch_exchange_info(BINANCE_API_URL))
+    print(f"Loaded {len(exchange_symbols.symbols)} exchange symbols")
+    return exchange_symbols
+
+async def ensure_exchange_symbols():
+    """
+    Load exchange info once per SYMBOL_REFRESH_INTERVAL; until it loads,
+    symbols are resolved against the default quote asset
+    """
+    try:
+        await market_cache.get("exchange-info", load_exchange_symbols, ttl=symbol_registry.SYMBOL_REFRESH_INTERVAL)
+    except Exception as e:
+        print(f"Error loading exchange info: {str(e)}")
+
+@app.on_event("startup")
+async def startup_exchange_symbols():
+    await ensure_exchange_symbols()
+
 # Initialize Stripe
 stripe.api_key = os.environ.get("STRIPE_SECRET_KEY")
 STRIPE_WEBHOOK_SECRET = os.environ.get("STRIPE_WEBHOOK_SECRET")
@@ -126,17 +198,38 @@ class OrderCreate(BaseModel):
     user_id: str
     symbol: str
     entry_price: float
-    stop_loss: float
-    take_profit: float
+    stop_loss: Optional[float] = None
+    take_profit: Optional[float] = None
     position_type: Optional[str] = "long"  # Default to long
+    order_type: Optional[str] = "fixed"  # fixed, trailing_stop or oco
+    trail_amount: Optional[float] = None
+    trail_percent: Optional[float] = None
+
+class BulkOrderCreate(BaseModel):
+    # Items are validated one by one so a bad item doesn't reject the batch
+    orders: List[Dict[str, Any]]
+
+class BacktestRequest(BaseModel):
+    symbol: str
+    position_type: str = "long"
+    entry_price: float
+    # One level or a grid; every stop_loss is paired with every take_profit
+    stop_loss: List[float]
+    take_profit: List[float]
+    interval: str = "1h"
+    horizon: int = 168       # candles an order is given to hit a level
+    lookback: int = 5000     # candles of history to replay
 
 class OrderResponse(BaseModel):
     id: str
     user_id: str
     symbol: str
     entry_price: float
-    stop_loss: float
-    take_profit: float
+    stop_loss: Optional[float] = None
+    take_profit: Optional[float] = None
+    order_type: Optional[str] = "fixed"
+    trail_amount: Optional[float] = None
+    trail_percent: Optional[float] = None
     created_at: datetime
 
 class SubscriptionRequest(BaseModel):
@@ -166,12 +259,26 @@ async def get_current_user(request: Request):
             headers={"WWW-Authenticate": "Bearer"}
         )
     
-    token = auth_header.split(" ")[1]
+    return await authenticate_token(auth_header.split(" ")[1])
+
+async def authenticate_token(token: str):
+    """Verify a bearer token and return its user"""
+    # Tokens we've already verified are served from the cache
+    cached_user = auth_cache.token_cache.get(token)
+    if cached_user is not None:
+        return cached_user
     
     try:
-        # Verify token with Supabase
-        user_response = supabase.auth.get_user(token)
-        user = user_response.user
+        if auth_cache.can_verify_locally(token):
+            # Verify the signature locally, no round trip to the auth server
+            claims = auth_cache.verify_hs256(token, auth_cache.SUPABASE_JWT_SECRET)
+            user = AuthenticatedUser(claims)
+        else:
+            # Verify token with Supabase
+            user_response = await db.run(supabase.auth.get_user, token)
+            user = user_response.user
+            if user:
+                claims = auth_cache.decode_unverified(token)[1]
         
         if not user:
             raise HTTPException(
@@ -179,9 +286,19 @@ async def get_current_user(request: Request):
                 detail="Invalid authentication token",
                 headers={"WWW-Authenticate": "Bearer"}
             )
-            
+        
+        auth_cache.token_cache.put(token, user, float(claims["exp"]), str(user.id))
         return user
         
+    except HTTPException:
+        raise
+    except TokenError as e:
+        print(f"Authentication error: {str(e)}")
+        raise HTTPException(
+            status_code=401, 
+            detail="Invalid authentication token",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
     except Exception as e:
         print(f"Authentication error: {str(e)}")
         raise HTTPException(
@@ -190,6 +307,32 @@ async def get_current_user(request: Request):
             headers={"WWW-Authenticate": "Bearer"}
         )
 
+@app.post("/auth/logout", tags=["auth"])
+async def logout(request: Request, current_user = Depends(get_current_user)):
+    """
+    Evict the caller's token from the verified token cache
+    """
+    token = request.headers["Authorization"].split(" ")[1]
+    auth_cache.revoke_token(token)
+    return {"message": "Logged out"}
+
+@app.post("/auth/revoke/{user_id}", tags=["auth"])
+async def revoke_user_tokens(user_id: str, current_user = Depends(get_current_user)):
+    """
+    Evict every cached token of the caller, signing out all sessions
+    """
+    if str(current_user.id) != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to revoke this user's tokens")
+    auth_cache.revoke_user(user_id)
+    return {"message": "Tokens revoked"}
+
+@app.get("/auth/cache-stats", tags=["auth"])
+async def get_auth_cache_stats():
+    """
+    Hit/miss counters for the verified token cache
+    """
+    return auth_cache.token_cache.status()
+
 @app.get("/", tags=["home"])
 async def home():
     """
@@ -209,12 +352,12 @@ async def test_db():
     """
     try:
         # Get all users from the table
-        response = supabase.table('users').select("*").execute()
-        print(f"Found users: {response.data}")  # Debug print
+        users = await db.list_users()
+        print(f"Found users: {users}")  # Debug print
         return {
             "message": "Database connection successful!",
-            "user_count": len(response.data),
-            "users": response.data
+            "user_count": len(users),
+            "users": users
         }
     except Exception as e:
         print(f"Database error: {str(e)}")  # Debug print
@@ -229,7 +372,7 @@ async def signup(user: UserCreate):
         print(f"Attempting to create user with email: {user.email}")
         
         # Use Supabase auth client for signup
-        auth_response = supabase.auth.sign_up({
+        auth_response = await db.run(supabase.auth.sign_up, {
             "email": user.email,
             "password": user.password
         })
@@ -242,7 +385,7 @@ async def signup(user: UserCreate):
                 "created_at": datetime.now().isoformat()
             }
             
-            supabase.table('users').insert(profile_data).execute()
+            await db.insert_user(profile_data)
             
             return {
                 "message": "User registered successfully",
@@ -263,7 +406,7 @@ async def login(email: str = Form(...), password: str = Form(...)):
         print(f"Login attempt for email: {email}")
         
         # Use Supabase auth client for login
-        auth_response = supabase.auth.sign_in_with_password({
+        auth_response = await db.run(supabase.auth.sign_in_with_password, {
             "email": email,
             "password": password
         })
@@ -288,53 +431,56 @@ async def login(email: str = Form(...), password: str = Form(...)):
 
 # Live data endpoint
 @app.get("/price/{symbol}", tags=["crypto"])
-def get_price(symbol: str):
+async def get_price(symbol: str):
     """
     Get live price for a crypto symbol (e.g., BTC, ETH)
     """
-    # Mock data for now
-    prices = {
-        "BTC": 45000,
-        "ETH": 2500
-    }
-    return {"symbol": symbol, "price": prices.get(symbol, 0)}
+    return await get_current_price(symbol)
+
+async def fetch_24hr_stats(keys: List[str]) -> Dict[str, dict]:
+    """
+    Fetch 24hr ticker stats from Binance for the given cache keys only
+    """
+    symbols = [key.split(":", 1)[1] for key in keys]
+    print(f"Fetching 24hr stats from Binance for: {symbols}")
+    stats = await http_client.get_json(
+        f"{BINANCE_API_URL}/ticker/24hr",
+        params={"symbols": json.dumps(symbols, separators=(",", ":"))}
+    )
+    return {f"24hr:{item['symbol']}": item for item in stats}
 
 @app.get("/top-cryptos", tags=["crypto"])
-async def get_top_cryptos() -> List[dict]:
+async def get_top_cryptos(symbols: Optional[str] = None) -> List[dict]:
     """
-    Get top cryptocurrencies from Binance
+    Get 24hr stats from Binance for the watchlist, or for ?symbols=BTC,ETH,...
     """
     try:
-        print("Fetching crypto data from Binance...")
+        await ensure_exchange_symbols()
+        requested = [symbol for symbol in symbols.split(",") if symbol.strip()] if symbols else None
+        wanted_symbols = exchange_symbols.resolve_watchlist(requested)
+        if not wanted_symbols:
+            return []
         
-        # Get ticker prices
-        price_response = requests.get('https://api.binance.com/api/v3/ticker/price')
+        # Served from the market cache, only misses go to Binance
+        stats = await market_cache.get_many(
+            [f"24hr:{symbol}" for symbol in wanted_symbols],
+            fetch_24hr_stats
+        )
         
-        # Get 24hr stats
-        stats_response = requests.get('https://api.binance.com/api/v3/ticker/24hr')
+        formatted_data = []
+        for symbol in wanted_symbols:
+            stat = stats.get(f"24hr:{symbol}")
+            if stat:
+                formatted_data.append({
+                    'symbol': exchange_symbols.base_of(symbol),
+                    'price': float(stat['lastPrice']),
+                    'change_24h': float(stat['priceChangePercent']),
+                    'volume': float(stat['volume']),
+                    'high_24h': float(stat['highPrice']),
+                    'low_24h': float(stat['lowPrice'])
+                })
         
-        if price_response.status_code == 200 and stats_response.status_code == 200:
-            prices = {item['symbol']: float(item['price']) for item in price_response.json()}
-            stats = stats_response.json()
-            
-            # Filter for specific pairs we want (BTC, ETH, BNB, SOL)
-            wanted_symbols = ['BTCUSDT', 'ETHUSDT', 'BNBUSDT', 'SOLUSDT']
-            
-            formatted_data = []
-            for symbol in wanted_symbols:
-                stat = next((item for item in stats if item['symbol'] == symbol), None)
-                if stat:
-                    formatted_data.append({
-                        'symbol': symbol.replace('USDT', ''),
-                        'price': float(stat['lastPrice']),
-                        'change_24h': float(stat['priceChangePercent']),
-                        'volume': float(stat['volume']),
-                        'high_24h': float(stat['highPrice']),
-                        'low_24h': float(stat['lowPrice'])
-                    })
-            
-            print(f"Successfully fetched {len(formatted_data)} crypto pairs")
-            return formatted_data
+        return formatted_data
             
     except Exception as e:
         print(f"Error fetching crypto data: {str(e)}")
@@ -343,6 +489,50 @@ async def get_top_cryptos() -> List[dict]:
             detail=f"Failed to fetch crypto data: {str(e)}"
         )
 
+def placeholder_user(user_id: str, email: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Users row for an id we haven't seen yet
+    """
+    return {
+        "id": user_id,
+        "email": email or f"user_{user_id}@example.com",  # Placeholder
+        "password": "placeholder_password",  # Add a placeholder password
+        "created_at": datetime.now().isoformat(),
+        "updated_at": datetime.now().isoformat()
+    }
+
+def build_order_record(order: OrderCreate) -> Dict[str, Any]:
+    record = {
+        "id": str(uuid.uuid4()),
+        "user_id": order.user_id,
+        "symbol": order.symbol,
+        "entry_price": order.entry_price,
+        "stop_loss": order.stop_loss,
+        "take_profit": order.take_profit,
+        "position_type": order.position_type,  # Add position type
+        "status": "open",
+        "created_at": datetime.now().isoformat()
+    }
+    kind = sltp_engine.order_type({"order_type": order.order_type})
+    if kind != "fixed":
+        # Only sent for the new order types, so fixed orders don't depend
+        # on the trailing-order columns
+        record.update({
+            "order_type": kind,
+            "trail_amount": order.trail_amount,
+            "trail_percent": order.trail_percent,
+            # Running best price, advanced by the SL/TP engine
+            "trail_extreme": order.entry_price,
+        })
+    return record
+
+def order_created(order: Dict[str, Any]):
+    """
+    Bookkeeping after a new order has been written
+    """
+    order_mirror.upsert(order)
+    publish_order_event(order["id"], "open", order=order)
+
 @app.post("/orders", response_model=OrderResponse, tags=["orders"])
 async def create_order(order: OrderCreate):
     """
@@ -351,61 +541,53 @@ async def create_order(order: OrderCreate):
     try:
         print(f"Received order request: {order}")
         
+        invalid = sltp_engine.validate_order(order.dict())
+        if invalid:
+            raise HTTPException(status_code=400, detail=invalid)
+        
+        if journal.JOURNAL_ENABLED:
+            # Durable once journaled; the drainer creates a missing user
+            # and writes the row
+            new_order = build_order_record(order)
+            await order_journal.append("create", new_order["id"], new_order)
+            order_created(new_order)
+            return new_order
+        
         # Validate the user exists
-        user_response = supabase.table('users')\
-            .select('*')\
-            .eq('id', order.user_id)\
-            .execute()
+        existing_user = await db.get_user(order.user_id)
             
-        print(f"User lookup response: {user_response}")
+        print(f"User lookup response: {existing_user}")
             
-        if not user_response.data:
+        if not existing_user:
             # Try to create the user if it doesn't exist
             try:
                 print(f"User not found, attempting to create: {order.user_id}")
-                new_user = {
-                    "id": order.user_id,
-                    "email": f"user_{order.user_id}@example.com",  # Placeholder
-                    "password": "placeholder_password",  # Add a placeholder password
-                    "created_at": datetime.now().isoformat(),
-                    "updated_at": datetime.now().isoformat()
-                }
-                
-                user_insert = supabase.table('users').insert(new_user).execute()
+                user_insert = await db.insert_user(placeholder_user(order.user_id))
                 print(f"User creation response: {user_insert}")
             except Exception as user_error:
                 print(f"Failed to create user: {str(user_error)}")
                 raise HTTPException(status_code=404, detail=f"User not found and could not be created: {str(user_error)}")
 
         # Create new order
-        new_order = {
-            "id": str(uuid.uuid4()),
-            "user_id": order.user_id,
-            "symbol": order.symbol,
-            "entry_price": order.entry_price,
-            "stop_loss": order.stop_loss,
-            "take_profit": order.take_profit,
-            "position_type": order.position_type,  # Add position type
-            "status": "open",
-            "created_at": datetime.now().isoformat()
-        }
+        new_order = build_order_record(order)
         
         print(f"Creating order with data: {new_order}")
         
         try:
-            response = supabase.table('orders')\
-                .insert(new_order)\
-                .execute()
+            created_order = await db.insert_order(new_order)
                 
-            print(f"Order creation response: {response}")
+            print(f"Order creation response: {created_order}")
             
-            if not response.data:
+            if not created_order:
                 raise HTTPException(
                     status_code=400, 
                     detail="Failed to create order in database"
                 )
                 
-            return response.data[0]
+            order_created(created_order)
+            return created_order
+        except HTTPException:
+            raise
         except Exception as insert_error:
             print(f"Order insert error: {str(insert_error)}")
             # Try to get more detailed error information
@@ -420,21 +602,116 @@ async def create_order(order: OrderCreate):
         print(f"Error creating order: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/orders/bulk", tags=["orders"])
+async def create_orders(bulk: BulkOrderCreate):
+    """
+    Create many orders at once.
+
+    Users are resolved with one lookup and all valid orders are written
+    with one multi-row insert. Returns a result per submitted item.
+    """
+    try:
+        results: List[Dict[str, Any]] = [None] * len(bulk.orders)
+        valid: List[tuple] = []
+        
+        for index, item in enumerate(bulk.orders):
+            try:
+                order = OrderCreate(**item)
+            except (ValidationError, TypeError) as e:
+                results[index] = {"index": index, "status": "error", "detail": str(e)}
+                continue
+            if order.entry_price <= 0:
+                results[index] = {"index": index, "status": "error", "detail": "entry_price must be positive"}
+                continue
+            invalid = sltp_engine.validate_order(order.dict())
+            if invalid:
+                results[index] = {"index": index, "status": "error", "detail": invalid}
+                continue
+            valid.append((index, order))
+        
+        if valid and journal.JOURNAL_ENABLED:
+            # Appended concurrently, so the batch shares one journal fsync
+            records = [build_order_record(order) for _, order in valid]
+            await asyncio.gather(*(order_journal.append("create", record["id"], record) for record in records))
+            for (index, _), record in zip(valid, records):
+                order_created(record)
+                results[index] = {"index": index, "status": "created", "order": record}
+        elif valid:
+            # Resolve every user once, creating any that are missing
+            user_ids = sorted({order.user_id for _, order in valid})
+            existing_ids = {user["id"] for user in await db.get_users(user_ids)}
+            missing_ids = [user_id for user_id in user_ids if user_id not in existing_ids]
+            if missing_ids:
+                print(f"Creating {len(missing_ids)} missing users for bulk order")
+                await db.insert_users([placeholder_user(user_id) for user_id in missing_ids])
+            
+            records = [build_order_record(order) for _, order in valid]
+            if any("order_type" in record for record in records):
+                # PostgREST wants the same keys on every row of a multi-row insert
+                for record in records:
+                    record.setdefault("order_type", "fixed")
+                    for field in ("trail_amount", "trail_percent", "trail_extreme"):
+                        record.setdefault(field, None)
+            created_orders = {str(order["id"]): order for order in await db.insert_orders(records)}
+            
+            for (index, _), record in zip(valid, records):
+                created = created_orders.get(record["id"])
+                if created:
+                    order_created(created)
+                    results[index] = {"index": index, "status": "created", "order": created}
+                else:
+                    results[index] = {"index": index, "status": "error", "detail": "Order was not returned by the database"}
+        
+        created_count = sum(1 for result in results if result["status"] == "created")
+        print(f"Bulk order: created {created_count} of {len(results)}")
+        return {"created": created_count, "failed": len(results) - created_count, "results": results}
+        
+    except Exception as e:
+        print(f"Error creating orders: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Bulk order creation failed: {str(e)}")
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    # Comma separated column list, e.g. ?fields=symbol,entry_price
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(",") if field.strip()]
+
 @app.get("/orders/{user_id}", tags=["orders"])
-async def get_user_orders(user_id: str):
+async def get_user_orders(
+    user_id: str,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    symbol: Optional[str] = None,
+    status: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    fields: Optional[str] = None
+):
     """
-    Get all orders for a specific user
+    Get orders for a specific user, newest first.
+
+    Paginate by passing the returned next_cursor back as ?cursor=.
+    Filter with symbol, status and a created_at range (start inclusive,
+    end exclusive); pick columns with ?fields=a,b,c.
     """
     try:
         print(f"Fetching orders for user: {user_id}")
-        response = supabase.table('orders')\
-            .select("*")\
-            .eq('user_id', user_id)\
-            .execute()
+        if order_mirror.ready and not start and not end:
+            orders, next_cursor = order_mirror.page(
+                user_id, limit=limit, cursor=cursor, symbol=symbol, status=status,
+                fields=parse_fields(fields)
+            )
+        else:
+            orders, next_cursor = await db.list_orders(
+                user_id, limit=limit, cursor=cursor, symbol=symbol, status=status,
+                start=start, end=end, fields=parse_fields(fields)
+            )
 
-        print(f"Found orders: {response.data}")
-        return {"orders": response.data}
+        print(f"Found {len(orders)} orders")
+        return {"orders": orders, "next_cursor": next_cursor}
         
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
         print(f"Error fetching orders: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -442,27 +719,875 @@ async def get_user_orders(user_id: str):
 @app.get("/current-price/{symbol}", tags=["market"])
 async def get_current_price(symbol: str):
     """
-    Get current price for a symbol from Binance
+    Get current price for a symbol, from the fastest healthy price source
     """
     try:
         # Convert symbol to Binance format
-        binance_symbol = f"{symbol}USDT"
+        binance_symbol = exchange_symbols.normalize(symbol)
         
-        # Get real-time price from Binance
-        response = requests.get(f'https://api.binance.com/api/v3/ticker/price?symbol={binance_symbol}')
+        async def fetch_price():
+            base = exchange_symbols.base_of(binance_symbol)
+            if exchange_symbols.normalize(base) != binance_symbol:
+                # Not a default-quote pair (e.g. ETHBTC): the other sources
+                # only quote the base in USD, so ask Binance for the pair
+                prices = await fetch_binance_prices([binance_symbol], priority=rate_limits.NORMAL)
+                return prices.get(binance_symbol)
+            # Hedged across Binance, Coinbase, Kraken and CoinCap
+            try:
+                result = await price_aggregator.get_price(base)
+            except SymbolNotFound:
+                return None
+            return result["price"]
         
-        if response.status_code == 200:
-            data = response.json()
-            return {
-                "symbol": symbol,
-                "price": float(data['price'])
-            }
-        else:
+        price = await market_cache.get(f"price:{binance_symbol}", fetch_price)
+        
+        if price is None:
             raise HTTPException(status_code=404, detail="Symbol not found")
             
+        return {
+            "symbol": symbol,
+            "price": price
+        }
+            
+    except HTTPException:
+        raise
+    except PriceUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def get_fx_matrix() -> fx.FxMatrix:
+    """
+    Current cross-rate matrix; refreshed from one rates snapshot per FX_REFRESH_INTERVAL
+    """
+    return await market_cache.get("fx:snapshot", fx.fetch_snapshot, ttl=fx.FX_REFRESH_INTERVAL)
+
+@app.get("/fx/rates", tags=["forex"])
+async def get_fx_rates(pairs: str):
+    """
+    Cross rates for many pairs at once, e.g. ?pairs=EUR/USD,GBP/JPY,AUDCAD
+    """
+    try:
+        requested = [pair for pair in pairs.split(",") if pair.strip()]
+        parsed = [fx.parse_pair(pair) for pair in requested]
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    
+    try:
+        matrix = await get_fx_matrix()
+    except Exception as e:
+        print(f"Error fetching FX rates: {str(e)}")
+        raise HTTPException(status_code=503, detail=f"FX rates unavailable: {str(e)}")
+    
+    unknown = sorted({code for pair in parsed for code in pair if code not in matrix})
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Unknown currencies: {', '.join(unknown)}")
+    
+    values = matrix.rates_for(parsed)
+    return {
+        "rates": {f"{base}/{quote}": float(rate) for (base, quote), rate in zip(parsed, values)},
+        **fx.describe(matrix)
+    }
+
+@app.get("/fx/{base}/{quote}", tags=["forex"])
+async def get_fx_rate(base: str, quote: str):
+    """
+    Cross rate for a single pair, e.g. /fx/EUR/JPY
+    """
+    result = await get_fx_rates(f"{base}/{quote}")
+    return {
+        "pair": f"{base.upper()}/{quote.upper()}",
+        "rate": result["rates"][f"{base.upper()}/{quote.upper()}"],
+        "source": result["source"],
+        "timestamp": result["timestamp"]
+    }
+
+@app.get("/market/sources", tags=["market"])
+async def get_price_source_stats():
+    """
+    Per-source latency and error statistics used to route price requests
+    """
+    return price_aggregator.stats()
+
+@app.get("/market/symbols", tags=["market"])
+async def get_symbol_registry_stats():
+    """
+    Exchange symbol registry status and the configured watchlist
+    """
+    return exchange_symbols.stats()
+
+@app.get("/market/symbols/{symbol}", tags=["market"])
+async def resolve_symbol(symbol: str):
+    """
+    Resolve BTC, BTCUSDT, BTC/USDT, ... to the exchange pair
+    """
+    await ensure_exchange_symbols()
+    info = exchange_symbols.info(symbol)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Symbol not found")
+    return info._asdict()
+
+@app.get("/market/rate-limits", tags=["market"])
+async def get_rate_limit_stats():
+    """
+    Outbound request budgets per provider, queued and merged requests
+    """
+    return http_client.stats()
+
+@app.get("/market/cache-stats", tags=["market"])
+async def get_market_cache_stats():
+    """
+    Hit/miss counters for the market data cache
+    """
+    return market_cache.stats()
+
+def engine_symbol_key(order: Dict[str, Any]) -> Optional[str]:
+    # Only crypto orders can be priced from Binance
+    if (order.get("market_type") or "crypto") != "crypto" or not order.get("symbol"):
+        return None
+    return exchange_symbols.normalize(order["symbol"])
+
+# Server-push channel for price and order-status updates
+push_hub = Hub()
+
+def publish_price(symbol: str, price: float):
+    push_hub.publish(f"price:{symbol}", {
+        "symbol": symbol,
+        "price": price,
+        "timestamp": datetime.now().isoformat()
+    })
+
+def publish_order_event(order_id: str, status: str, **fields):
+    push_hub.publish(f"order:{order_id}", {
+        "order_id": str(order_id),
+        "status": status,
+        "timestamp": datetime.now().isoformat(),
+        **fields
+    })
+
+async def fetch_binance_prices(symbols: List[str], priority: int = rate_limits.HIGH) -> Dict[str, float]:
+    """
+    Fetch last prices for many Binance symbols in one request
+    """
+    # One unlisted symbol would fail the whole batch
+    symbols = [symbol for symbol in symbols if exchange_symbols.is_listed(symbol)]
+    if not symbols:
+        return {}
+    # Defaults to HIGH: SL/TP monitoring goes ahead of UI traffic when the
+    # Binance budget is short
+    data = await http_client.get_json(
+        f"{BINANCE_API_URL}/ticker/price",
+        params={"symbols": json.dumps(symbols, separators=(",", ":"))},
+        priority=priority
+    )
+    prices = {item['symbol']: float(item['price']) for item in data}
+    for symbol, price in prices.items():
+        market_cache.set(f"price:{symbol}", price)
+        persist_price(symbol, price)
+        publish_price(symbol, price)
+    return prices
+
+async def close_order_transaction(order: Dict[str, Any], close_price: float, close_reason: str):
+    """
+    Close an order atomically through the close_order_transaction function
+    """
+    profit_loss = calculate_profit_loss(order, close_price)
+    if journal.JOURNAL_ENABLED:
+        history = await journal_close(order, close_price, close_reason, round(profit_loss, 2))
+    else:
+        history = await db.close_order(order["id"], close_price, close_reason, round(profit_loss, 2))
+        if history:
+            trader_board.record(history)
+    order_mirror.remove(order["id"])
+    invalidate_community_feed(order_id=order["id"])
+    publish_order_event(
+        order["id"], "closed",
+        close_price=close_price,
+        profit_loss=round(profit_loss, 2),
+        close_reason=close_reason
+    )
+    return history
+
+def is_permanent_db_error(error: Exception) -> bool:
+    # Postgres data exceptions (22xxx) and constraint violations (23xxx)
+    # fail the same way however often they are retried
+    code = str(getattr(error, "code", None) or "")
+    return code.startswith("22") or code.startswith("23")
+
+async def apply_journal_entry(entry: Dict[str, Any]):
+    """
+    Replay one journaled order write against Supabase. Entries can be
+    replayed twice after a crash, so every step is safe to repeat.
+    """
+    order_id, data = entry["order_id"], entry["data"]
+    try:
+        if entry["op"] == "create":
+            # Already closed: writing it again would reopen it
+            if await db.history_exists(order_id):
+                return
+            if not await db.get_user(data["user_id"]):
+                await db.insert_user(placeholder_user(data["user_id"]))
+            await db.upsert_order(data)
+        elif entry["op"] == "update":
+            await db.update_order(order_id, data)
+        elif entry["op"] == "close":
+            if await db.history_exists(order_id):
+                return
+            try:
+                history = await db.close_order(order_id, data["close_price"], data["close_reason"], data["profit_loss"])
+            except Exception as e:
+                # Deleted before the close reached the database
+                if is_order_not_found(e):
+                    return
+                raise
+            if history:
+                trader_board.record(history)
+        elif entry["op"] == "delete":
+            await db.delete_order(order_id)
+    except Exception as e:
+        if is_permanent_db_error(e):
+            raise PermanentError(str(e))
+        raise
+
+async def journal_close(order: Dict[str, Any], close_price: float, close_reason: str, profit_loss: float) -> Dict[str, Any]:
+    """
+    Journal a close and return the order_history row it will produce; the
+    row is written when the drainer replays the entry
+    """
+    closed_at = datetime.now().isoformat()
+    await order_journal.append("close", order["id"], {
+        "close_price": close_price,
+        "close_reason": close_reason,
+        "profit_loss": profit_loss,
+    })
+    return {
+        "order_id": order["id"],
+        "user_id": order.get("user_id"),
+        "symbol": order.get("symbol"),
+        "entry_price": order.get("entry_price"),
+        "close_price": close_price,
+        "stop_loss": order.get("stop_loss"),
+        "take_profit": order.get("take_profit"),
+        "position_type": order.get("position_type"),
+        "profit_loss": profit_loss,
+        "close_reason": close_reason,
+        "closed_at": closed_at,
+        "pending": True,
+    }
+
+# Local write-ahead log for order writes: endpoints answer once the entry
+# is fsynced and the drainer replays it to Supabase in the background
+order_journal = OrderJournal(journal.JOURNAL_DIR, apply_journal_entry)
+
+@app.on_event("startup")
+async def startup_order_journal():
+    # Before the order mirror starts, so its first load sees recovered entries
+    if journal.JOURNAL_ENABLED:
+        order_journal.start()
+
+async def load_all_orders() -> List[Dict[str, Any]]:
+    """
+    The orders table as the API sees it: journaled writes the drainer
+    hasn't replayed yet are applied on top
+    """
+    if not journal.JOURNAL_ENABLED:
+        return await db.list_all_orders()
+    # Entries replayed while the table is read may be missing from the
+    # snapshot, so everything pending at the start is applied as well
+    entries = list(order_journal.pending)
+    orders = await db.list_all_orders()
+    seen = {entry["seq"] for entry in entries}
+    entries += [entry for entry in order_journal.pending if entry["seq"] not in seen]
+    return order_journal.overlay(orders, entries)
+
+async def load_order(order_id: str) -> Optional[Dict[str, Any]]:
+    """
+    One orders row, with journaled writes not yet replayed applied on top
+    """
+    order = await db.get_order(order_id)
+    if journal.JOURNAL_ENABLED:
+        pending = order_journal.pending_for(order_id)
+        if pending:
+            return journal.fold(order, pending)
+    return order
+
+# In-memory copy of the orders table, answering order reads and pre-checks
+order_mirror = OrderMirror()
+order_mirror_sync = OrderMirrorSync(
+    order_mirror,
+    load_all_orders,
+    feed=RealtimeChanges(supabase_url, supabase_service_key) if order_store.ORDER_FEED == "realtime" else None,
+    # Change-feed rows and changes replayed after a reload are re-read
+    # through the journal, so a journaled order Supabase hasn't seen yet
+    # isn't dropped
+    fetch_one=load_order
+)
+
+async def find_order(order_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Look an order up in the mirror, falling back to the database on a miss
+    (e.g. a frontend insert the change feed hasn't delivered yet)
+    """
+    order = order_mirror.get(order_id) if order_mirror.ready else None
+    if journal.JOURNAL_ENABLED:
+        pending = order_journal.pending_for(order_id)
+        if pending:
+            # The database is behind the journal for this order
+            return journal.fold(order or await db.get_order(order_id), pending)
+    return order or await db.get_order(order_id)
+
+async def load_open_orders() -> List[Dict[str, Any]]:
+    if order_mirror.ready:
+        return order_mirror.open_orders()
+    return await db.list_open_orders()
+
+# Server-side stop-loss/take-profit execution
+order_engine = SLTPEngine(
+    close_order=close_order_transaction,
+    load_orders=load_open_orders,
+    fetch_prices=fetch_binance_prices,
+    symbol_key=engine_symbol_key,
+    poll_interval=sltp_engine.POLL_INTERVAL,
+    resync_interval=sltp_engine.RESYNC_INTERVAL,
+    save_trail_extremes=db.update_trail_extremes,
+    trail_flush_interval=sltp_engine.TRAIL_FLUSH_INTERVAL
+)
+
+def sync_engine_with_mirror(event: str, order: Optional[Dict[str, Any]]):
+    # The mirror sees every order change, ours and the frontend's
+    if event == "load":
+        order_engine.load(order_mirror.open_orders())
+    elif event == "remove" or (order.get("status") or "open") != "open":
+        order_engine.remove_order(order["id"])
+    else:
+        order_engine.add_order(order)
+
+order_mirror.subscribe(sync_engine_with_mirror)
+
+@app.on_event("startup")
+async def startup_order_mirror():
+    if order_store.ORDER_MIRROR_ENABLED:
+        order_mirror_sync.start()
+
+@app.on_event("shutdown")
+async def shutdown_order_mirror():
+    await order_mirror_sync.stop()
+
+# Rolling top-trader rankings, updated on every order_history insert
+trader_board = Leaderboard()
+trader_board_sync = LeaderboardSync(
+    trader_board,
+    db.list_analytics_totals,
+    db.list_history_since,
+    feed=RealtimeChanges(supabase_url, supabase_service_key, table="order_history")
+    if leaderboard.LEADERBOARD_FEED == "realtime" else None
+)
+
+@app.on_event("startup")
+async def startup_leaderboard():
+    if leaderboard.LEADERBOARD_ENABLED:
+        trader_board_sync.start()
+
+@app.on_event("shutdown")
+async def shutdown_leaderboard():
+    await trader_board_sync.stop()
+
+# Latest prices, written to the prices table in periodic batches
+price_writer = PricePersister(db.upsert_prices)
+
+def persist_price(symbol: str, price: float, timestamp: Optional[float] = None):
+    # The prices table is keyed like crypto_BTC; only the default-quote
+    # pair of each base is stored so e.g. ETHBTC can't overwrite ETH
+    if not price_persister.PRICE_PERSIST_ENABLED:
+        return
+    base = exchange_symbols.base_of(symbol)
+    if exchange_symbols.normalize(base) == symbol:
+        price_writer.record(f"crypto_{base}", price, timestamp)
+
+# Streaming price ingestion, feeding the cache and the SL/TP engine
+price_board = PriceBoard()
+
+# In-memory OHLCV history, fed by the price stream
+candle_store = CandleStore()
+candle_backfill_locks: Dict[str, asyncio.Lock] = {}
+
+def stream_symbols() -> List[str]:
+    pushed_symbols = [topic.split(":", 1)[1] for topic in push_hub.topics("price:")]
+    return sorted(
+        set(exchange_symbols.resolve_watchlist()) | set(order_engine.symbols())
+        | set(pushed_symbols) | set(candle_store.symbols())
+    )
+
+def on_price_tick(tick):
+    market_cache.set(f"price:{tick.symbol}", tick.price)
+    if tick.stats:
+        market_cache.set(f"24hr:{tick.symbol}", tick.stats)
+    candle_store.add_tick(tick.symbol, tick.price, tick.event_time)
+    persist_price(tick.symbol, tick.price, tick.event_time)
+    order_engine.submit_tick(tick.symbol, tick.price)
+    publish_price(tick.symbol, tick.price)
+
+price_board.subscribe(on_price_tick)
+price_source = create_source(stream_symbols)
+# A replay stops at the end of its file instead of reconnecting, which
+# would feed the same old ticks to the SL/TP engine again and again
+price_ingestor = PriceIngestor(
+    price_source, price_board,
+    reconnect=not isinstance(price_source, ReplaySource) or PRICE_REPLAY_LOOP
+) if price_source else None
+
+@app.on_event("startup")
+async def startup_order_engine():
+    if price_ingestor:
+        price_ingestor.start()
+        print(f"Price stream started ({type(price_source).__name__})")
+    if sltp_engine.ENGINE_ENABLED:
+        # REST polling is only needed when no stream is feeding prices
+        order_engine.start(poll=price_ingestor is None)
+        print("SL/TP engine started")
+
+@app.on_event("shutdown")
+async def shutdown_order_engine():
+    if price_ingestor:
+        await price_ingestor.stop()
+    await order_engine.stop()
+
+@app.on_event("startup")
+async def startup_price_writer():
+    if price_persister.PRICE_PERSIST_ENABLED:
+        price_writer.start()
+
+@app.on_event("shutdown")
+async def shutdown_price_writer():
+    # Flush whatever is still buffered
+    await price_writer.stop()
+
+# Most topics one push connection may subscribe to
+WS_MAX_TOPICS = int(os.getenv("WS_MAX_TOPICS", "50"))
+
+def normalize_topic(topic: str) -> Optional[str]:
+    kind, _, key = str(topic).partition(":")
+    if not key:
+        return None
+    if kind == "price":
+        return f"price:{exchange_symbols.normalize(key)}"
+    if kind == "order":
+        return f"order:{key}"
+    return None
+
+@app.websocket("/ws")
+async def push_channel(websocket: WebSocket):
+    """
+    Push channel for price and order-status updates.
+
+    Send {"action": "subscribe", "topics": ["price:BTC", "order:<order_id>"]}
+    (or "unsubscribe"); updates arrive as {"topic": ..., "data": ...}.
+    Slow clients only receive the latest update per topic.
+
+    Order topics need a bearer token, passed as the Authorization header or
+    the `token` query parameter, and are limited to the user's own orders.
+    """
+    await websocket.accept()
+    user = None
+    auth_header = websocket.headers.get("Authorization", "")
+    token = auth_header.split(" ")[1] if auth_header.startswith("Bearer ") else websocket.query_params.get("token")
+    if token:
+        try:
+            user = await authenticate_token(token)
+        except HTTPException as he:
+            await websocket.close(code=1008, reason=str(he.detail))
+            return
+
+    subscriber = push_hub.connect()
+
+    async def send_updates():
+        while True:
+            for topic, data in await subscriber.next_batch():
+                await websocket.send_json({"topic": topic, "data": data})
+
+    def sender_done(task: asyncio.Task):
+        # A failed send means the socket is gone; stop the receive loop too
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Push channel send error: {str(task.exception())}")
+            asyncio.ensure_future(websocket.close(code=1011))
+
+    async def rejected_topic(topic: str) -> Optional[str]:
+        kind, _, key = topic.partition(":")
+        if kind == "price" and not exchange_symbols.is_listed(key):
+            return f"Unknown symbol: {key}"
+        if kind == "order":
+            if user is None:
+                return f"Authentication required for {topic}"
+            try:
+                order = await find_order(key)
+            except Exception:
+                order = None
+            if not order or str(order.get("user_id")) != str(user.id):
+                return f"Not authorized for {topic}"
+        return None
+
+    sender = asyncio.ensure_future(send_updates())
+    sender.add_done_callback(sender_done)
+    try:
+        while True:
+            message = await websocket.receive_json()
+            topics = [t for t in (normalize_topic(t) for t in message.get("topics", [])) if t]
+            action = message.get("action")
+
+            if action == "subscribe":
+                topics = [topic for topic in dict.fromkeys(topics) if topic not in subscriber.topics]
+                errors = [error for error in [await rejected_topic(topic) for topic in topics] if error]
+                if errors:
+                    await websocket.send_json({"error": "; ".join(errors)})
+                    continue
+                if len(subscriber.topics) + len(topics) > WS_MAX_TOPICS:
+                    await websocket.send_json({"error": f"Too many topics (limit {WS_MAX_TOPICS})"})
+                    continue
+                push_hub.subscribe(subscriber, topics)
+                # Send the latest known price straight away
+                for topic in topics:
+                    if topic.startswith("price:"):
+                        symbol = topic.split(":", 1)[1]
+                        price = price_board.get(symbol) or market_cache.peek(topic)
+                        if price is not None:
+                            subscriber.offer(topic, {"symbol": symbol, "price": price, "timestamp": datetime.now().isoformat()})
+            elif action == "unsubscribe":
+                push_hub.unsubscribe(subscriber, topics)
+            else:
+                await websocket.send_json({"error": f"Unknown action: {action}"})
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"Push channel error: {str(e)}")
+    finally:
+        sender.cancel()
+        push_hub.disconnect(subscriber)
+
+@app.get("/ws/stats", tags=["system"])
+async def get_push_stats():
+    """
+    Connection and fan-out counters for the push channel
+    """
+    return push_hub.stats()
+
+# On-disk columnar candle history, so restarts and old ranges don't need Binance
+history_store = PriceHistoryStore() if price_history.PRICE_HISTORY_ENABLED else None
+HISTORY_FLUSH_INTERVAL = float(os.getenv("PRICE_HISTORY_FLUSH_INTERVAL", "60"))
+
+def closed_candles_to_persist() -> List[tuple]:
+    """
+    Closed in-memory candles that are newer than what's on disk and hold
+    exchange data (tick-built candles are never written, since rows on
+    disk are never rewritten)
+    """
+    pending = []
+    for symbol in candle_store.symbols():
+        for resolution in RESOLUTIONS:
+            exact_until = candle_store.exact_until(symbol, resolution)
+            if exact_until is None:
+                continue
+            last_stored = history_store.series(symbol, resolution).last_open_time()
+            candles = candle_store.get(
+                symbol, resolution,
+                start=last_stored + 1 if last_stored is not None else None,
+                end=exact_until + 1
+            )
+            if candles:
+                pending.append((symbol, resolution, candles))
+    return pending
+
+# The flush loop and every backfill persist; one writer at a time, or two
+# executor threads could append the same rows or interleave column writes
+candle_persist_lock: Optional[asyncio.Lock] = None
+
+async def persist_candles():
+    global candle_persist_lock
+    if not history_store:
+        return
+    # Created on first use so it belongs to the server's event loop
+    if candle_persist_lock is None:
+        candle_persist_lock = asyncio.Lock()
+    async with candle_persist_lock:
+        pending = closed_candles_to_persist()
+        if not pending:
+            return
+        
+        def write():
+            written = 0
+            for symbol, resolution, candles in pending:
+                written += history_store.append(symbol, resolution, candles)
+            return written
+        
+        loop = asyncio.get_event_loop()
+        written = await loop.run_in_executor(None, write)
+    if written:
+        print(f"Persisted {written} candles to price history")
+
+async def refresh_candles():
+    """
+    Replace closed tick-built candles with Binance klines so they can be
+    persisted
+    """
+    now = int(time.time())
+    for symbol in candle_store.symbols():
+        if not exchange_symbols.is_listed(symbol):
+            continue
+        for resolution, step in RESOLUTIONS.items():
+            exact_until = candle_store.exact_until(symbol, resolution)
+            if exact_until is not None and exact_until >= now - now % step - step:
+                continue
+            params = {"symbol": symbol, "interval": BACKFILL_INTERVALS[resolution], "limit": 1000}
+            if exact_until is not None:
+                params["startTime"] = (exact_until + step) * 1000
+            try:
+                klines = await http_client.get_json(f"{BINANCE_API_URL}/klines", params=params, priority=rate_limits.LOW)
+            except Exception as e:
+                print(f"Error refreshing {resolution} candles for {symbol}: {str(e)}")
+                continue
+            if exact_until is None:
+                candle_store.add_klines(symbol, resolution, klines)
+            else:
+                candle_store.update_klines(symbol, resolution, klines)
+
+async def candle_persist_loop():
+    while True:
+        await asyncio.sleep(HISTORY_FLUSH_INTERVAL)
+        try:
+            await refresh_candles()
+            await persist_candles()
+        except Exception as e:
+            print(f"Error persisting candles: {str(e)}")
+
+def load_candles_from_history():
+    """
+    Warm the in-memory candle store from disk on startup
+    """
+    loaded = 0
+    for symbol, resolution in history_store.stored():
+        if resolution not in RESOLUTIONS:
+            continue
+        columns = history_store.series(symbol, resolution).range(limit=CAPACITIES[resolution])
+        candle_store.load(symbol, resolution, zip(
+            columns["open_time"], columns["open"], columns["high"],
+            columns["low"], columns["close"], columns["volume"]
+        ))
+        loaded += len(columns["open_time"])
+    print(f"Loaded {loaded} candles from price history")
+
+candle_persist_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def startup_price_history():
+    global candle_persist_task
+    if not history_store:
+        return
+    try:
+        load_candles_from_history()
+    except Exception as e:
+        print(f"Error loading price history: {str(e)}")
+    candle_persist_task = asyncio.ensure_future(candle_persist_loop())
+
+@app.on_event("shutdown")
+async def shutdown_price_history():
+    if not history_store:
+        return
+    if candle_persist_task:
+        candle_persist_task.cancel()
+    try:
+        await persist_candles()
+    except Exception as e:
+        print(f"Error persisting candles: {str(e)}")
+    history_store.sync()
+    history_store.close()
+
+async def ensure_candles(symbol: str, resolution: str):
+    """
+    Backfill a symbol's candles from Binance klines unless the store
+    already has recent data for it
+    """
+    step = RESOLUTIONS[resolution]
+    last_open_time = candle_store.last_open_time(symbol, resolution)
+    if resolution in candle_store.backfilled.get(symbol, ()) and last_open_time and last_open_time >= time.time() - 2 * step:
+        return
+    
+    lock = candle_backfill_locks.setdefault(f"{symbol}:{resolution}", asyncio.Lock())
+    async with lock:
+        # Another request may have backfilled while we waited
+        last_open_time = candle_store.last_open_time(symbol, resolution)
+        if resolution in candle_store.backfilled.get(symbol, ()) and last_open_time and last_open_time >= time.time() - 2 * step:
+            return
+        print(f"Backfilling {resolution} candles for {symbol}")
+        klines = await http_client.get_json(
+            f"{BINANCE_API_URL}/klines",
+            params={"symbol": symbol, "interval": BACKFILL_INTERVALS[resolution], "limit": 1000}
+        )
+        candle_store.add_klines(symbol, resolution, klines)
+    
+    await persist_candles()
+
+@app.get("/candles/{symbol}", tags=["market"])
+async def get_candles(
+    symbol: str,
+    interval: str = "1h",
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    limit: int = 500
+):
+    """
+    OHLCV candles for a symbol from the in-memory candle store.
+
+    interval is one of 1m, 10m, 1h, 1d; start/end are epoch milliseconds
+    (start inclusive, end exclusive), like Binance klines.
+    """
+    if interval not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"interval must be one of {', '.join(RESOLUTIONS)}")
+    
+    binance_symbol = exchange_symbols.normalize(symbol)
+    if not exchange_symbols.is_listed(binance_symbol):
+        raise HTTPException(status_code=404, detail="Symbol not found")
+    try:
+        await ensure_candles(binance_symbol, interval)
+    except http_client.UpstreamError as e:
+        if e.status_code == 400:
+            raise HTTPException(status_code=404, detail="Symbol not found")
+        raise HTTPException(status_code=502, detail=f"Failed to backfill candles: {str(e)}")
+    
+    start_seconds = start // 1000 if start is not None else None
+    end_seconds = end // 1000 if end is not None else None
+    limit = max(1, min(limit, 5000))
+    candles = candle_store.get(binance_symbol, interval, start=start_seconds, end=end_seconds, limit=limit)
+    
+    # Anything older than the in-memory window comes from the on-disk history
+    oldest_in_memory = candle_store.oldest_open_time(binance_symbol, interval)
+    if history_store and start_seconds is not None and len(candles) < limit and (
+        oldest_in_memory is None or start_seconds < oldest_in_memory
+    ):
+        disk_end = oldest_in_memory if oldest_in_memory is not None else end_seconds
+        if end_seconds is not None and disk_end is not None:
+            disk_end = min(disk_end, end_seconds)
+        older = history_store.range(
+            binance_symbol, interval, start=start_seconds, end=disk_end,
+            limit=limit - len(candles)
+        )
+        candles = older + candles
+    
+    for candle in candles:
+        candle["open_time"] *= 1000
+    return {"symbol": symbol, "interval": interval, "candles": candles}
+
+async def recent_candles(symbol: str, interval: str, count: int) -> List[Dict[str, Any]]:
+    """
+    The last `count` candles, topped up from the on-disk history when the
+    in-memory ring holds fewer
+    """
+    await ensure_candles(symbol, interval)
+    candles = candle_store.get(symbol, interval, limit=count)
+    if history_store and len(candles) < count:
+        oldest_in_memory = candle_store.oldest_open_time(symbol, interval)
+        older = history_store.range(symbol, interval, end=oldest_in_memory, limit=count - len(candles))
+        candles = older + candles
+    return candles
+
+@app.post("/backtest", tags=["market"])
+async def run_backtest(request: BacktestRequest):
+    """
+    Replay stop-loss/take-profit levels over historical candles: how often
+    each level pair would have hit the target or the stop, how long it took
+    and the distribution of returns (percent), for every grid combination
+    """
+    try:
+        if request.interval not in RESOLUTIONS:
+            raise HTTPException(status_code=400, detail=f"interval must be one of {', '.join(RESOLUTIONS)}")
+        side = (request.position_type or "long").lower()
+        if side not in ("long", "short"):
+            raise HTTPException(status_code=400, detail="position_type must be long or short")
+        binance_symbol = exchange_symbols.normalize(request.symbol)
+        if not exchange_symbols.is_listed(binance_symbol):
+            raise HTTPException(status_code=404, detail="Symbol not found")
+        
+        lookback = max(2, min(request.lookback, CAPACITIES[request.interval]))
+        try:
+            candles = await recent_candles(binance_symbol, request.interval, lookback)
+        except http_client.UpstreamError as e:
+            if e.status_code == 400:
+                raise HTTPException(status_code=404, detail="Symbol not found")
+            raise HTTPException(status_code=502, detail=f"Failed to backfill candles: {str(e)}")
+        
+        # numpy work is CPU-bound; keep it off the event loop
+        result = await asyncio.get_running_loop().run_in_executor(
+            None, backtest.run,
+            candles, side, request.entry_price, request.stop_loss, request.take_profit,
+            request.horizon, RESOLUTIONS[request.interval]
+        )
+        return {
+            "symbol": request.symbol,
+            "interval": request.interval,
+            "position_type": side,
+            "from": candles[0]["open_time"] * 1000,
+            "to": candles[-1]["open_time"] * 1000,
+            **result,
+        }
+        
+    except backtest.BacktestError as be:
+        raise HTTPException(status_code=400, detail=str(be))
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        print(f"Error running backtest: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/stream/status", tags=["system"])
+async def get_stream_status():
+    """
+    Status of the streaming price feed
+    """
+    if not price_ingestor:
+        return {"enabled": False}
+    return {"enabled": True, "symbols": len(price_board.prices), **price_ingestor.status()}
+
+@app.get("/prices/persist-stats", tags=["system"])
+async def get_price_persist_stats():
+    """
+    Counters for the batched writer behind the prices table
+    """
+    return {"enabled": price_persister.PRICE_PERSIST_ENABLED, **price_writer.stats()}
+
+@app.get("/mirror/status", tags=["system"])
+async def get_order_mirror_status():
+    """
+    Size and counters of the in-memory orders mirror
+    """
+    return {"enabled": order_store.ORDER_MIRROR_ENABLED, **order_mirror_sync.status()}
+
+@app.get("/orders/{order_id}/trailing-stop", tags=["orders"])
+async def get_trailing_stop(order_id: str):
+    """
+    Where a trailing_stop/oco order's stop currently sits, as tracked by
+    the SL/TP engine
+    """
+    order = await find_order(order_id)
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if sltp_engine.order_type(order) == "fixed":
+        raise HTTPException(status_code=400, detail="Order has no trailing stop")
+    extreme = order_engine.trailing_extreme(str(order["id"]))
+    return {
+        "order_id": order["id"],
+        "order_type": sltp_engine.order_type(order),
+        "tracked": extreme is not None,
+        "extreme": extreme if extreme is not None else order.get("trail_extreme"),
+        "trailing_stop": order_engine.trailing_stop(str(order["id"])),
+        "stop_loss": order.get("stop_loss"),
+        "take_profit": order.get("take_profit"),
+    }
+
+@app.get("/engine/status", tags=["system"])
+async def get_engine_status():
+    """
+    Counters for the server-side SL/TP engine
+    """
+    return {"enabled": sltp_engine.ENGINE_ENABLED, **order_engine.status()}
+
 @app.put("/update-profile/{user_id}", tags=["auth"])
 async def update_profile(
     user_id: str,
@@ -497,18 +1622,20 @@ async def update_profile(
         print(f"Final update data: {update_data}")
         
         # Update user in the users table
-        response = supabase.table('users')\
-            .update(update_data)\
-            .eq('id', user_id)\
-            .execute()
+        updated_user = await db.update_user(user_id, update_data)
         
-        print(f"Update response: {response}")
+        print(f"Update response: {updated_user}")
         
-        if not response.data:
+        if not updated_user:
             raise HTTPException(status_code=404, detail="User not found or update failed")
+        
+        # Cached tokens still carry the old profile, make them re-verify
+        auth_cache.revoke_user(user_id)
             
-        return {"message": "Profile updated successfully", "user": response.data[0]}
+        return {"message": "Profile updated successfully", "user": updated_user}
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Profile update error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -528,13 +1655,10 @@ async def ensure_user(user_data: dict):
         print(f"Ensuring user exists: {user_id}, {email}")
         
         # Check if user exists
-        user_response = supabase.table('users')\
-            .select('*')\
-            .eq('id', user_id)\
-            .execute()
+        existing_user = await db.get_user(user_id)
             
         # If user doesn't exist, create them
-        if not user_response.data:
+        if not existing_user:
             print(f"Creating new user record for {user_id}")
             new_user = {
                 "id": user_id,
@@ -544,12 +1668,14 @@ async def ensure_user(user_data: dict):
                 "updated_at": datetime.now().isoformat()
             }
             
-            insert_response = supabase.table('users').insert(new_user).execute()
-            print(f"User creation response: {insert_response}")
-            return {"message": "User created successfully", "user": insert_response.data[0]}
+            created_user = await db.insert_user(new_user)
+            print(f"User creation response: {created_user}")
+            return {"message": "User created successfully", "user": created_user}
         
-        return {"message": "User already exists", "user": user_response.data[0]}
+        return {"message": "User already exists", "user": existing_user}
             
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error ensuring user: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -563,24 +1689,25 @@ async def delete_order(order_id: str):
         print(f"Deleting order: {order_id}")
         
         # First check if order exists
-        order_check = supabase.table('orders')\
-            .select('*')\
-            .eq('id', order_id)\
-            .execute()
+        existing_order = await find_order(order_id)
             
-        if not order_check.data:
+        if not existing_order:
             raise HTTPException(status_code=404, detail="Order not found")
             
         # Delete the order
-        response = supabase.table('orders')\
-            .delete()\
-            .eq('id', order_id)\
-            .execute()
+        if journal.JOURNAL_ENABLED:
+            response = await order_journal.append("delete", order_id, {})
+        else:
+            response = await db.delete_order(order_id)
+        order_mirror.remove(order_id)
+        publish_order_event(order_id, "deleted")
             
         print(f"Delete response: {response}")
         
         return {"message": "Order deleted successfully"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error deleting order: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -606,12 +1733,9 @@ async def update_order(order_id: str, order_update: dict):
         print(f"Update data: {order_update}")
         
         # First check if order exists
-        order_check = supabase.table('orders')\
-            .select('*')\
-            .eq('id', order_id)\
-            .execute()
+        existing_order = await find_order(order_id)
             
-        if not order_check.data:
+        if not existing_order:
             raise HTTPException(status_code=404, detail="Order not found")
             
         # Update only provided fields
@@ -625,24 +1749,79 @@ async def update_order(order_id: str, order_update: dict):
             update_data["stop_loss"] = order_update["stop_loss"]
         if "take_profit" in order_update:
             update_data["take_profit"] = order_update["take_profit"]
+        for field in ("trail_amount", "trail_percent"):
+            if field in order_update:
+                update_data[field] = order_update[field]
+        
+        invalid = sltp_engine.validate_order({**existing_order, **update_data})
+        if invalid:
+            raise HTTPException(status_code=400, detail=invalid)
             
         # Add updated_at timestamp
         update_data["updated_at"] = datetime.now().isoformat()
             
         # Update the order
-        response = supabase.table('orders')\
-            .update(update_data)\
-            .eq('id', order_id)\
-            .execute()
+        if journal.JOURNAL_ENABLED:
+            await order_journal.append("update", order_id, update_data)
+            updated_order = {**existing_order, **update_data}
+        else:
+            updated_order = await db.update_order(order_id, update_data)
+        if not updated_order:
+            # Gone since the mirror last saw it
+            order_mirror.remove(order_id)
+            raise HTTPException(status_code=404, detail="Order not found")
+        order_mirror.upsert(updated_order)
+        publish_order_event(order_id, "updated", order=updated_order)
             
-        print(f"Update response: {response}")
+        print(f"Update response: {updated_order}")
         
-        return {"message": "Order updated successfully", "order": response.data[0]}
+        return {"message": "Order updated successfully", "order": updated_order}
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error updating order: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def is_order_not_found(error: Exception) -> bool:
+    return "not found" in str(error).lower()
+
+async def resolve_close_price(order_id: str, close_price: float, order: Optional[Dict[str, Any]] = None) -> float:
+    """
+    Use the client's close price, or the current market price for the order
+    (looked up unless the caller already has it)
+    """
+    if close_price > 0:
+        return close_price
+    
+    # Only needed when no close price was sent
+    order_data = order or await find_order(order_id)
+    if not order_data:
+        raise HTTPException(status_code=404, detail=f"Order with ID {order_id} not found")
+    
+    try:
+        current_price_response = await get_current_price(order_data["symbol"])
+        close_price = float(current_price_response.get("price", 0))
+        print(f"Using fetched current price: {close_price}")
+    except Exception as e:
+        print(f"Error fetching current price: {str(e)}")
+        close_price = float(order_data["entry_price"])  # Fallback to entry price
+    return close_price
+
+def order_closed(history: Dict[str, Any]):
+    """
+    Bookkeeping after an order has been moved to order_history
+    """
+    order_mirror.remove(history["order_id"])
+    trader_board.record(history)
+    invalidate_community_feed(order_id=history["order_id"])
+    publish_order_event(
+        history["order_id"], "closed",
+        close_price=history.get("close_price"),
+        profit_loss=history.get("profit_loss"),
+        close_reason=history.get("close_reason")
+    )
+
 @app.post("/orders/{order_id}/close", tags=["orders"])
 async def close_order(order_id: str, close_data: dict):
     """
@@ -650,7 +1829,6 @@ async def close_order(order_id: str, close_data: dict):
     """
     try:
         print(f"Closing order: {order_id}")
-        print(f"Close data received: {close_data}")
         
         # Validate input data
         if not close_data:
@@ -659,135 +1837,45 @@ async def close_order(order_id: str, close_data: dict):
         if not isinstance(close_data, dict):
             raise HTTPException(status_code=400, detail="Invalid close data format")
         
-        # First get the order details
-        try:
-            order = supabase.table('orders')\
-                .select('*')\
-                .eq('id', order_id)\
-                .execute()
-                
-            if not order.data:
-                error_msg = f"Order with ID {order_id} not found"
-                print(error_msg)
-                raise HTTPException(status_code=404, detail=error_msg)
-                
-            order_data = order.data[0]
-            print(f"Order found: {order_data}")
-        except Exception as e:
-            print(f"Error fetching order: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Error fetching order: {str(e)}")
+        order = None
+        if journal.JOURNAL_ENABLED:
+            # Looked up once; the close is journaled against this copy
+            order = await find_order(order_id)
+            if not order:
+                raise HTTPException(status_code=404, detail=f"Order with ID {order_id} not found")
         
-        # Calculate profit/loss
         try:
-            entry_price = float(order_data["entry_price"])
-            close_price = float(close_data.get("close_price", 0))
-            
-            if close_price <= 0:
-                # If no close price provided, fetch current price
-                try:
-                    symbol = order_data["symbol"]
-                    current_price_response = await get_current_price(symbol)
-                    close_price = float(current_price_response.get("price", 0))
-                    print(f"Using fetched current price: {close_price}")
-                except Exception as e:
-                    print(f"Error fetching current price: {str(e)}")
-                    close_price = entry_price  # Fallback to entry price
-            
-            # Calculate profit/loss based on position type
-            position_type = order_data.get("position_type", "long")  # Default to long if not specified
-            
-            if position_type == "short":
-                # For short positions, profit when price goes down
-                profit_loss = ((entry_price - close_price) / entry_price) * 100
-            else:
-                # For long positions, profit when price goes up
-                profit_loss = ((close_price - entry_price) / entry_price) * 100
-                
-            print(f"Calculated profit/loss: {profit_loss}% for {position_type} position")
-            
-        except Exception as e:
-            print(f"Error calculating profit/loss: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Error calculating profit/loss: {str(e)}")
+            close_price = await resolve_close_price(order_id, float(close_data.get("close_price") or 0), order)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid close price")
         
-        # Create history record
-        try:
-            history_record = {
-                "id": str(uuid.uuid4()),
-                "order_id": str(order_id),
-                "user_id": str(order_data["user_id"]),
-                "symbol": str(order_data["symbol"]),
-                "entry_price": float(order_data["entry_price"]),
-                "stop_loss": float(order_data["stop_loss"]),
-                "take_profit": float(order_data["take_profit"]),
-                "position_type": str(order_data.get("position_type", "long")),
-                "close_price": float(close_price),
-                "profit_loss": float(profit_loss),
-                "close_reason": str(close_data.get("close_reason", "manual")),
-                "created_at": str(order_data["created_at"]),
-                "closed_at": datetime.now().isoformat()
-            }
-            
-            print(f"Creating history record: {history_record}")
-            
-            # Validate all required fields are present
-            required_fields = ["id", "order_id", "user_id", "symbol", "entry_price", 
-                              "stop_loss", "take_profit", "close_price", "profit_loss", 
-                              "close_reason", "created_at", "closed_at"]
-            
-            for field in required_fields:
-                if field not in history_record or history_record[field] is None:
-                    raise ValueError(f"Missing required field: {field}")
-                    
-        except Exception as e:
-            print(f"Error preparing history record: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Error preparing history record: {str(e)}")
+        if journal.JOURNAL_ENABLED:
+            history = await close_order_transaction(
+                order, close_price, str(close_data.get("close_reason", "manual"))
+            )
+            return {"message": "Order closed successfully", "history": history}
         
-        # Insert into order_history
-        try:
-            # First check if the table exists
-            try:
-                table_check = supabase.table('order_history').select('count').limit(1).execute()
-                print("order_history table exists")
-            except Exception as table_error:
-                print(f"Error checking order_history table: {str(table_error)}")
-                raise HTTPException(status_code=500, 
-                                   detail="order_history table may not exist. Please create it first.")
-            
-            # Now try to insert
-            history_response = supabase.table('order_history')\
-                .insert(history_record)\
-                .execute()
-                
-            print(f"History response: {history_response}")
-            
-            if not history_response.data:
-                raise Exception("Insert succeeded but returned no data")
-                
-        except Exception as e:
-            print(f"Error inserting into order_history: {str(e)}")
-            
-            # Try to get more detailed error information
-            error_detail = str(e)
-            if hasattr(e, 'response') and hasattr(e.response, 'text'):
-                error_detail += f" Response: {e.response.text}"
-                
-            raise HTTPException(status_code=500, detail=f"Error inserting into order_history: {error_detail}")
-            
-        # Delete from active orders
+        # Delete the order and write its history row in one transaction;
+        # profit/loss is calculated by the database
         try:
-            delete_response = supabase.table('orders')\
-                .delete()\
-                .eq('id', order_id)\
-                .execute()
-                
-            print(f"Delete response: {delete_response}")
+            history = await db.close_order(
+                order_id,
+                close_price,
+                close_reason=str(close_data.get("close_reason", "manual"))
+            )
         except Exception as e:
-            print(f"Error deleting from orders: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Error deleting from orders: {str(e)}")
-            
+            if is_order_not_found(e):
+                raise HTTPException(status_code=404, detail=f"Order with ID {order_id} not found")
+            raise
+        
+        if not history:
+            raise HTTPException(status_code=500, detail="Close succeeded but returned no history row")
+        
+        order_closed(history)
+        
         return {
             "message": "Order closed successfully",
-            "history": history_response.data[0]
+            "history": history
         }
         
     except HTTPException as he:
@@ -800,27 +1888,384 @@ async def close_order(order_id: str, close_data: dict):
         traceback.print_exc()  # Print full traceback for debugging
         raise HTTPException(status_code=500, detail=error_msg)
 
+async def journal_close_many(closes: List[Dict[str, Any]], orders: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Journal many closes at once (one group commit); the first close of
+    each order wins
+    """
+    closing = {}
+    for close in closes:
+        closing.setdefault(close["order_id"], (orders[close["order_id"]], close))
+    return list(await asyncio.gather(*(
+        close_order_transaction(order, close["close_price"], close["close_reason"])
+        for order, close in closing.values()
+    )))
+
+@app.post("/orders/bulk-close", tags=["orders"])
+async def close_orders(close_data: dict):
+    """
+    Close many orders in one transaction.
+
+    Body: {"orders": [{"order_id": ..., "close_price": ..., "close_reason": ...}, ...]}
+    Returns a result per submitted item.
+    """
+    try:
+        items = close_data.get("orders") if isinstance(close_data, dict) else None
+        if not isinstance(items, list) or not items:
+            raise HTTPException(status_code=400, detail="Expected a non-empty 'orders' list")
+        
+        results: List[Dict[str, Any]] = [None] * len(items)
+        closes = []
+        close_indexes = {}
+        orders: Dict[str, Optional[Dict[str, Any]]] = {}
+        for index, item in enumerate(items):
+            if not isinstance(item, dict) or not item.get("order_id"):
+                results[index] = {"index": index, "status": "error", "detail": "Missing order_id"}
+                continue
+            order_id = str(item["order_id"])
+            try:
+                uuid.UUID(order_id)
+            except ValueError:
+                results[index] = {"index": index, "order_id": order_id, "status": "error", "detail": "Invalid order_id"}
+                continue
+            if journal.JOURNAL_ENABLED:
+                # One lookup per order, reused for the price and the close
+                if order_id not in orders:
+                    orders[order_id] = await find_order(order_id)
+                if not orders[order_id]:
+                    results[index] = {"index": index, "order_id": order_id, "status": "not_found"}
+                    continue
+            try:
+                close_price = await resolve_close_price(order_id, float(item.get("close_price") or 0), orders.get(order_id))
+            except (TypeError, ValueError):
+                results[index] = {"index": index, "order_id": order_id, "status": "error", "detail": "Invalid close price"}
+                continue
+            except HTTPException as he:
+                results[index] = {"index": index, "order_id": order_id, "status": "not_found", "detail": he.detail}
+                continue
+            close_indexes.setdefault(order_id, []).append(index)
+            closes.append({
+                "order_id": order_id,
+                "close_price": close_price,
+                "close_reason": str(item.get("close_reason", "manual"))
+            })
+        
+        if journal.JOURNAL_ENABLED:
+            history_rows = await journal_close_many(closes, orders)
+        else:
+            history_rows = await db.close_orders(closes) if closes else []
+            for history in history_rows:
+                order_closed(history)
+        history_by_order = {str(history["order_id"]): history for history in history_rows}
+        
+        for order_id, indexes in close_indexes.items():
+            history = history_by_order.get(order_id)
+            for position, index in enumerate(indexes):
+                if history and position == 0:
+                    results[index] = {"index": index, "order_id": order_id, "status": "closed", "history": history}
+                else:
+                    results[index] = {"index": index, "order_id": order_id, "status": "not_found"}
+        
+        closed_count = len(history_rows)
+        return {"closed": closed_count, "failed": len(results) - closed_count, "results": results}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error closing orders: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error closing orders: {str(e)}")
+
 @app.get("/order-history/{user_id}", tags=["orders"])
-async def get_order_history(user_id: str):
+async def get_order_history(
+    user_id: str,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    symbol: Optional[str] = None,
+    close_reason: Optional[str] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    fields: Optional[str] = None
+):
     """
-    Get order history for a user
+    Get order history for a user, most recently closed first.
+
+    Paginate by passing the returned next_cursor back as ?cursor=.
+    Filter with symbol, close_reason and a closed_at range (start
+    inclusive, end exclusive); pick columns with ?fields=a,b,c.
     """
     try:
         print(f"Fetching order history for user: {user_id}")
         
-        # Get all order history for the user
-        response = supabase.table('order_history')\
-            .select('*')\
-            .eq('user_id', user_id)\
-            .order('closed_at', desc=True)\
-            .execute()
+        history, next_cursor = await db.list_history(
+            user_id, limit=limit, cursor=cursor, symbol=symbol, close_reason=close_reason,
+            start=start, end=end, fields=parse_fields(fields)
+        )
             
-        return {"history": response.data}
+        return {"history": history, "next_cursor": next_cursor}
         
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
         print(f"Error fetching order history: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+MAX_PNL_USERS = 200
+
+async def open_orders_for(user_ids: Optional[List[str]] = None, public: bool = False) -> List[Dict[str, Any]]:
+    """
+    Open orders of some users, or all public open orders
+    """
+    if order_mirror.ready:
+        if public:
+            return [order for order in order_mirror.open_orders() if order.get("is_public")]
+        return [
+            order for user_id in user_ids for order in order_mirror.for_user(user_id)
+            if (order.get("status") or "open") == "open"
+        ]
+    if public:
+        return await db.list_public_open_orders()
+    return await db.list_open_orders_for_users(user_ids)
+
+async def prices_for_orders(orders: List[Dict[str, Any]]) -> Dict[str, float]:
+    """
+    Current price per order id. Crypto prices come from the price cache,
+    with every missing symbol fetched in one batched Binance call; forex
+    prices come from the FX cross-rate matrix.
+    """
+    crypto_symbols: Dict[str, str] = {}
+    forex_pairs: Dict[str, str] = {}
+    for order in orders:
+        if (order.get("market_type") or "crypto") == "forex":
+            forex_pairs[str(order["id"])] = order["symbol"]
+        elif order.get("symbol"):
+            crypto_symbols[str(order["id"])] = exchange_symbols.normalize(order["symbol"])
+    
+    quotes: Dict[str, float] = {}
+    for symbol in set(crypto_symbols.values()):
+        price = market_cache.peek(f"price:{symbol}")
+        if price is not None:
+            quotes[symbol] = price
+    missing = [symbol for symbol in set(crypto_symbols.values()) if symbol not in quotes]
+    if missing:
+        try:
+            quotes.update(await fetch_binance_prices(missing, priority=rate_limits.NORMAL))
+        except Exception as e:
+            print(f"Error fetching prices for P/L: {str(e)}")
+    prices = {order_id: quotes[symbol] for order_id, symbol in crypto_symbols.items() if symbol in quotes}
+    
+    if forex_pairs:
+        try:
+            matrix = await get_fx_matrix()
+            for order_id, symbol in forex_pairs.items():
+                try:
+                    base, quote = fx.parse_pair(symbol)
+                except ValueError:
+                    continue
+                if base in matrix and quote in matrix:
+                    prices[order_id] = matrix.rate(base, quote)
+        except Exception as e:
+            print(f"Error fetching FX rates for P/L: {str(e)}")
+    return prices
+
+@app.get("/portfolio/pnl", tags=["portfolio"])
+async def get_bulk_pnl(user_ids: Optional[str] = None, public: bool = False, include_orders: bool = True):
+    """
+    Unrealized P/L for many users (?user_ids=a,b,c) or for all public open
+    orders (?public=true), priced in one pass
+    """
+    try:
+        ids = [user_id.strip() for user_id in (user_ids or "").split(",") if user_id.strip()]
+        if not public and not ids:
+            raise HTTPException(status_code=400, detail="Pass user_ids or public=true")
+        if len(ids) > MAX_PNL_USERS:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_PNL_USERS} user_ids per request")
+        
+        orders = await open_orders_for(ids, public=public)
+        batch = PositionBatch(orders, await prices_for_orders(orders))
+        response = {
+            "summary": batch.summary(),
+            "by_user": batch.by_user(),
+            "exposure": batch.exposure(),
+        }
+        if include_orders:
+            response["orders"] = batch.results()
+        return response
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error computing P/L: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/portfolio/{user_id}/pnl", tags=["portfolio"])
+async def get_user_pnl(user_id: str):
+    """
+    Unrealized P/L, exposure per symbol and distance to SL/TP (all in
+    percent) for a user's open orders
+    """
+    try:
+        orders = await open_orders_for([user_id])
+        batch = PositionBatch(orders, await prices_for_orders(orders))
+        return {
+            "user_id": user_id,
+            "summary": batch.summary(),
+            "exposure": batch.exposure(),
+            "orders": batch.results(),
+        }
+    except Exception as e:
+        print(f"Error computing P/L: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/analytics/{user_id}", tags=["portfolio"])
+async def get_user_analytics(user_id: str):
+    """
+    Trading performance for a user: win rate, P/L and R-multiple stats,
+    equity and drawdown (P/L figures in percent)
+    """
+    try:
+        row = await db.get_user_analytics(user_id)
+        return analytics.summarize(user_id, row)
+    except Exception as e:
+        print(f"Error fetching analytics: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def fetch_nicknames(keys: List[str]) -> Dict[str, Any]:
+    nicknames = await db.get_nicknames([key.split(":", 1)[1] for key in keys])
+    return {key: nicknames.get(key.split(":", 1)[1]) for key in keys}
+
+@app.get("/leaderboard", tags=["portfolio"])
+async def get_leaderboard(window: str = "7d", metric: str = "total_pnl", limit: int = 10,
+                          min_trades: int = 1, user_id: Optional[str] = None):
+    """
+    Top traders over a rolling window (24h, 7d or all), ranked by total
+    P/L, win rate or trade count. Served from memory; pass user_id to also
+    get that user's own standing.
+    """
+    try:
+        if window not in leaderboard.WINDOWS:
+            raise HTTPException(status_code=400, detail=f"window must be one of {', '.join(leaderboard.WINDOWS)}")
+        if metric not in leaderboard.METRICS:
+            raise HTTPException(status_code=400, detail=f"metric must be one of {', '.join(leaderboard.METRICS)}")
+        if not trader_board.ready:
+            raise HTTPException(status_code=503, detail="Leaderboard is loading")
+        limit = max(1, min(limit, leaderboard.MAX_LEADERBOARD_SIZE))
+        
+        entries = trader_board.top(window, limit, metric, max(1, min_trades))
+        own = trader_board.entry(user_id, window) if user_id else None
+        wanted = {entry["user_id"] for entry in entries} | ({user_id} if own else set())
+        # Nicknames change rarely; keep them cached for ten minutes
+        nicknames = await market_cache.get_many([f"nickname:{uid}" for uid in wanted], fetch_nicknames, ttl=600)
+        for entry in entries + ([own] if own else []):
+            entry["nickname"] = nicknames.get(f"nickname:{entry['user_id']}")
+        
+        return {
+            "window": window,
+            "metric": metric,
+            "updated_at": trader_board.loaded_at,
+            "entries": entries,
+            "user": own,
+        }
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        print(f"Error building leaderboard: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/leaderboard/status", tags=["portfolio"])
+async def get_leaderboard_status():
+    return {"enabled": leaderboard.LEADERBOARD_ENABLED, **trader_board_sync.status()}
+
+# Public open orders, priced and sorted newest first. Rebuilt at most every
+# COMMUNITY_FEED_TTL seconds, or on the next request after a public order
+# is created, changed or closed.
+COMMUNITY_FEED_TTL = float(os.getenv("COMMUNITY_FEED_TTL", "10"))
+community_feed_version = 0
+community_feed_ids: set = set()
+
+def invalidate_community_feed(order: Optional[Dict[str, Any]] = None, order_id: Optional[str] = None):
+    global community_feed_version
+    if order is not None:
+        order_id = str(order["id"])
+        if not order.get("is_public") and order_id not in community_feed_ids:
+            return
+    elif order_id is not None and str(order_id) not in community_feed_ids:
+        return
+    market_cache.invalidate(f"community:orders:{community_feed_version}")
+    community_feed_version += 1
+
+def community_feed_listener(event: str, order: Optional[Dict[str, Any]]):
+    # "load" replaces the whole mirror, so anything may have changed
+    invalidate_community_feed(order if event != "load" else None)
+
+order_mirror.subscribe(community_feed_listener)
+
+async def build_community_feed() -> List[Dict[str, Any]]:
+    global community_feed_ids
+    orders = await open_orders_for(public=True)
+    # One price lookup per unique symbol, one nickname lookup per page of users
+    batch = PositionBatch(orders, await prices_for_orders(orders))
+    nicknames = await market_cache.get_many(
+        list({f"nickname:{order.get('user_id')}" for order in orders}), fetch_nicknames, ttl=600
+    )
+    feed = [
+        {**row, "nickname": nicknames.get(f"nickname:{row.get('user_id')}")}
+        for row in batch.results()
+    ]
+    feed.sort(key=lambda row: (str(row.get("created_at")), str(row["id"])), reverse=True)
+    community_feed_ids = {str(row["id"]) for row in feed}
+    return feed
+
+@app.get("/community/orders", tags=["portfolio"])
+async def get_community_orders(limit: int = 50, cursor: Optional[str] = None, symbol: Optional[str] = None):
+    """
+    Public open orders with current price and unrealized P/L (percent),
+    newest first. Paginate by passing next_cursor back as ?cursor=.
+    """
+    try:
+        limit = max(1, min(limit, db.MAX_PAGE_SIZE))
+        feed = await market_cache.get(
+            f"community:orders:{community_feed_version}", build_community_feed, ttl=COMMUNITY_FEED_TTL
+        )
+        if symbol is not None:
+            # BTC, btc and BTC/USDT all select BTCUSDT orders, however they were stored
+            symbol = exchange_symbols.normalize(symbol)
+            rows = [row for row in feed if row.get("symbol") and exchange_symbols.normalize(row["symbol"]) == symbol]
+        else:
+            rows = feed
+        if cursor:
+            position = db.decode_cursor(cursor)
+            rows = [row for row in rows if (str(row.get("created_at")), str(row["id"])) < position]
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = db.encode_cursor(rows[-1], "created_at")
+        return {"orders": rows, "next_cursor": next_cursor}
+        
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        print(f"Error fetching community orders: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# After the SL/TP engine has stopped, since its closes are journaled too
+@app.on_event("shutdown")
+async def shutdown_order_journal():
+    await order_journal.stop()
+
+@app.get("/journal/status", tags=["system"])
+async def get_journal_status():
+    """
+    Order journal backlog and replay counters
+    """
+    return {"enabled": journal.JOURNAL_ENABLED, **(order_journal.status() if journal.JOURNAL_ENABLED else {})}
+
+# Registered last: earlier shutdown hooks (e.g. the final price flush)
+# still need the database pool
+@app.on_event("shutdown")
+async def shutdown_db_pool():
+    db.shutdown()
+
 # Comment out all subscription endpoints
 """
 @app.post("/api/subscriptions", tags=["subscriptions"])
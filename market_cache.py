@@ -0,0 +1,183 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+
+class CacheEntry:
+    """
+    A cached value with its freshness window
+    """
+    __slots__ = ("value", "fetched_at", "fresh_until", "stale_until")
+
+    def __init__(self, value: Any, ttl: float, stale_ttl: float):
+        now = time.monotonic()
+        self.value = value
+        self.fetched_at = now
+        self.fresh_until = now + ttl
+        self.stale_until = now + ttl + stale_ttl
+
+
+class MarketDataCache:
+    """
+    TTL cache for upstream market data.
+
+    - Entries are fresh for `ttl` seconds, then served stale for up to
+      `stale_ttl` more seconds while a background refresh runs.
+    - Concurrent misses for the same key share a single upstream fetch.
+    - Batch lookups fetch every missing key with one upstream call.
+    """
+
+    def __init__(self, ttl: float = 5.0, stale_ttl: float = 60.0, max_entries: int = 10000):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries: Dict[str, CacheEntry] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._background: set = set()
+        self._stats = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "upstream_fetches": 0,
+            "refreshes": 0,
+            "errors": 0,
+        }
+
+    async def get(self, key: str, fetch: Callable[[], Awaitable[Any]], ttl: Optional[float] = None) -> Any:
+        """
+        Get a single key, calling `fetch()` on a miss
+        """
+        async def fetch_many(keys: List[str]) -> Dict[str, Any]:
+            return {key: await fetch()}
+
+        values = await self.get_many([key], fetch_many, ttl=ttl)
+        return values.get(key)
+
+    async def get_many(
+        self,
+        keys: Iterable[str],
+        fetch_many: Callable[[List[str]], Awaitable[Dict[str, Any]]],
+        ttl: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """
+        Get several keys at once; all missing keys are loaded with one
+        `fetch_many(missing_keys)` call that returns a {key: value} dict
+        """
+        now = time.monotonic()
+        results: Dict[str, Any] = {}
+        waiting: Dict[str, asyncio.Future] = {}
+        missing: List[str] = []
+        stale: List[str] = []
+
+        for key in dict.fromkeys(keys):
+            entry = self._entries.get(key)
+            if entry is not None and now < entry.fresh_until:
+                self._stats["hits"] += 1
+                results[key] = entry.value
+            elif entry is not None and now < entry.stale_until:
+                # Serve the stale value and revalidate in the background
+                self._stats["stale_hits"] += 1
+                results[key] = entry.value
+                if key not in self._inflight:
+                    stale.append(key)
+            elif key in self._inflight:
+                # Someone is already fetching this key, share their result
+                self._stats["coalesced"] += 1
+                waiting[key] = self._inflight[key]
+            else:
+                self._stats["misses"] += 1
+                missing.append(key)
+
+        if stale:
+            self._stats["refreshes"] += 1
+            self._register(stale)
+            task = asyncio.ensure_future(self._load(stale, fetch_many, ttl, background=True))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+        if missing:
+            self._register(missing)
+            waiting.update({key: self._inflight[key] for key in missing})
+            await self._load(missing, fetch_many, ttl)
+
+        for key, future in waiting.items():
+            results[key] = await asyncio.shield(future)
+
+        return results
+
+    def _register(self, keys: List[str]):
+        loop = asyncio.get_event_loop()
+        for key in keys:
+            self._inflight[key] = loop.create_future()
+
+    async def _load(self, keys: List[str], fetch_many, ttl: Optional[float], background: bool = False):
+        """
+        Run one upstream fetch for `keys` and resolve everyone waiting on them
+        """
+        futures = {key: self._inflight[key] for key in keys}
+        self._stats["upstream_fetches"] += 1
+        try:
+            values = await fetch_many(keys) or {}
+        except asyncio.CancelledError:
+            # Don't leave waiters hanging on a fetch that will never finish
+            for key, future in futures.items():
+                self._inflight.pop(key, None)
+                future.cancel()
+            raise
+        except Exception as e:
+            self._stats["errors"] += 1
+            print(f"Market cache fetch failed for {keys}: {str(e)}")
+            for key, future in futures.items():
+                self._inflight.pop(key, None)
+                if not future.done():
+                    future.set_exception(e)
+                    # Mark retrieved so unawaited stale refreshes don't warn
+                    future.exception()
+            if not background:
+                raise
+            return
+
+        for key, future in futures.items():
+            value = values.get(key)
+            if value is not None:
+                self.set(key, value, ttl)
+            self._inflight.pop(key, None)
+            if not future.done():
+                future.set_result(value)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """
+        Store a value directly (e.g. from a push feed)
+        """
+        if key not in self._entries and len(self._entries) >= self.max_entries:
+            # Evict the oldest inserted entry
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[key] = CacheEntry(value, self.ttl if ttl is None else ttl, self.stale_ttl)
+
+    def peek(self, key: str) -> Any:
+        """
+        Return a cached value if it is still servable, without fetching
+        """
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() < entry.stale_until:
+            return entry.value
+        return None
+
+    def invalidate(self, key: str):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats["hits"] + self._stats["stale_hits"] + self._stats["misses"] + self._stats["coalesced"]
+        served_from_cache = self._stats["hits"] + self._stats["stale_hits"]
+        return {
+            **self._stats,
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hit_ratio": round(served_from_cache / lookups, 4) if lookups else 0.0,
+            "ttl_seconds": self.ttl,
+            "stale_ttl_seconds": self.stale_ttl,
+        }
@@ -0,0 +1,347 @@
+import asyncio
+import itertools
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import db
+
+ORDER_MIRROR_ENABLED = os.getenv("ORDER_MIRROR_ENABLED", "true").lower() == "true"
+ORDER_MIRROR_RESYNC_INTERVAL = float(os.getenv("ORDER_MIRROR_RESYNC_INTERVAL", "300"))
+ORDER_FEED = os.getenv("ORDER_FEED", "realtime").lower()  # realtime | off
+
+# Ids removed by us are ignored by the change feed for this long, so a
+# late INSERT/UPDATE echo can't bring a closed order back
+TOMBSTONE_TTL = 120.0
+
+
+class OrderMirror:
+    """
+    In-process copy of the orders table, indexed by id, user_id and symbol.
+
+    Our own writes go through upsert()/remove() as soon as the database
+    accepts them; writes made elsewhere (the frontend writes orders
+    directly) arrive through apply_change() from the change feed, and a
+    periodic full reload repairs anything the feed missed.
+    """
+
+    def __init__(self):
+        self.orders: Dict[str, Dict[str, Any]] = {}
+        self.by_user: Dict[str, Set[str]] = {}
+        self.by_symbol: Dict[str, Set[str]] = {}
+        self.loaded_at: Optional[float] = None
+        self._tombstones: Dict[str, float] = {}
+        self._loading = False
+        self._changes_during_load: List[Tuple[str, str]] = []
+        self._listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+        self.stats = {"loads": 0, "upserts": 0, "removes": 0, "feed_changes": 0, "reads": 0}
+
+    @property
+    def ready(self) -> bool:
+        return self.loaded_at is not None
+
+    def subscribe(self, listener: Callable[[str, Dict[str, Any]], None]):
+        """
+        listener(event, order) with event one of "upsert", "remove" or
+        "load" (order is None for "load")
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, event: str, order: Optional[Dict[str, Any]]):
+        for listener in self._listeners:
+            try:
+                listener(event, order)
+            except Exception as e:
+                print(f"Order mirror listener error: {str(e)}")
+
+    # Index maintenance
+
+    def _index(self, order: Dict[str, Any]):
+        order_id = str(order["id"])
+        self.orders[order_id] = order
+        self.by_user.setdefault(str(order.get("user_id")), set()).add(order_id)
+        self.by_symbol.setdefault(str(order.get("symbol")), set()).add(order_id)
+
+    def _unindex(self, order_id: str) -> Optional[Dict[str, Any]]:
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            return None
+        for index, key in ((self.by_user, str(order.get("user_id"))), (self.by_symbol, str(order.get("symbol")))):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(order_id)
+                if not ids:
+                    del index[key]
+        return order
+
+    # Writes
+
+    def upsert(self, order: Dict[str, Any]):
+        """
+        Write-through after we inserted or updated an order
+        """
+        order_id = str(order["id"])
+        self._tombstones.pop(order_id, None)
+        self._unindex(order_id)
+        self._index(order)
+        self.stats["upserts"] += 1
+        if self._loading:
+            # The snapshot being read may not include this write yet
+            self._changes_during_load.append(("UPDATE", order_id))
+        self._notify("upsert", order)
+
+    def remove(self, order_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Write-through after we deleted or closed an order
+        """
+        order_id = str(order_id)
+        self._tombstones[order_id] = time.monotonic()
+        order = self._unindex(order_id)
+        if order is not None:
+            self.stats["removes"] += 1
+            self._notify("remove", order)
+        return order
+
+    def load(self, orders: List[Dict[str, Any]]):
+        """
+        Replace the contents with a full snapshot of the table
+        """
+        self.orders.clear()
+        self.by_user.clear()
+        self.by_symbol.clear()
+        cutoff = time.monotonic() - TOMBSTONE_TTL
+        self._tombstones = {order_id: at for order_id, at in self._tombstones.items() if at > cutoff}
+        for order in orders:
+            if str(order["id"]) not in self._tombstones:
+                self._index(order)
+        self.loaded_at = time.time()
+        self.stats["loads"] += 1
+        self._notify("load", None)
+
+    async def reload(self, fetch_all: Callable[[], Awaitable[List[Dict[str, Any]]]],
+                     fetch_one: Callable[[str], Awaitable[Optional[Dict[str, Any]]]] = db.get_order):
+        # Changes that arrive while the snapshot is being read are replayed
+        # on top of it, since the snapshot may predate them
+        self._loading = True
+        self._changes_during_load = []
+        try:
+            orders = await fetch_all()
+        finally:
+            self._loading = False
+        self.load(orders)
+        replay, self._changes_during_load = self._changes_during_load, []
+        for change_type, order_id in replay:
+            await self.apply_change(change_type, order_id, fetch_one)
+
+    async def apply_change(self, change_type: str, order_id: str,
+                           fetch_one: Callable[[str], Awaitable[Optional[Dict[str, Any]]]] = db.get_order):
+        """
+        Apply an INSERT/UPDATE/DELETE from the change feed. Rows are re-read
+        through PostgREST so they match what the rest of the API returns.
+        """
+        order_id = str(order_id)
+        self.stats["feed_changes"] += 1
+        if self._loading:
+            self._changes_during_load.append((change_type, order_id))
+            return
+        if change_type == "DELETE":
+            order = self._unindex(order_id)
+            if order is not None:
+                self._notify("remove", order)
+            return
+
+        if self._tombstoned(order_id):
+            return
+        order = await fetch_one(order_id)
+        if self._tombstoned(order_id):
+            # We removed it while the row was being read
+            return
+        if order is None:
+            removed = self._unindex(order_id)
+            if removed is not None:
+                self._notify("remove", removed)
+            return
+        self._unindex(order_id)
+        self._index(order)
+        self._notify("upsert", order)
+
+    def _tombstoned(self, order_id: str) -> bool:
+        removed_at = self._tombstones.get(order_id)
+        return removed_at is not None and time.monotonic() - removed_at < TOMBSTONE_TTL
+
+    # Reads
+
+    def get(self, order_id: str) -> Optional[Dict[str, Any]]:
+        self.stats["reads"] += 1
+        return self.orders.get(str(order_id))
+
+    def for_user(self, user_id: str) -> List[Dict[str, Any]]:
+        self.stats["reads"] += 1
+        return [self.orders[order_id] for order_id in self.by_user.get(str(user_id), ())]
+
+    def for_symbol(self, symbol: str) -> List[Dict[str, Any]]:
+        self.stats["reads"] += 1
+        return [self.orders[order_id] for order_id in self.by_symbol.get(str(symbol), ())]
+
+    def open_orders(self) -> List[Dict[str, Any]]:
+        return [order for order in self.orders.values() if (order.get("status") or "open") == "open"]
+
+    def page(self, user_id: str, limit: int = 100, cursor: Optional[str] = None,
+             symbol: Optional[str] = None, status: Optional[str] = None,
+             fields: Optional[List[str]] = None):
+        """
+        Same contract as db.list_orders (newest first, keyset cursor),
+        answered from memory. Returns (orders, next_cursor).
+        """
+        columns = db.project(fields, db.ORDER_COLUMNS, "created_at").split(",")
+        limit = max(1, min(int(limit), db.MAX_PAGE_SIZE))
+        rows = [
+            order for order in self.for_user(user_id)
+            if (symbol is None or order.get("symbol") == symbol)
+            and (status is None or order.get("status") == status)
+        ]
+        if cursor:
+            timestamp, row_id = db.decode_cursor(cursor)
+            rows = [order for order in rows if (str(order.get("created_at")), str(order["id"])) < (timestamp, row_id)]
+        rows.sort(key=lambda order: (str(order.get("created_at")), str(order["id"])), reverse=True)
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = db.encode_cursor(rows[-1], "created_at")
+        return [{column: order.get(column) for column in columns} for order in rows], next_cursor
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "ready": self.ready,
+            "loaded_at": self.loaded_at,
+            "orders": len(self.orders),
+            "users": len(self.by_user),
+            "symbols": len(self.by_symbol),
+        }
+
+
+class RealtimeChanges:
+    """
+    Supabase Realtime (Phoenix channel) subscription to postgres_changes
+    on one table; yields (type, id, record) for every INSERT/UPDATE/DELETE
+    (record is the new row, or the old one's primary key for a DELETE).
+    The table must be in the supabase_realtime publication.
+    """
+
+    def __init__(self, supabase_url: str, api_key: str, table: str = "orders",
+                 heartbeat_interval: float = 25.0):
+        self.url = (
+            supabase_url.replace("https://", "wss://", 1).rstrip("/")
+            + f"/realtime/v1/websocket?apikey={api_key}&vsn=1.0.0"
+        )
+        self.api_key = api_key
+        self.table = table
+        self.heartbeat_interval = heartbeat_interval
+        self._refs = itertools.count(1)
+
+    def _message(self, topic: str, event: str, payload: Dict[str, Any]) -> str:
+        ref = str(next(self._refs))
+        return json.dumps({"topic": topic, "event": event, "payload": payload, "ref": ref, "join_ref": ref})
+
+    async def _heartbeat(self, websocket):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            await websocket.send(self._message("phoenix", "heartbeat", {}))
+
+    async def changes(self) -> AsyncIterator[Tuple[str, str, Dict[str, Any]]]:
+        import websockets
+
+        topic = f"realtime:{self.table}-mirror"
+        async with websockets.connect(self.url, ping_interval=None, max_queue=1024) as websocket:
+            await websocket.send(self._message(topic, "phx_join", {
+                "config": {
+                    "broadcast": {"self": False},
+                    "presence": {"key": ""},
+                    "postgres_changes": [{"event": "*", "schema": "public", "table": self.table}],
+                },
+                "access_token": self.api_key,
+            }))
+            heartbeat = asyncio.ensure_future(self._heartbeat(websocket))
+            try:
+                async for raw in websocket:
+                    message = json.loads(raw)
+                    event = message.get("event")
+                    payload = message.get("payload") or {}
+                    if event == "phx_reply" and message.get("topic") == topic:
+                        if payload.get("status") != "ok":
+                            raise RuntimeError(f"Realtime join failed: {payload.get('response')}")
+                        print(f"Change feed subscribed to {self.table}")
+                    elif event in ("phx_error", "phx_close") and message.get("topic") == topic:
+                        raise RuntimeError(f"Realtime channel {event}")
+                    elif event == "postgres_changes":
+                        data = payload.get("data") or {}
+                        record = data.get("record") or data.get("old_record") or {}
+                        if data.get("type") in ("INSERT", "UPDATE", "DELETE") and record.get("id"):
+                            yield data["type"], str(record["id"]), record
+            finally:
+                heartbeat.cancel()
+
+
+class OrderMirrorSync:
+    """
+    Keeps an OrderMirror coherent: initial load, periodic full reloads and
+    the change feed (reconnecting with backoff)
+    """
+
+    def __init__(self, mirror: OrderMirror, fetch_all: Callable[[], Awaitable[List[Dict[str, Any]]]],
+                 feed: Optional[RealtimeChanges] = None,
+                 resync_interval: float = ORDER_MIRROR_RESYNC_INTERVAL, max_backoff: float = 30.0,
+                 fetch_one: Callable[[str], Awaitable[Optional[Dict[str, Any]]]] = db.get_order):
+        self.mirror = mirror
+        self.fetch_all = fetch_all
+        self.fetch_one = fetch_one
+        self.feed = feed
+        self.resync_interval = resync_interval
+        self.max_backoff = max_backoff
+        self._tasks: List[asyncio.Task] = []
+        self.stats = {"feed_connects": 0, "feed_errors": 0, "resync_errors": 0}
+
+    async def _resync_loop(self):
+        while True:
+            try:
+                await self.mirror.reload(self.fetch_all, self.fetch_one)
+                print(f"Order mirror loaded {len(self.mirror.orders)} orders")
+            except Exception as e:
+                self.stats["resync_errors"] += 1
+                print(f"Order mirror resync failed: {str(e)}")
+            await asyncio.sleep(self.resync_interval)
+
+    async def _feed_loop(self):
+        backoff = 1.0
+        while True:
+            try:
+                self.stats["feed_connects"] += 1
+                async for change_type, order_id, _ in self.feed.changes():
+                    await self.mirror.apply_change(change_type, order_id, self.fetch_one)
+                    backoff = 1.0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["feed_errors"] += 1
+                print(f"Order change feed error: {str(e)}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks.append(asyncio.ensure_future(self._resync_loop()))
+        if self.feed is not None:
+            self._tasks.append(asyncio.ensure_future(self._feed_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def status(self) -> Dict[str, Any]:
+        return {**self.mirror.status(), **self.stats, "feed": self.feed is not None}
@@ -0,0 +1,135 @@
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+def _as_float(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _clean(value: float) -> Optional[float]:
+    # NaN (no price / no level) becomes null in the JSON response
+    return None if np.isnan(value) else round(float(value), 4)
+
+
+class PositionBatch:
+    """
+    Open orders as parallel arrays, so P/L and SL/TP distances for the
+    whole batch are a handful of vector operations.
+
+    Orders have no size, so P/L and distances are percentages and
+    exposure is counted in positions.
+    """
+
+    def __init__(self, orders: List[Dict[str, Any]], prices: Dict[str, float]):
+        """
+        `prices` maps order id to the current price of its symbol
+        """
+        self.orders = orders
+        count = len(orders)
+        self.entry = np.fromiter((_as_float(order.get("entry_price")) for order in orders), dtype=np.float64, count=count)
+        self.stop_loss = np.fromiter((_as_float(order.get("stop_loss")) for order in orders), dtype=np.float64, count=count)
+        self.take_profit = np.fromiter((_as_float(order.get("take_profit")) for order in orders), dtype=np.float64, count=count)
+        self.price = np.fromiter((prices.get(str(order["id"]), np.nan) for order in orders), dtype=np.float64, count=count)
+        # +1 long, -1 short
+        self.side = np.fromiter(
+            (-1.0 if str(order.get("position_type") or "long").lower() == "short" else 1.0 for order in orders),
+            dtype=np.float64, count=count
+        )
+        self._metrics: Optional[Dict[str, np.ndarray]] = None
+
+    def compute(self) -> Dict[str, np.ndarray]:
+        if self._metrics is not None:
+            return self._metrics
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pnl = self.side * (self.price - self.entry) / self.entry * 100
+            # Positive while the level hasn't been reached yet
+            to_stop = self.side * (self.price - self.stop_loss) / self.price * 100
+            to_target = self.side * (self.take_profit - self.price) / self.price * 100
+        self._metrics = {"pnl": pnl, "to_stop": to_stop, "to_target": to_target}
+        return self._metrics
+
+    def results(self) -> List[Dict[str, Any]]:
+        metrics = self.compute()
+        return [
+            {
+                **order,
+                "current_price": _clean(self.price[i]),
+                "unrealized_pnl": _clean(metrics["pnl"][i]),
+                "distance_to_stop_loss": _clean(metrics["to_stop"][i]),
+                "distance_to_take_profit": _clean(metrics["to_target"][i]),
+            }
+            for i, order in enumerate(self.orders)
+        ]
+
+    def summary(self) -> Dict[str, Any]:
+        pnl = self.compute()["pnl"]
+        side = self.side
+        priced = pnl[~np.isnan(pnl)]
+        return {
+            "positions": int(len(pnl)),
+            "priced": int(len(priced)),
+            "long": int(np.count_nonzero(side > 0)),
+            "short": int(np.count_nonzero(side < 0)),
+            "total_pnl": _clean(priced.sum()) if len(priced) else 0.0,
+            "average_pnl": _clean(priced.mean()) if len(priced) else None,
+            "winning": int(np.count_nonzero(priced > 0)),
+            "losing": int(np.count_nonzero(priced < 0)),
+        }
+
+    def exposure(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Long/short position counts and average P/L per symbol
+        """
+        if not self.orders:
+            return {}
+        symbols, index = np.unique([str(order.get("symbol")) for order in self.orders], return_inverse=True)
+        pnl = self.compute()["pnl"]
+        priced = ~np.isnan(pnl)
+        longs = np.bincount(index, weights=self.side > 0, minlength=len(symbols))
+        shorts = np.bincount(index, weights=self.side < 0, minlength=len(symbols))
+        pnl_sum = np.bincount(index[priced], weights=pnl[priced], minlength=len(symbols))
+        pnl_count = np.bincount(index[priced], minlength=len(symbols))
+        return {
+            str(symbol): {
+                "long": int(longs[i]),
+                "short": int(shorts[i]),
+                "net": int(longs[i] - shorts[i]),
+                "average_pnl": round(float(pnl_sum[i] / pnl_count[i]), 4) if pnl_count[i] else None,
+            }
+            for i, symbol in enumerate(symbols)
+        }
+
+    def by_user(self) -> Dict[str, Dict[str, Any]]:
+        """
+        summary() per user, grouped with bincount rather than a loop
+        """
+        if not self.orders:
+            return {}
+        users, index = np.unique([str(order.get("user_id")) for order in self.orders], return_inverse=True)
+        size = len(users)
+        pnl = self.compute()["pnl"]
+        priced = ~np.isnan(pnl)
+        priced_index, priced_pnl = index[priced], pnl[priced]
+        positions = np.bincount(index, minlength=size)
+        longs = np.bincount(index, weights=self.side > 0, minlength=size)
+        priced_count = np.bincount(priced_index, minlength=size)
+        total = np.bincount(priced_index, weights=priced_pnl, minlength=size)
+        winning = np.bincount(priced_index, weights=priced_pnl > 0, minlength=size)
+        losing = np.bincount(priced_index, weights=priced_pnl < 0, minlength=size)
+        return {
+            str(user_id): {
+                "positions": int(positions[i]),
+                "priced": int(priced_count[i]),
+                "long": int(longs[i]),
+                "short": int(positions[i] - longs[i]),
+                "total_pnl": round(float(total[i]), 4),
+                "average_pnl": round(float(total[i] / priced_count[i]), 4) if priced_count[i] else None,
+                "winning": int(winning[i]),
+                "losing": int(losing[i]),
+            }
+            for i, user_id in enumerate(users)
+        }
@@ -0,0 +1,192 @@
+import mmap
+import os
+import re
+from array import array
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional
+
+PRICE_HISTORY_ENABLED = os.getenv("PRICE_HISTORY_ENABLED", "true").lower() == "true"
+PRICE_HISTORY_DIR = os.getenv("PRICE_HISTORY_DIR", os.path.join("data", "price_history"))
+
+# One file per field; open_time doubles as the time index
+FIELDS = (
+    ("open_time", "q"),
+    ("open", "d"),
+    ("high", "d"),
+    ("low", "d"),
+    ("close", "d"),
+    ("volume", "d"),
+)
+ITEM_SIZE = 8
+
+_SAFE_NAME = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class ColumnFile:
+    """
+    Append-only file of fixed-width values, read through a memory map
+    """
+
+    def __init__(self, path: str, typecode: str):
+        self.path = path
+        self.typecode = typecode
+        self._file = open(path, "ab+")
+        self._view: Optional[memoryview] = None
+        self._mapped_length = 0
+
+    def __len__(self):
+        return os.fstat(self._file.fileno()).st_size // ITEM_SIZE
+
+    def truncate(self, length: int):
+        self._view = None
+        self._file.truncate(length * ITEM_SIZE)
+
+    def append(self, values: array):
+        self._file.write(values.tobytes())
+        self._file.flush()
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+
+    def view(self) -> memoryview:
+        """
+        Zero-copy view of every value in the file
+        """
+        length = len(self)
+        if self._view is None or self._mapped_length != length:
+            if length == 0:
+                return memoryview(array(self.typecode))
+            # Old views stay valid for callers still holding slices of them
+            mapped = mmap.mmap(self._file.fileno(), length * ITEM_SIZE, access=mmap.ACCESS_READ)
+            self._view = memoryview(mapped).cast(self.typecode)
+            self._mapped_length = length
+        return self._view
+
+    def close(self):
+        self._view = None
+        self._file.close()
+
+
+class CandleSeries:
+    """
+    Columnar candle history for one symbol at one resolution
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.columns = {
+            name: ColumnFile(os.path.join(directory, f"{name}.bin"), typecode)
+            for name, typecode in FIELDS
+        }
+        # A crash between column writes can leave columns uneven; cut them
+        # back to the last complete row
+        length = min(len(column) for column in self.columns.values())
+        for column in self.columns.values():
+            if len(column) != length:
+                column.truncate(length)
+
+    def __len__(self):
+        return len(self.columns["open_time"])
+
+    def last_open_time(self) -> Optional[int]:
+        times = self.columns["open_time"].view()
+        return times[-1] if len(times) else None
+
+    def append(self, candles: Iterable[Dict[str, Any]]) -> int:
+        """
+        Append candles newer than the last stored one; returns how many
+        """
+        last = self.last_open_time()
+        rows = [candle for candle in candles if last is None or candle["open_time"] > last]
+        if not rows:
+            return 0
+        rows.sort(key=lambda candle: candle["open_time"])
+        for name, typecode in FIELDS:
+            self.columns[name].append(array(typecode, (candle[name] for candle in rows)))
+        return len(rows)
+
+    def range(self, start: Optional[int] = None, end: Optional[int] = None,
+              limit: Optional[int] = None) -> Dict[str, memoryview]:
+        """
+        Zero-copy column slices for start <= open_time < end
+        """
+        views = {name: column.view() for name, column in self.columns.items()}
+        length = min(len(view) for view in views.values())
+        times = views["open_time"]
+        first = bisect_left(times, start, 0, length) if start is not None else 0
+        last = bisect_left(times, end, 0, length) if end is not None else length
+        if limit is not None and last - first > limit:
+            first = last - limit
+        return {name: view[first:last] for name, view in views.items()}
+
+    def sync(self):
+        for column in self.columns.values():
+            column.sync()
+
+    def close(self):
+        for column in self.columns.values():
+            column.close()
+
+
+def rows(columns: Dict[str, memoryview]) -> List[Dict[str, Any]]:
+    """
+    Turn column slices into candle dicts (for JSON responses)
+    """
+    names = [name for name, _ in FIELDS]
+    return [dict(zip(names, values)) for values in zip(*(columns[name] for name in names))]
+
+
+class PriceHistoryStore:
+    """
+    On-disk candle history: <root>/<symbol>/<resolution>/<field>.bin
+    """
+
+    def __init__(self, root: str = PRICE_HISTORY_DIR):
+        self.root = root
+        self._series: Dict[str, CandleSeries] = {}
+
+    def series(self, symbol: str, resolution: str) -> CandleSeries:
+        if not _SAFE_NAME.match(symbol) or not _SAFE_NAME.match(resolution):
+            raise ValueError(f"Invalid series name: {symbol}/{resolution}")
+        key = f"{symbol}/{resolution}"
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = CandleSeries(os.path.join(self.root, symbol, resolution))
+        return series
+
+    def append(self, symbol: str, resolution: str, candles: Iterable[Dict[str, Any]]) -> int:
+        return self.series(symbol, resolution).append(candles)
+
+    def range(self, symbol: str, resolution: str, start: Optional[int] = None,
+              end: Optional[int] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        if not os.path.isdir(os.path.join(self.root, symbol, resolution)):
+            return []
+        return rows(self.series(symbol, resolution).range(start, end, limit))
+
+    def stored(self) -> List[tuple]:
+        """
+        (symbol, resolution) pairs that have data on disk
+        """
+        if not os.path.isdir(self.root):
+            return []
+        pairs = []
+        for symbol in sorted(os.listdir(self.root)):
+            symbol_dir = os.path.join(self.root, symbol)
+            if not os.path.isdir(symbol_dir):
+                continue
+            for resolution in sorted(os.listdir(symbol_dir)):
+                if os.path.isdir(os.path.join(symbol_dir, resolution)):
+                    pairs.append((symbol, resolution))
+        return pairs
+
+    def sync(self):
+        for series in self._series.values():
+            series.sync()
+
+    def close(self):
+        for series in self._series.values():
+            series.close()
+        self._series.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {key: len(series) for key, series in self._series.items()}
@@ -0,0 +1,123 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+PRICE_PERSIST_ENABLED = os.getenv("PRICE_PERSIST_ENABLED", "true").lower() == "true"
+PRICE_FLUSH_INTERVAL = float(os.getenv("PRICE_FLUSH_INTERVAL", "5"))
+PRICE_FLUSH_MAX_BATCH = int(os.getenv("PRICE_FLUSH_MAX_BATCH", "500"))
+
+
+class PricePersister:
+    """
+    Coalesces price updates into periodic multi-row upserts.
+
+    Only the last price per symbol is buffered, so the number of writes
+    depends on the flush interval, not on the tick rate. Symbols whose
+    price hasn't changed since the last successful write are skipped.
+    A flush happens every `flush_interval` seconds, or sooner once
+    `max_batch` distinct symbols are pending.
+    """
+
+    def __init__(self, write_batch: Callable[[List[Dict[str, Any]]], Awaitable[Any]],
+                 flush_interval: float = PRICE_FLUSH_INTERVAL, max_batch: int = PRICE_FLUSH_MAX_BATCH):
+        self.write_batch = write_batch
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._pending: Dict[str, Tuple[float, float]] = {}
+        self._persisted: Dict[str, float] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            "updates": 0,
+            "coalesced": 0,
+            "unchanged": 0,
+            "flushes": 0,
+            "rows_written": 0,
+            "errors": 0,
+        }
+
+    def record(self, symbol: str, price: float, timestamp: Optional[float] = None):
+        """
+        Buffer the latest price for a symbol (cheap, called on every tick)
+        """
+        self._stats["updates"] += 1
+        if symbol in self._pending:
+            self._stats["coalesced"] += 1
+        elif self._persisted.get(symbol) == price:
+            self._stats["unchanged"] += 1
+            return
+        self._pending[symbol] = (price, timestamp or time.time())
+        if len(self._pending) >= self.max_batch and self._wake is not None:
+            self._wake.set()
+
+    async def flush(self) -> int:
+        """
+        Write everything pending as one upsert; returns the rows written
+        """
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+        rows = [
+            {
+                "symbol": symbol,
+                "price": price,
+                "timestamp": datetime.fromtimestamp(timestamp, timezone.utc).isoformat(),
+            }
+            for symbol, (price, timestamp) in batch.items()
+            if self._persisted.get(symbol) != price
+        ]
+        if not rows:
+            return 0
+        try:
+            await self.write_batch(rows)
+        except Exception:
+            self._stats["errors"] += 1
+            # Put the batch back unless a newer price arrived meanwhile
+            for symbol, value in batch.items():
+                self._pending.setdefault(symbol, value)
+            raise
+        for row in rows:
+            self._persisted[row["symbol"]] = row["price"]
+        self._stats["flushes"] += 1
+        self._stats["rows_written"] += len(rows)
+        return len(rows)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error persisting prices: {str(e)}")
+
+    def start(self):
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error persisting prices: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "pending": len(self._pending),
+            "tracked_symbols": len(self._persisted),
+            "flush_interval": self.flush_interval,
+        }
@@ -0,0 +1,231 @@
+import abc
+import asyncio
+import math
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import http_client
+
+HEDGE_DELAY_MIN = float(os.getenv("PRICE_HEDGE_DELAY_MIN", "0.05"))
+HEDGE_DELAY_MAX = float(os.getenv("PRICE_HEDGE_DELAY_MAX", "0.5"))
+PRICE_SOURCE_TIMEOUT = float(os.getenv("PRICE_SOURCE_TIMEOUT", "3"))
+EWMA_ALPHA = 0.2
+
+
+class PriceUnavailable(Exception):
+    """
+    Raised when no source returned a valid price
+    """
+
+
+class SymbolNotFound(Exception):
+    """
+    Raised by a source that doesn't list the symbol
+    """
+
+
+class PriceSource(abc.ABC):
+    """
+    A market data provider returning the USD price of a base asset
+    """
+    name = "base"
+
+    def __init__(self):
+        self.requests = 0
+        self.successes = 0
+        self.errors = 0
+        self.not_found = 0
+        self.wins = 0
+        self.ewma_latency = None
+        self.ewma_error_rate = 0.0
+        self.last_error: Optional[str] = None
+
+    @abc.abstractmethod
+    async def fetch(self, base: str) -> float:
+        """
+        USD price of `base`; raises SymbolNotFound if the source doesn't list it
+        """
+
+    def record(self, latency: float, ok: bool, error: Optional[str] = None):
+        self.requests += 1
+        if ok:
+            self.successes += 1
+            self.ewma_latency = latency if self.ewma_latency is None else (
+                EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.ewma_latency
+            )
+        else:
+            self.errors += 1
+            self.last_error = error
+        self.ewma_error_rate = EWMA_ALPHA * (0.0 if ok else 1.0) + (1 - EWMA_ALPHA) * self.ewma_error_rate
+
+    def score(self) -> float:
+        """
+        Lower is better: expected latency, penalised by recent errors
+        """
+        latency = self.ewma_latency if self.ewma_latency is not None else HEDGE_DELAY_MAX
+        return latency * (1 + 4 * self.ewma_error_rate)
+
+    def hedge_delay(self) -> float:
+        # Wait roughly as long as this source usually takes before hedging
+        latency = self.ewma_latency if self.ewma_latency is not None else HEDGE_DELAY_MAX
+        return min(max(latency * 1.5, HEDGE_DELAY_MIN), HEDGE_DELAY_MAX)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "successes": self.successes,
+            "errors": self.errors,
+            "not_found": self.not_found,
+            "wins": self.wins,
+            "ewma_latency_ms": round(self.ewma_latency * 1000, 1) if self.ewma_latency is not None else None,
+            "ewma_error_rate": round(self.ewma_error_rate, 3),
+            "last_error": self.last_error,
+        }
+
+
+class BinanceSource(PriceSource):
+    name = "binance"
+
+    def __init__(self, base_url: str, symbol_for: Optional[Callable[[str], str]] = None):
+        super().__init__()
+        self.base_url = base_url
+        self.symbol_for = symbol_for or (lambda base: f"{base}USDT")
+
+    async def fetch(self, base: str) -> float:
+        try:
+            data = await http_client.get_json(f"{self.base_url}/ticker/price", params={"symbol": self.symbol_for(base)})
+        except http_client.UpstreamError as e:
+            if e.status_code == 400:
+                raise SymbolNotFound(base)
+            raise
+        return float(data["price"])
+
+
+class CoinbaseSource(PriceSource):
+    name = "coinbase"
+
+    async def fetch(self, base: str) -> float:
+        try:
+            data = await http_client.get_json(f"https://api.coinbase.com/v2/prices/{base}-USD/spot")
+        except http_client.UpstreamError as e:
+            if e.status_code in (400, 404):
+                raise SymbolNotFound(base)
+            raise
+        return float(data["data"]["amount"])
+
+
+class KrakenSource(PriceSource):
+    name = "kraken"
+
+    async def fetch(self, base: str) -> float:
+        data = await http_client.get_json("https://api.kraken.com/0/public/Ticker", params={"pair": f"{base}USD"})
+        if data.get("error"):
+            if any("Unknown asset pair" in error for error in data["error"]):
+                raise SymbolNotFound(base)
+            raise http_client.UpstreamError(", ".join(data["error"]))
+        result = next(iter(data["result"].values()))
+        return float(result["c"][0])
+
+
+class CoinCapSource(PriceSource):
+    name = "coincap"
+
+    async def fetch(self, base: str) -> float:
+        data = await http_client.get_json("https://api.coincap.io/v2/assets", params={"search": base, "limit": 10})
+        for asset in data.get("data", []):
+            if asset.get("symbol", "").upper() == base:
+                return float(asset["priceUsd"])
+        raise SymbolNotFound(base)
+
+
+def is_valid_price(price: Any) -> bool:
+    return isinstance(price, float) and math.isfinite(price) and price > 0
+
+
+class PriceAggregator:
+    """
+    Hedged price lookups across several sources.
+
+    Sources are tried in order of their recent latency and error rate. If
+    the best source hasn't answered within its usual latency, the next one
+    is fired as well, and so on; the first valid price wins and the rest are
+    cancelled. There is no mock fallback: if nothing answers, PriceUnavailable
+    is raised.
+    """
+
+    def __init__(self, sources: List[PriceSource], timeout: float = PRICE_SOURCE_TIMEOUT):
+        self.sources = sources
+        self.timeout = timeout
+
+    def ranked(self) -> List[PriceSource]:
+        return sorted(self.sources, key=lambda source: source.score())
+
+    async def _attempt(self, source: PriceSource, base: str) -> float:
+        started = time.monotonic()
+        try:
+            price = await asyncio.wait_for(source.fetch(base), timeout=self.timeout)
+        except SymbolNotFound:
+            source.not_found += 1
+            raise
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            source.record(time.monotonic() - started, ok=False, error=str(e) or type(e).__name__)
+            raise
+        if not is_valid_price(price):
+            source.record(time.monotonic() - started, ok=False, error=f"Invalid price: {price}")
+            raise ValueError(f"{source.name} returned an invalid price")
+        source.record(time.monotonic() - started, ok=True)
+        return price
+
+    async def get_price(self, base: str) -> Dict[str, Any]:
+        """
+        Return {"price", "source"} for the USD price of `base` (e.g. BTC)
+        """
+        base = base.upper()
+        pending: Dict[asyncio.Task, PriceSource] = {}
+        remaining = self.ranked()
+        not_found = 0
+        errors: List[str] = []
+
+        try:
+            while remaining or pending:
+                if remaining:
+                    source = remaining.pop(0)
+                    pending[asyncio.ensure_future(self._attempt(source, base))] = source
+                    wait_for = source.hedge_delay() if remaining else None
+                else:
+                    wait_for = None
+
+                done, _ = await asyncio.wait(pending.keys(), timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    source = pending.pop(task)
+                    if task.exception() is None:
+                        source.wins += 1
+                        return {"price": task.result(), "source": source.name}
+                    if isinstance(task.exception(), SymbolNotFound):
+                        not_found += 1
+                    else:
+                        errors.append(f"{source.name}: {str(task.exception())}")
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if not_found == len(self.sources):
+            raise SymbolNotFound(base)
+        raise PriceUnavailable(f"No price for {base}: {'; '.join(errors) or 'symbol not listed'}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {source.name: {**source.stats(), "score_ms": round(source.score() * 1000, 1)} for source in self.ranked()}
+
+
+def default_sources(binance_url: str, binance_symbol_for: Optional[Callable[[str], str]] = None) -> List[PriceSource]:
+    names = [name.strip() for name in os.getenv("PRICE_SOURCES", "binance,coinbase,kraken,coincap").split(",")]
+    available = {
+        "binance": lambda: BinanceSource(binance_url, binance_symbol_for),
+        "coinbase": CoinbaseSource,
+        "kraken": KrakenSource,
+        "coincap": CoinCapSource,
+    }
+    return [available[name]() for name in names if name in available]
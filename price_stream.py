@@ -0,0 +1,259 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Set
+
+# Feed configuration
+PRICE_FEED = os.getenv("PRICE_FEED", "binance").lower()  # binance | replay | off
+BINANCE_STREAM_URL = os.getenv("BINANCE_STREAM_URL", "wss://stream.binance.com:9443/stream")
+STREAM_CHANNEL = os.getenv("PRICE_STREAM_CHANNEL", "ticker")
+PRICE_REPLAY_FILE = os.getenv("PRICE_REPLAY_FILE", "")
+PRICE_REPLAY_SPEED = float(os.getenv("PRICE_REPLAY_SPEED", "0"))
+# Start the replay file over at EOF; off by default so old ticks are fed once
+PRICE_REPLAY_LOOP = os.getenv("PRICE_REPLAY_LOOP", "false").lower() == "true"
+
+
+class Tick:
+    """
+    A single price update
+    """
+    __slots__ = ("symbol", "price", "event_time", "received_at", "stats")
+
+    def __init__(self, symbol: str, price: float, event_time: float,
+                 received_at: Optional[float] = None, stats: Optional[Dict[str, Any]] = None):
+        self.symbol = symbol
+        self.price = price
+        self.event_time = event_time      # seconds since epoch, from the exchange
+        self.received_at = received_at if received_at is not None else time.time()
+        self.stats = stats                # 24hr ticker fields, when the feed has them
+
+
+def parse_binance_message(message: Dict[str, Any]) -> Optional[Tick]:
+    """
+    Parse a Binance stream payload (combined or raw) into a Tick
+    """
+    data = message.get("data", message)
+    symbol = data.get("s")
+    if not symbol:
+        return None
+
+    event_time = data.get("E", time.time() * 1000) / 1000
+    if data.get("e") == "24hrTicker":
+        # Same field names as the REST /ticker/24hr response
+        stats = {
+            "symbol": symbol,
+            "lastPrice": data["c"],
+            "priceChangePercent": data["P"],
+            "volume": data["v"],
+            "highPrice": data["h"],
+            "lowPrice": data["l"],
+        }
+        return Tick(symbol, float(data["c"]), event_time, stats=stats)
+    if "p" in data:
+        # trade / aggTrade
+        return Tick(symbol, float(data["p"]), event_time)
+    if "c" in data:
+        # miniTicker
+        return Tick(symbol, float(data["c"]), event_time)
+    return None
+
+
+class PriceBoard:
+    """
+    Latest known price per symbol, fanned out to listeners on every update
+    """
+
+    def __init__(self):
+        self.prices: Dict[str, float] = {}
+        self.updated_at: Dict[str, float] = {}
+        self._listeners: List[Callable[[Tick], None]] = []
+
+    def subscribe(self, listener: Callable[[Tick], None]):
+        self._listeners.append(listener)
+
+    def update(self, tick: Tick):
+        self.prices[tick.symbol] = tick.price
+        self.updated_at[tick.symbol] = tick.received_at
+        for listener in self._listeners:
+            try:
+                listener(tick)
+            except Exception as e:
+                print(f"Price listener error for {tick.symbol}: {str(e)}")
+
+    def get(self, symbol: str, max_age: Optional[float] = None) -> Optional[float]:
+        price = self.prices.get(symbol)
+        if price is None or max_age is None:
+            return price
+        if time.time() - self.updated_at.get(symbol, 0) > max_age:
+            return None
+        return price
+
+
+class BinanceStreamSource:
+    """
+    Combined Binance websocket stream. The subscribed symbol set follows
+    `symbols_provider()` and is adjusted live with SUBSCRIBE/UNSUBSCRIBE.
+    """
+
+    def __init__(self, symbols_provider: Callable[[], Iterable[str]],
+                 url: str = BINANCE_STREAM_URL, channel: str = STREAM_CHANNEL,
+                 resubscribe_interval: float = 5.0):
+        self.symbols_provider = symbols_provider
+        self.url = url
+        self.channel = channel
+        self.resubscribe_interval = resubscribe_interval
+        self._request_id = 0
+
+    def _streams(self, symbols: Iterable[str]) -> Set[str]:
+        return {f"{symbol.lower()}@{self.channel}" for symbol in symbols}
+
+    async def _send(self, websocket, method: str, streams: Set[str]):
+        self._request_id += 1
+        await websocket.send(json.dumps({"method": method, "params": sorted(streams), "id": self._request_id}))
+
+    async def ticks(self) -> AsyncIterator[Tick]:
+        import websockets
+
+        subscribed = self._streams(self.symbols_provider())
+        async with websockets.connect(self.url, ping_interval=20, max_queue=1024) as websocket:
+            print(f"Price stream connected: {self.url}")
+            if subscribed:
+                await self._send(websocket, "SUBSCRIBE", subscribed)
+            next_check = time.monotonic() + self.resubscribe_interval
+
+            while True:
+                try:
+                    raw = await asyncio.wait_for(websocket.recv(), timeout=self.resubscribe_interval)
+                except asyncio.TimeoutError:
+                    raw = None
+
+                if time.monotonic() >= next_check:
+                    # Follow the symbols we actually need
+                    wanted = self._streams(self.symbols_provider())
+                    if wanted - subscribed:
+                        await self._send(websocket, "SUBSCRIBE", wanted - subscribed)
+                    if subscribed - wanted:
+                        await self._send(websocket, "UNSUBSCRIBE", subscribed - wanted)
+                    subscribed = wanted
+                    next_check = time.monotonic() + self.resubscribe_interval
+
+                if raw is None:
+                    continue
+                message = json.loads(raw)
+                if "result" in message:
+                    # Acknowledgement of a (UN)SUBSCRIBE request
+                    continue
+                tick = parse_binance_message(message)
+                if tick is not None:
+                    yield tick
+
+
+class ReplaySource:
+    """
+    Replays ticks from a local JSON-lines file, for offline testing.
+
+    Each line is either a raw Binance stream payload or
+    {"symbol": "BTCUSDT", "price": 50000.0, "ts": 1700000000000}.
+    With speed=0 ticks are replayed as fast as possible, otherwise the
+    original spacing is kept, divided by `speed`.
+    """
+
+    def __init__(self, path: str, speed: float = PRICE_REPLAY_SPEED):
+        self.path = path
+        self.speed = speed
+
+    async def ticks(self) -> AsyncIterator[Tick]:
+        previous_time = None
+        with open(self.path, "r") as replay_file:
+            for line in replay_file:
+                line = line.strip()
+                if not line:
+                    continue
+                message = json.loads(line)
+                if "symbol" in message and "price" in message:
+                    tick = Tick(message["symbol"].upper(), float(message["price"]),
+                                message.get("ts", time.time() * 1000) / 1000)
+                else:
+                    tick = parse_binance_message(message)
+                if tick is None:
+                    continue
+
+                if self.speed > 0 and previous_time is not None:
+                    await asyncio.sleep(max(0.0, (tick.event_time - previous_time) / self.speed))
+                else:
+                    # Let other tasks run between ticks
+                    await asyncio.sleep(0)
+                previous_time = tick.event_time
+                tick.received_at = time.time()
+                yield tick
+
+
+class PriceIngestor:
+    """
+    Pumps ticks from a source into the price board, reconnecting with
+    backoff when the source drops
+    """
+
+    def __init__(self, source, board: PriceBoard, reconnect: bool = True, max_backoff: float = 30.0):
+        self.source = source
+        self.board = board
+        self.reconnect = reconnect
+        self.max_backoff = max_backoff
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "ticks": 0,
+            "connects": 0,
+            "errors": 0,
+            "last_tick_at": None,
+            "last_latency_ms": None,
+        }
+
+    async def run(self):
+        backoff = 1.0
+        while True:
+            try:
+                self.stats["connects"] += 1
+                async for tick in self.source.ticks():
+                    self.stats["ticks"] += 1
+                    self.stats["last_tick_at"] = tick.received_at
+                    self.stats["last_latency_ms"] = round((tick.received_at - tick.event_time) * 1000, 1)
+                    self.board.update(tick)
+                    backoff = 1.0
+                if not self.reconnect:
+                    return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Price stream error: {str(e)}")
+                if not self.reconnect:
+                    return
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def status(self) -> Dict[str, Any]:
+        return {"source": type(self.source).__name__, "running": self._task is not None and not self._task.done(), **self.stats}
+
+
+def create_source(symbols_provider: Callable[[], Iterable[str]]):
+    """
+    Build the source selected by PRICE_FEED, or None when streaming is off
+    """
+    if PRICE_FEED == "replay":
+        if not PRICE_REPLAY_FILE:
+            raise ValueError("PRICE_REPLAY_FILE must be set when PRICE_FEED=replay")
+        return ReplaySource(PRICE_REPLAY_FILE)
+    if PRICE_FEED == "binance":
+        return BinanceStreamSource(symbols_provider)
+    return None
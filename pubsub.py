@@ -0,0 +1,96 @@
+import asyncio
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+
+class Subscriber:
+    """
+    One push connection's outbox.
+
+    Only the latest message per topic is kept, so a slow consumer skips
+    intermediate updates instead of building an unbounded backlog.
+    """
+
+    def __init__(self):
+        self.topics: Set[str] = set()
+        self._pending: "OrderedDict[str, Any]" = OrderedDict()
+        self._ready = asyncio.Event()
+        self.sent = 0
+        self.dropped = 0
+
+    def offer(self, topic: str, message: Any):
+        if topic in self._pending:
+            # Replace the unsent update with the newer one
+            self.dropped += 1
+        self._pending[topic] = message
+        self._ready.set()
+
+    async def next_batch(self) -> List[Tuple[str, Any]]:
+        """
+        Wait for pending updates and take all of them
+        """
+        await self._ready.wait()
+        batch = list(self._pending.items())
+        self._pending.clear()
+        self._ready.clear()
+        self.sent += len(batch)
+        return batch
+
+
+class Hub:
+    """
+    Topic-based fan-out from one upstream feed to many subscribers
+    """
+
+    def __init__(self):
+        self._topics: Dict[str, Set[Subscriber]] = {}
+        self._subscribers: Set[Subscriber] = set()
+        self.published = 0
+        self._closed_sent = 0
+        self._closed_dropped = 0
+
+    def connect(self) -> Subscriber:
+        subscriber = Subscriber()
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def disconnect(self, subscriber: Subscriber):
+        self.unsubscribe(subscriber, list(subscriber.topics))
+        if subscriber in self._subscribers:
+            self._subscribers.discard(subscriber)
+            self._closed_sent += subscriber.sent
+            self._closed_dropped += subscriber.dropped
+
+    def subscribe(self, subscriber: Subscriber, topics: Iterable[str]):
+        for topic in topics:
+            self._topics.setdefault(topic, set()).add(subscriber)
+            subscriber.topics.add(topic)
+
+    def unsubscribe(self, subscriber: Subscriber, topics: Iterable[str]):
+        for topic in topics:
+            subscribers = self._topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._topics[topic]
+            subscriber.topics.discard(topic)
+
+    def publish(self, topic: str, message: Any):
+        subscribers = self._topics.get(topic)
+        if not subscribers:
+            return
+        self.published += 1
+        for subscriber in subscribers:
+            subscriber.offer(topic, message)
+
+    def topics(self, prefix: str = "") -> List[str]:
+        return [topic for topic in self._topics if topic.startswith(prefix)]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "connections": len(self._subscribers),
+            "topics": len(self._topics),
+            "published": self.published,
+            "sent": self._closed_sent + sum(subscriber.sent for subscriber in self._subscribers),
+            "dropped": self._closed_dropped + sum(subscriber.dropped for subscriber in self._subscribers),
+        }
@@ -0,0 +1,241 @@
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+# Request priorities, lowest value is served first
+HIGH = 0    # SL/TP monitoring
+NORMAL = 1  # user-facing requests
+LOW = 2     # background refreshes
+
+# Longest a request may queue for tokens before failing fast
+MAX_QUEUE_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "10"))
+
+
+class RateLimited(Exception):
+    """
+    Raised when a request can't get tokens within MAX_QUEUE_WAIT
+    """
+
+
+class TokenBucket:
+    """
+    `capacity` tokens, refilled continuously over `period` seconds
+    """
+
+    def __init__(self, capacity: float, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+
+    def wait_time(self, weight: float) -> float:
+        self._refill()
+        paused = max(0.0, self.paused_until - time.monotonic())
+        missing = min(weight, self.capacity) - self.tokens
+        return max(paused, missing / self.rate if missing > 0 else 0.0)
+
+    def take(self, weight: float) -> bool:
+        if self.wait_time(weight) > 0:
+            return False
+        self.tokens -= min(weight, self.capacity)
+        return True
+
+    def observe_used(self, used: float):
+        """
+        Sync with the usage the provider reports; never raises our budget
+        """
+        self._refill()
+        self.tokens = min(self.tokens, self.capacity - used)
+
+    def pause(self, seconds: float):
+        self._refill()
+        self.tokens = 0.0
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class Ticket:
+    """
+    One request's claim on a provider's tokens
+    """
+    __slots__ = ("weight", "priority", "future", "limiter")
+
+    def __init__(self, limiter: "ProviderLimiter", weight: float, priority: int):
+        self.limiter = limiter
+        self.weight = weight
+        self.priority = priority
+        self.future: Optional[asyncio.Future] = None
+
+    def boost(self, priority: int):
+        """
+        Raise priority, e.g. when a higher-priority request merges into this one
+        """
+        if priority < self.priority:
+            self.priority = priority
+            if self.future is not None and not self.future.done():
+                self.limiter._enqueue(self)
+
+
+class ProviderLimiter:
+    """
+    Token-bucket scheduler for one upstream provider.
+
+    Requests that can't be served immediately queue by priority, then
+    arrival order; a single dispatcher grants tokens as they refill.
+    """
+
+    def __init__(self, name: str, bucket: TokenBucket,
+                 weigh: Optional[Callable[[str, Dict[str, Any]], float]] = None,
+                 used_weight_header: Optional[str] = None):
+        self.name = name
+        self.bucket = bucket
+        self.weigh = weigh or (lambda path, params: 1)
+        self.used_weight_header = used_weight_header
+        self._queue: List[tuple] = []
+        self._sequence = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._stats = {
+            "requests": 0,
+            "weight": 0.0,
+            "queued": 0,
+            "rejected": 0,
+            "throttled": 0,
+        }
+
+    def ticket(self, url: str, params: Optional[Dict[str, Any]], priority: int) -> Ticket:
+        return Ticket(self, self.weigh(urlsplit(url).path, params or {}), priority)
+
+    async def acquire(self, ticket: Ticket):
+        self._stats["requests"] += 1
+        self._stats["weight"] += ticket.weight
+        if not self._queue and self.bucket.take(ticket.weight):
+            return
+
+        self._stats["queued"] += 1
+        ticket.future = asyncio.get_running_loop().create_future()
+        self._enqueue(ticket)
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), MAX_QUEUE_WAIT)
+        except asyncio.TimeoutError:
+            self._stats["rejected"] += 1
+            raise RateLimited(f"{self.name} rate limit: no capacity within {MAX_QUEUE_WAIT:.0f}s")
+        finally:
+            # Leaves a dead heap entry that the dispatcher skips
+            if not ticket.future.done():
+                ticket.future.cancel()
+
+    def _enqueue(self, ticket: Ticket):
+        heapq.heappush(self._queue, (ticket.priority, next(self._sequence), ticket))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    async def _dispatch(self):
+        while self._queue:
+            priority, _, ticket = self._queue[0]
+            # Skip granted/abandoned tickets and entries superseded by a boost
+            if ticket.future is None or ticket.future.done() or priority != ticket.priority:
+                heapq.heappop(self._queue)
+                continue
+            wait = self.bucket.wait_time(ticket.weight)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            heapq.heappop(self._queue)
+            self.bucket.take(ticket.weight)
+            ticket.future.set_result(None)
+
+    def observe(self, status_code: int, headers: Any):
+        """
+        Feed back provider-reported usage and 429/418 throttling
+        """
+        if self.used_weight_header:
+            used = headers.get(self.used_weight_header)
+            if used and used.isdigit():
+                self.bucket.observe_used(float(used))
+        if status_code in (418, 429):
+            self._stats["throttled"] += 1
+            retry_after = headers.get("Retry-After")
+            self.bucket.pause(float(retry_after) if retry_after and retry_after.isdigit() else 1.0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "capacity": self.bucket.capacity,
+            "available": round(self.bucket.available(), 1),
+            "waiting": sum(1 for _, _, ticket in self._queue if ticket.future is not None and not ticket.future.done()),
+        }
+
+
+def _symbol_count(params: Dict[str, Any]) -> int:
+    try:
+        return len(json.loads(params["symbols"]))
+    except (TypeError, ValueError):
+        return 1
+
+
+def binance_weight(path: str, params: Dict[str, Any]) -> float:
+    """
+    Request weight of a Binance spot REST call
+    """
+    if path.endswith("/ticker/24hr"):
+        if "symbol" in params:
+            return 2
+        if "symbols" in params:
+            count = _symbol_count(params)
+            return 2 if count <= 20 else 40 if count <= 100 else 80
+        return 80
+    if path.endswith("/ticker/price"):
+        return 2 if "symbol" in params else 4
+    if path.endswith("/exchangeInfo"):
+        return 20
+    if path.endswith("/klines"):
+        return 2
+    return 1
+
+
+def _limit(name: str, default: str) -> TokenBucket:
+    # RATE_LIMIT_<NAME>="<calls or weight>/<seconds>"
+    calls, _, period = os.getenv(f"RATE_LIMIT_{name.upper()}", default).partition("/")
+    return TokenBucket(float(calls), float(period or 60))
+
+
+def default_limiters() -> Dict[str, ProviderLimiter]:
+    """
+    Limiters keyed by host. Binance allows 6000 weight/minute; we budget
+    below that so other clients on the same IP have room.
+    """
+    binance = ProviderLimiter("binance", _limit("binance", "5000/60"), binance_weight, "X-MBX-USED-WEIGHT-1M")
+    limiters = {
+        "api.binance.com": binance,
+        "api.coinbase.com": ProviderLimiter("coinbase", _limit("coinbase", "10000/3600")),
+        "api.kraken.com": ProviderLimiter("kraken", _limit("kraken", "60/60")),
+        "api.coincap.io": ProviderLimiter("coincap", _limit("coincap", "200/60")),
+    }
+    binance_host = urlsplit(os.getenv("BINANCE_API_URL", "https://api.binance.com/api/v3")).netloc
+    limiters.setdefault(binance_host, binance)
+    return limiters
+
+
+limiters = default_limiters()
+
+
+def limiter_for(url: str) -> Optional[ProviderLimiter]:
+    return limiters.get(urlsplit(url).netloc)
+
+
+def stats() -> Dict[str, Any]:
+    return {limiter.name: limiter.stats() for limiter in limiters.values()}
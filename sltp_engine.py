@@ -0,0 +1,617 @@
+import asyncio
+import bisect
+import itertools
+import os
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+STOP_LOSS_REASON = "stop_loss_triggered"
+TAKE_PROFIT_REASON = "take_profit_triggered"
+# Starts with "stop_loss" so analytics count it as a stop-loss close
+TRAILING_STOP_REASON = "stop_loss_trailing_triggered"
+
+# fixed: stop_loss and take_profit
+# trailing_stop: a stop that follows the best price by trail_amount or
+#   trail_percent; stop_loss, if set, is a floor it never goes below
+# oco: a trailing stop and a take_profit, the first to trigger cancels the other
+ORDER_TYPES = ("fixed", "trailing_stop", "oco")
+
+
+class PriceLadder:
+    """
+    Order ids sorted by trigger price.
+
+    Lookups of every order at or above / at or below a price are
+    O(log n + k) where k is the number of orders returned.
+    """
+
+    def __init__(self):
+        self._prices: List[float] = []
+        self._order_ids: List[str] = []
+
+    def __len__(self):
+        return len(self._prices)
+
+    def add(self, price: float, order_id: str):
+        index = bisect.bisect_right(self._prices, price)
+        self._prices.insert(index, price)
+        self._order_ids.insert(index, order_id)
+
+    def remove(self, price: float, order_id: str) -> bool:
+        index = bisect.bisect_left(self._prices, price)
+        while index < len(self._prices) and self._prices[index] == price:
+            if self._order_ids[index] == order_id:
+                del self._prices[index]
+                del self._order_ids[index]
+                return True
+            index += 1
+        return False
+
+    def at_or_above(self, price: float) -> List[str]:
+        return self._order_ids[bisect.bisect_left(self._prices, price):]
+
+    def at_or_below(self, price: float) -> List[str]:
+        return self._order_ids[:bisect.bisect_right(self._prices, price)]
+
+
+class TrailGroup:
+    """
+    Trailing stops that share a running extremum, with their trails kept
+    sorted (absolute amounts and fractions of the extremum separately) so
+    the triggered ones are always a prefix. A group merged into another
+    points at it through `parent`.
+    """
+    __slots__ = ("id", "extreme", "amounts", "fractions", "parent")
+
+    def __init__(self, group_id: str, extreme: float):
+        self.id = group_id
+        self.extreme = extreme
+        self.amounts: List[Tuple[float, str]] = []
+        self.fractions: List[Tuple[float, str]] = []
+        self.parent: Optional["TrailGroup"] = None
+
+    def __len__(self):
+        return len(self.amounts) + len(self.fractions)
+
+    def add(self, order_id: str, amount: Optional[float], fraction: Optional[float]):
+        if amount is not None:
+            bisect.insort(self.amounts, (amount, order_id))
+        else:
+            bisect.insort(self.fractions, (fraction, order_id))
+
+    def remove(self, order_id: str, amount: Optional[float], fraction: Optional[float]):
+        entries, key = (self.amounts, (amount, order_id)) if amount is not None else (self.fractions, (fraction, order_id))
+        index = bisect.bisect_left(entries, key)
+        if index < len(entries) and entries[index] == key:
+            del entries[index]
+
+    def absorb(self, other: "TrailGroup"):
+        # Insert the smaller side into the larger, so an order is re-inserted
+        # O(log n) times over its lifetime
+        if len(other) > len(self):
+            self.amounts, other.amounts = other.amounts, self.amounts
+            self.fractions, other.fractions = other.fractions, self.fractions
+        for entry in other.amounts:
+            bisect.insort(self.amounts, entry)
+        for entry in other.fractions:
+            bisect.insort(self.fractions, entry)
+        other.amounts, other.fractions = [], []
+        other.parent = self
+
+    def tightest_trail(self) -> float:
+        amount = self.amounts[0][0] if self.amounts else float("inf")
+        fraction = self.fractions[0][0] * self.extreme if self.fractions else float("inf")
+        return min(amount, fraction)
+
+    def pop_triggered(self, price: float, sign: float) -> List[str]:
+        """
+        Remove and return the orders whose stop (extreme - sign * trail)
+        `price` has reached; they are a prefix of each sorted list
+        """
+        popped: List[str] = []
+        for entries, trail_of in ((self.amounts, lambda value: value),
+                                  (self.fractions, lambda value: value * self.extreme)):
+            cut = 0
+            while cut < len(entries) and sign * (self.extreme - sign * trail_of(entries[cut][0])) >= sign * price:
+                cut += 1
+            popped += [order_id for _, order_id in entries[:cut]]
+            del entries[:cut]
+        return popped
+
+
+class TrailingBook:
+    """
+    Trailing stops for one side of one symbol.
+
+    Orders are grouped by running extremum (highest price seen for longs,
+    lowest for shorts). A new extreme price collapses every group it passes
+    into one group at that price, so a tick moves all the stops it affects
+    with a merge instead of touching each order. Each tick or new order
+    creates at most one group, so a tick merges O(1) groups amortized;
+    orders find their current group through parent pointers (union-find).
+    A ladder of each group's tightest stop finds the triggered groups in
+    O(log n + k).
+    """
+
+    def __init__(self, short: bool):
+        self.sign = -1.0 if short else 1.0
+        self.keys: List[float] = []    # sign * extreme, ascending: least extreme first
+        self.groups: Dict[float, TrailGroup] = {}
+        self.by_id: Dict[str, TrailGroup] = {}
+        self.triggers = PriceLadder()  # group ids by the group's tightest stop
+        self.group_of: Dict[str, TrailGroup] = {}
+        self.trails: Dict[str, Tuple[Optional[float], Optional[float]]] = {}
+        self._ids = itertools.count()
+
+    def __len__(self):
+        return len(self.trails)
+
+    def _find(self, order_id: str) -> Optional[TrailGroup]:
+        group = self.group_of.get(order_id)
+        if group is None or group.parent is None:
+            return group
+        root = group
+        while root.parent is not None:
+            root = root.parent
+        # Path compression
+        while group.parent is not None and group.parent is not root:
+            group.parent, group = root, group.parent
+        self.group_of[order_id] = root
+        return root
+
+    def _trigger_price(self, group: TrailGroup) -> float:
+        return group.extreme - self.sign * group.tightest_trail()
+
+    def _group_at(self, extreme: float) -> TrailGroup:
+        key = self.sign * extreme
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = TrailGroup(str(next(self._ids)), extreme)
+            self.by_id[group.id] = group
+            bisect.insort(self.keys, key)
+        else:
+            self._untrack(group)
+        return group
+
+    def _track(self, group: TrailGroup):
+        if len(group):
+            self.triggers.add(self._trigger_price(group), group.id)
+        else:
+            key = self.sign * group.extreme
+            del self.groups[key]
+            del self.by_id[group.id]
+            del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def _untrack(self, group: TrailGroup):
+        if len(group):
+            self.triggers.remove(self._trigger_price(group), group.id)
+
+    def add(self, order_id: str, amount: Optional[float], fraction: Optional[float], extreme: float):
+        group = self._group_at(extreme)
+        group.add(order_id, amount, fraction)
+        self.group_of[order_id] = group
+        self.trails[order_id] = (amount, fraction)
+        self._track(group)
+
+    def remove(self, order_id: str) -> bool:
+        group = self._find(order_id)
+        if group is None:
+            return False
+        amount, fraction = self.trails.pop(order_id)
+        del self.group_of[order_id]
+        self._untrack(group)
+        group.remove(order_id, amount, fraction)
+        self._track(group)
+        return True
+
+    def extreme_of(self, order_id: str) -> Optional[float]:
+        group = self._find(order_id)
+        return group.extreme if group is not None else None
+
+    def extremes(self) -> Dict[str, float]:
+        return {order_id: self._find(order_id).extreme for order_id in self.trails}
+
+    def stop_of(self, order_id: str) -> Optional[float]:
+        group = self._find(order_id)
+        if group is None:
+            return None
+        amount, fraction = self.trails[order_id]
+        trail = amount if amount is not None else fraction * group.extreme
+        return group.extreme - self.sign * trail
+
+    def on_price(self, price: float) -> List[str]:
+        """
+        Advance the extremum to `price` and return (and unbook) the orders
+        whose trailing stop it hits
+        """
+        passed = bisect.bisect_left(self.keys, self.sign * price)
+        if passed:
+            merged = [self.groups.pop(key) for key in self.keys[:passed]]
+            del self.keys[:passed]
+            target = self._group_at(price)
+            for group in merged:
+                self.triggers.remove(self._trigger_price(group), group.id)
+                del self.by_id[group.id]
+                target.absorb(group)
+            self._track(target)
+
+        hit_ids = self.triggers.at_or_above(price) if self.sign > 0 else self.triggers.at_or_below(price)
+        triggered: List[str] = []
+        for group in [self.by_id[group_id] for group_id in hit_ids]:
+            self._untrack(group)
+            popped = group.pop_triggered(price, self.sign)
+            for order_id in popped:
+                del self.group_of[order_id]
+                del self.trails[order_id]
+            triggered.extend(popped)
+            self._track(group)
+        return triggered
+
+
+class SymbolBook:
+    """
+    Stop and target ladders for every open order on one symbol
+    """
+
+    def __init__(self):
+        self.long_stops = PriceLadder()     # LONG stop hits when price <= stop_loss
+        self.long_targets = PriceLadder()   # LONG target hits when price >= take_profit
+        self.short_stops = PriceLadder()    # SHORT stop hits when price >= stop_loss
+        self.short_targets = PriceLadder()  # SHORT target hits when price <= take_profit
+        self.long_trails = TrailingBook(short=False)
+        self.short_trails = TrailingBook(short=True)
+
+    def __len__(self):
+        return (len(self.long_stops) + len(self.long_targets) + len(self.short_stops)
+                + len(self.short_targets) + len(self.long_trails) + len(self.short_trails))
+
+    def ladders_for(self, is_short: bool) -> Tuple[PriceLadder, PriceLadder]:
+        if is_short:
+            return self.short_stops, self.short_targets
+        return self.long_stops, self.long_targets
+
+    def trails_for(self, is_short: bool) -> TrailingBook:
+        return self.short_trails if is_short else self.long_trails
+
+    def triggered(self, price: float) -> List[Tuple[str, str]]:
+        """
+        Return (order_id, close_reason) for every order hit at `price`.
+        Stops are checked before targets, like the JS monitor.
+        """
+        hits: Dict[str, str] = {}
+        for order_id in self.long_stops.at_or_above(price):
+            hits.setdefault(order_id, STOP_LOSS_REASON)
+        for order_id in self.short_stops.at_or_below(price):
+            hits.setdefault(order_id, STOP_LOSS_REASON)
+        for trails in (self.long_trails, self.short_trails):
+            for order_id in trails.on_price(price):
+                hits.setdefault(order_id, TRAILING_STOP_REASON)
+        for order_id in self.long_targets.at_or_below(price):
+            hits.setdefault(order_id, TAKE_PROFIT_REASON)
+        for order_id in self.short_targets.at_or_above(price):
+            hits.setdefault(order_id, TAKE_PROFIT_REASON)
+        return list(hits.items())
+
+
+def is_short(order: Dict[str, Any]) -> bool:
+    return str(order.get("position_type") or "long").lower() == "short"
+
+
+def order_type(order: Dict[str, Any]) -> str:
+    return str(order.get("order_type") or "fixed").lower()
+
+
+def _number(value: Any) -> Optional[float]:
+    return float(value) if value is not None else None
+
+
+def validate_order(order: Dict[str, Any]) -> Optional[str]:
+    """
+    Error message if the order's type and levels don't fit together
+    """
+    kind = order_type(order)
+    if kind not in ORDER_TYPES:
+        return f"order_type must be one of {', '.join(ORDER_TYPES)}"
+    if kind == "fixed":
+        if order.get("stop_loss") is None or order.get("take_profit") is None:
+            return "fixed orders need stop_loss and take_profit"
+        return None
+    amount, percent = _number(order.get("trail_amount")), _number(order.get("trail_percent"))
+    if (amount is None) == (percent is None):
+        return f"{kind} orders need exactly one of trail_amount or trail_percent"
+    if (amount is not None and amount <= 0) or (percent is not None and not 0 < percent < 100):
+        return "trail_amount must be positive and trail_percent between 0 and 100"
+    if kind == "oco" and order.get("take_profit") is None:
+        return "oco orders need a take_profit"
+    if kind == "trailing_stop" and order.get("take_profit") is not None:
+        return "trailing_stop orders have no take_profit; use an oco order"
+    return None
+
+
+def calculate_profit_loss(order: Dict[str, Any], close_price: float) -> float:
+    """
+    Percentage profit/loss for closing `order` at `close_price`
+    """
+    entry_price = float(order["entry_price"])
+    if is_short(order):
+        return ((entry_price - close_price) / entry_price) * 100
+    return ((close_price - entry_price) / entry_price) * 100
+
+
+class SLTPEngine:
+    """
+    Server-side stop-loss/take-profit engine.
+
+    Open orders are kept in per-symbol price ladders so each price tick only
+    touches the orders it actually triggers. Triggered orders are handed to
+    `close_order(order, close_price, close_reason)`.
+    """
+
+    def __init__(
+        self,
+        close_order: Callable[[Dict[str, Any], float, str], Awaitable[Any]],
+        load_orders: Callable[[], Awaitable[List[Dict[str, Any]]]],
+        fetch_prices: Callable[[List[str]], Awaitable[Dict[str, float]]],
+        symbol_key: Callable[[Dict[str, Any]], Optional[str]],
+        poll_interval: float = 2.0,
+        resync_interval: float = 60.0,
+        save_trail_extremes: Optional[Callable[[Dict[str, float]], Awaitable[Any]]] = None,
+        trail_flush_interval: float = 15.0,
+    ):
+        self.close_order = close_order
+        self.save_trail_extremes = save_trail_extremes
+        self.load_orders = load_orders
+        self.fetch_prices = fetch_prices
+        self.symbol_key = symbol_key
+        self.poll_interval = poll_interval
+        self.resync_interval = resync_interval
+        self.trail_flush_interval = trail_flush_interval
+
+        self.orders: Dict[str, Dict[str, Any]] = {}
+        self.order_symbols: Dict[str, str] = {}
+        self.books: Dict[str, SymbolBook] = {}
+        self._closing: set = set()
+        self._tasks: List[asyncio.Task] = []
+        self._background: set = set()
+        # Trailing extremes last written to the database, by order id
+        self._saved_extremes: Dict[str, float] = {}
+        self.stats = {"ticks": 0, "triggered": 0, "closed": 0, "close_errors": 0}
+
+    # Order book maintenance
+
+    def add_order(self, order: Dict[str, Any], extreme: Optional[float] = None):
+        """
+        Book an order's legs. For trailing orders the running extremum
+        starts at the best of entry price, the stored trail_extreme and
+        `extreme` (what we had tracked before a reload).
+        """
+        order_id = str(order.get("id"))
+        symbol = self.symbol_key(order)
+        if not symbol or validate_order(order) is not None:
+            return
+        if order_id in self.orders:
+            tracked = self.trailing_extreme(order_id)
+            self.remove_order(order_id)
+            extreme = tracked if extreme is None else extreme
+
+        book = self.books.get(symbol)
+        if book is None:
+            book = self.books[symbol] = SymbolBook()
+
+        short = is_short(order)
+        stops, targets = book.ladders_for(short)
+        if order.get("stop_loss") is not None:
+            stops.add(float(order["stop_loss"]), order_id)
+        if order.get("take_profit") is not None:
+            targets.add(float(order["take_profit"]), order_id)
+        if order_type(order) != "fixed":
+            candidates = [float(order["entry_price"])] + [
+                float(value) for value in (order.get("trail_extreme"), extreme) if value is not None
+            ]
+            percent = _number(order.get("trail_percent"))
+            book.trails_for(short).add(
+                order_id,
+                _number(order.get("trail_amount")),
+                percent / 100 if percent is not None else None,
+                min(candidates) if short else max(candidates)
+            )
+            if order.get("trail_extreme") is not None:
+                self._saved_extremes.setdefault(order_id, float(order["trail_extreme"]))
+        self.orders[order_id] = order
+        self.order_symbols[order_id] = symbol
+
+    def remove_order(self, order_id: str) -> Optional[Dict[str, Any]]:
+        order_id = str(order_id)
+        order = self.orders.pop(order_id, None)
+        symbol = self.order_symbols.pop(order_id, None)
+        if order is None or symbol is None:
+            return None
+
+        book = self.books.get(symbol)
+        if book is not None:
+            short = is_short(order)
+            stops, targets = book.ladders_for(short)
+            if order.get("stop_loss") is not None:
+                stops.remove(float(order["stop_loss"]), order_id)
+            if order.get("take_profit") is not None:
+                targets.remove(float(order["take_profit"]), order_id)
+            book.trails_for(short).remove(order_id)
+            if not len(book):
+                del self.books[symbol]
+        return order
+
+    def load(self, orders: Iterable[Dict[str, Any]]):
+        """
+        Rebuild the books from a full list of open orders, keeping the
+        trailing extremes tracked so far (the stored ones may lag)
+        """
+        extremes = self.trailing_extremes()
+        self.orders.clear()
+        self.order_symbols.clear()
+        self.books.clear()
+        for order in orders:
+            order_id = str(order.get("id"))
+            if order_id not in self._closing:
+                self.add_order(order, extremes.get(order_id))
+
+    def trailing_extreme(self, order_id: str) -> Optional[float]:
+        order = self.orders.get(order_id)
+        book = self.books.get(self.order_symbols.get(order_id, ""))
+        if order is None or book is None:
+            return None
+        return book.trails_for(is_short(order)).extreme_of(order_id)
+
+    def trailing_extremes(self) -> Dict[str, float]:
+        extremes: Dict[str, float] = {}
+        for book in self.books.values():
+            extremes.update(book.long_trails.extremes())
+            extremes.update(book.short_trails.extremes())
+        return extremes
+
+    def trailing_stop(self, order_id: str) -> Optional[float]:
+        """
+        Current trailing stop price of an order (None if it has none)
+        """
+        order = self.orders.get(str(order_id))
+        book = self.books.get(self.order_symbols.get(str(order_id), ""))
+        if order is None or book is None:
+            return None
+        return book.trails_for(is_short(order)).stop_of(str(order_id))
+
+    def symbols(self) -> List[str]:
+        return list(self.books.keys())
+
+    # Price evaluation
+
+    def on_price(self, symbol: str, price: float) -> List[Tuple[Dict[str, Any], str]]:
+        """
+        Evaluate a price tick, returning and unbooking the triggered orders
+        """
+        book = self.books.get(symbol)
+        if book is None:
+            return []
+
+        triggered = []
+        for order_id, reason in book.triggered(price):
+            order = self.remove_order(order_id)
+            if order is not None:
+                triggered.append((order, reason))
+        return triggered
+
+    async def process_tick(self, symbol: str, price: float):
+        self.stats["ticks"] += 1
+        triggered = self.on_price(symbol, price)
+        if not triggered:
+            return
+        self.stats["triggered"] += len(triggered)
+        await asyncio.gather(*(self._close(order, price, reason) for order, reason in triggered))
+
+    def submit_tick(self, symbol: str, price: float):
+        """
+        Evaluate a tick synchronously and close triggered orders in the
+        background (used by the streaming price feed)
+        """
+        self.stats["ticks"] += 1
+        triggered = self.on_price(symbol, price)
+        if not triggered:
+            return
+        self.stats["triggered"] += len(triggered)
+        for order, reason in triggered:
+            self._closing.add(str(order["id"]))
+            task = asyncio.ensure_future(self._close(order, price, reason))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    async def _close(self, order: Dict[str, Any], price: float, reason: str):
+        order_id = str(order["id"])
+        self._closing.add(order_id)
+        try:
+            print(f"Closing order {order_id} due to {reason} at price {price}")
+            await self.close_order(order, price, reason)
+            self.stats["closed"] += 1
+        except Exception as e:
+            self.stats["close_errors"] += 1
+            print(f"Error closing order {order_id}: {str(e)}")
+            # Put it back so the next tick retries, unless it is already gone
+            if "not found" not in str(e).lower():
+                self.add_order(order)
+        finally:
+            self._closing.discard(order_id)
+
+    # Background loops
+
+    async def _poll_loop(self):
+        while True:
+            symbols = self.symbols()
+            if symbols:
+                try:
+                    prices = await self.fetch_prices(symbols)
+                    for symbol, price in prices.items():
+                        await self.process_tick(symbol, price)
+                except Exception as e:
+                    print(f"SL/TP engine price poll failed: {str(e)}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _resync_loop(self):
+        # Orders are also written straight from the frontend, so reload the
+        # full set of open orders periodically
+        while True:
+            try:
+                orders = await self.load_orders()
+                self.load(orders)
+                print(f"SL/TP engine tracking {len(self.orders)} orders across {len(self.books)} symbols")
+            except Exception as e:
+                print(f"SL/TP engine resync failed: {str(e)}")
+            await asyncio.sleep(self.resync_interval)
+
+    async def flush_trail_extremes(self) -> int:
+        """
+        Write trailing extremes that moved since the last flush, so stops
+        survive a restart; returns the number of orders written
+        """
+        extremes = self.trailing_extremes()
+        changed = {
+            order_id: extreme for order_id, extreme in extremes.items()
+            if self._saved_extremes.get(order_id) != extreme
+        }
+        if changed:
+            await self.save_trail_extremes(changed)
+        self._saved_extremes = {order_id: extremes[order_id] for order_id in extremes}
+        return len(changed)
+
+    async def _trail_flush_loop(self):
+        while True:
+            await asyncio.sleep(self.trail_flush_interval)
+            try:
+                await self.flush_trail_extremes()
+            except Exception as e:
+                print(f"SL/TP engine failed to save trailing stops: {str(e)}")
+
+    def start(self, poll: bool = True):
+        if self._tasks:
+            return
+        self._tasks.append(asyncio.ensure_future(self._resync_loop()))
+        if self.save_trail_extremes is not None:
+            self._tasks.append(asyncio.ensure_future(self._trail_flush_loop()))
+        if poll:
+            self._tasks.append(asyncio.ensure_future(self._poll_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "open_orders": len(self.orders),
+            "trailing_orders": sum(len(book.long_trails) + len(book.short_trails) for book in self.books.values()),
+            "symbols": len(self.books),
+            "closing": len(self._closing),
+        }
+
+
+ENGINE_ENABLED = os.getenv("SLTP_ENGINE_ENABLED", "true").lower() == "true"
+POLL_INTERVAL = float(os.getenv("SLTP_POLL_INTERVAL", "2"))
+RESYNC_INTERVAL = float(os.getenv("SLTP_RESYNC_INTERVAL", "60"))
+TRAIL_FLUSH_INTERVAL = float(os.getenv("SLTP_TRAIL_FLUSH_INTERVAL", "15"))
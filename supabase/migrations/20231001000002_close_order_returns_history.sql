@@ -0,0 +1,90 @@
+-- Close an order in a single round trip: the order is deleted and its
+-- history row inserted in one transaction, and the history row is returned.
+-- profit_loss is calculated here when the caller doesn't pass it.
+DROP FUNCTION IF EXISTS close_order_transaction(UUID, NUMERIC, NUMERIC, TEXT);
+
+CREATE OR REPLACE FUNCTION close_order_transaction(
+  order_id UUID,
+  close_price NUMERIC,
+  profit_loss NUMERIC DEFAULT NULL,
+  close_reason TEXT DEFAULT 'manual'
+) RETURNS order_history AS $$
+DECLARE
+  order_record orders%ROWTYPE;
+  history_record order_history%ROWTYPE;
+BEGIN
+  -- Remove the order, locking it against concurrent closes
+  DELETE FROM orders WHERE id = close_order_transaction.order_id
+  RETURNING * INTO order_record;
+
+  -- Make sure the order exists
+  IF NOT FOUND THEN
+    RAISE EXCEPTION 'Order with ID % not found', close_order_transaction.order_id;
+  END IF;
+
+  -- Insert into order_history
+  INSERT INTO order_history (
+    id,
+    order_id,
+    user_id,
+    symbol,
+    entry_price,
+    stop_loss,
+    take_profit,
+    position_type,
+    close_price,
+    profit_loss,
+    close_reason,
+    created_at,
+    closed_at
+  ) VALUES (
+    uuid_generate_v4(),
+    order_record.id,
+    order_record.user_id,
+    order_record.symbol,
+    order_record.entry_price,
+    order_record.stop_loss,
+    order_record.take_profit,
+    order_record.position_type,
+    close_order_transaction.close_price,
+    COALESCE(
+      close_order_transaction.profit_loss,
+      CASE
+        WHEN lower(COALESCE(order_record.position_type, 'long')) = 'short'
+          THEN ((order_record.entry_price - close_order_transaction.close_price) / order_record.entry_price) * 100
+        ELSE ((close_order_transaction.close_price - order_record.entry_price) / order_record.entry_price) * 100
+      END
+    ),
+    COALESCE(close_order_transaction.close_reason, 'manual'),
+    order_record.created_at,
+    NOW()
+  )
+  RETURNING * INTO history_record;
+
+  RETURN history_record;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Bulk variant: closes every order in `closes` in one transaction.
+-- `closes` is a JSON array of {order_id, close_price, profit_loss?, close_reason?}.
+-- Orders that no longer exist are skipped; the closed history rows are returned.
+CREATE OR REPLACE FUNCTION close_orders_transaction(
+  closes JSONB
+) RETURNS SETOF order_history AS $$
+DECLARE
+  close_item JSONB;
+BEGIN
+  FOR close_item IN SELECT * FROM jsonb_array_elements(closes)
+  LOOP
+    IF EXISTS (SELECT 1 FROM orders WHERE id = (close_item->>'order_id')::UUID) THEN
+      RETURN NEXT close_order_transaction(
+        (close_item->>'order_id')::UUID,
+        (close_item->>'close_price')::NUMERIC,
+        (close_item->>'profit_loss')::NUMERIC,
+        COALESCE(close_item->>'close_reason', 'manual')
+      );
+    END IF;
+  END LOOP;
+  RETURN;
+END;
+$$ LANGUAGE plpgsql;
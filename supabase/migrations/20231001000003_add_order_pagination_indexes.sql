@@ -0,0 +1,7 @@
+-- Keyset pagination indexes for GET /orders/{user_id} and GET /order-history/{user_id}.
+-- Pages are ordered by (created_at, id) and (closed_at, id) descending per user.
+CREATE INDEX IF NOT EXISTS idx_orders_user_created_at_id
+  ON orders (user_id, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_order_history_user_closed_at_id
+  ON order_history (user_id, closed_at DESC, id DESC);
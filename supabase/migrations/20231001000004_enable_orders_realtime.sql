@@ -0,0 +1,12 @@
+-- Publish changes to orders over Supabase Realtime so the API's in-memory
+-- orders mirror sees inserts/updates/deletes made directly by the frontend.
+DO $$
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM pg_publication_tables
+    WHERE pubname = 'supabase_realtime' AND schemaname = 'public' AND tablename = 'orders'
+  ) THEN
+    ALTER PUBLICATION supabase_realtime ADD TABLE orders;
+  END IF;
+END;
+$$;
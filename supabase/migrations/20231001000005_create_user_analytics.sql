@@ -0,0 +1,155 @@
+-- Per-user trading performance, maintained incrementally.
+-- Every order_history insert (API closes, bulk closes and closes written
+-- directly by the frontend) folds the trade into its user's row in O(1):
+-- counts, sums and sums of squares for P/L and R-multiples, plus running
+-- equity, peak equity and max drawdown (all in percent, as profit_loss is).
+CREATE TABLE IF NOT EXISTS user_analytics (
+  user_id TEXT PRIMARY KEY,
+  trades INTEGER NOT NULL DEFAULT 0,
+  wins INTEGER NOT NULL DEFAULT 0,
+  losses INTEGER NOT NULL DEFAULT 0,
+  pnl_sum NUMERIC NOT NULL DEFAULT 0,
+  pnl_sum_sq NUMERIC NOT NULL DEFAULT 0,
+  gross_profit NUMERIC NOT NULL DEFAULT 0,
+  gross_loss NUMERIC NOT NULL DEFAULT 0,
+  best_trade NUMERIC,
+  worst_trade NUMERIC,
+  r_trades INTEGER NOT NULL DEFAULT 0,
+  r_sum NUMERIC NOT NULL DEFAULT 0,
+  r_sum_sq NUMERIC NOT NULL DEFAULT 0,
+  equity NUMERIC NOT NULL DEFAULT 0,
+  max_equity NUMERIC NOT NULL DEFAULT 0,
+  max_drawdown NUMERIC NOT NULL DEFAULT 0,
+  stop_loss_closes INTEGER NOT NULL DEFAULT 0,
+  take_profit_closes INTEGER NOT NULL DEFAULT 0,
+  first_closed_at TIMESTAMPTZ,
+  last_closed_at TIMESTAMPTZ,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE OR REPLACE FUNCTION record_trade_analytics(
+  p_user_id TEXT,
+  p_profit_loss NUMERIC,
+  p_r_multiple NUMERIC,
+  p_close_reason TEXT,
+  p_closed_at TIMESTAMPTZ
+) RETURNS VOID AS $$
+BEGIN
+  INSERT INTO user_analytics AS ua (
+    user_id, trades, wins, losses, pnl_sum, pnl_sum_sq, gross_profit, gross_loss,
+    best_trade, worst_trade, r_trades, r_sum, r_sum_sq,
+    equity, max_equity, max_drawdown, stop_loss_closes, take_profit_closes,
+    first_closed_at, last_closed_at, updated_at
+  ) VALUES (
+    p_user_id,
+    1,
+    CASE WHEN p_profit_loss > 0 THEN 1 ELSE 0 END,
+    CASE WHEN p_profit_loss < 0 THEN 1 ELSE 0 END,
+    p_profit_loss,
+    p_profit_loss * p_profit_loss,
+    GREATEST(p_profit_loss, 0),
+    LEAST(p_profit_loss, 0),
+    p_profit_loss,
+    p_profit_loss,
+    CASE WHEN p_r_multiple IS NULL THEN 0 ELSE 1 END,
+    COALESCE(p_r_multiple, 0),
+    COALESCE(p_r_multiple * p_r_multiple, 0),
+    -- Equity starts at 0, which counts as the first peak
+    p_profit_loss,
+    GREATEST(p_profit_loss, 0),
+    GREATEST(-p_profit_loss, 0),
+    CASE WHEN p_close_reason LIKE 'stop_loss%' THEN 1 ELSE 0 END,
+    CASE WHEN p_close_reason LIKE 'take_profit%' THEN 1 ELSE 0 END,
+    p_closed_at,
+    p_closed_at,
+    NOW()
+  )
+  ON CONFLICT (user_id) DO UPDATE SET
+    trades = ua.trades + 1,
+    wins = ua.wins + EXCLUDED.wins,
+    losses = ua.losses + EXCLUDED.losses,
+    pnl_sum = ua.pnl_sum + EXCLUDED.pnl_sum,
+    pnl_sum_sq = ua.pnl_sum_sq + EXCLUDED.pnl_sum_sq,
+    gross_profit = ua.gross_profit + EXCLUDED.gross_profit,
+    gross_loss = ua.gross_loss + EXCLUDED.gross_loss,
+    best_trade = GREATEST(ua.best_trade, EXCLUDED.best_trade),
+    worst_trade = LEAST(ua.worst_trade, EXCLUDED.worst_trade),
+    r_trades = ua.r_trades + EXCLUDED.r_trades,
+    r_sum = ua.r_sum + EXCLUDED.r_sum,
+    r_sum_sq = ua.r_sum_sq + EXCLUDED.r_sum_sq,
+    equity = ua.equity + EXCLUDED.equity,
+    max_equity = GREATEST(ua.max_equity, ua.equity + EXCLUDED.equity),
+    max_drawdown = GREATEST(
+      ua.max_drawdown,
+      GREATEST(ua.max_equity, ua.equity + EXCLUDED.equity) - (ua.equity + EXCLUDED.equity)
+    ),
+    stop_loss_closes = ua.stop_loss_closes + EXCLUDED.stop_loss_closes,
+    take_profit_closes = ua.take_profit_closes + EXCLUDED.take_profit_closes,
+    first_closed_at = LEAST(ua.first_closed_at, EXCLUDED.first_closed_at),
+    last_closed_at = GREATEST(ua.last_closed_at, EXCLUDED.last_closed_at),
+    updated_at = NOW();
+END;
+$$ LANGUAGE plpgsql;
+
+-- R-multiple: P/L in units of the initial risk (entry to stop loss)
+CREATE OR REPLACE FUNCTION trade_r_multiple(
+  entry_price NUMERIC,
+  stop_loss NUMERIC,
+  profit_loss NUMERIC
+) RETURNS NUMERIC AS $$
+  SELECT CASE
+    WHEN entry_price IS NULL OR entry_price = 0 OR stop_loss IS NULL OR stop_loss = entry_price THEN NULL
+    ELSE profit_loss / (ABS(entry_price - stop_loss) / entry_price * 100)
+  END;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION order_history_analytics_trigger() RETURNS TRIGGER AS $$
+BEGIN
+  IF NEW.profit_loss IS NOT NULL AND NEW.user_id IS NOT NULL THEN
+    PERFORM record_trade_analytics(
+      NEW.user_id::TEXT,
+      NEW.profit_loss,
+      trade_r_multiple(NEW.entry_price, NEW.stop_loss, NEW.profit_loss),
+      NEW.close_reason,
+      COALESCE(NEW.closed_at, NOW())
+    );
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS order_history_analytics ON order_history;
+CREATE TRIGGER order_history_analytics
+  AFTER INSERT ON order_history
+  FOR EACH ROW EXECUTE FUNCTION order_history_analytics_trigger();
+
+-- Rebuild every user's row from order_history, oldest trade first so
+-- equity and drawdown come out as they would have incrementally
+CREATE OR REPLACE FUNCTION backfill_user_analytics() RETURNS INTEGER AS $$
+DECLARE
+  trade RECORD;
+  replayed INTEGER := 0;
+BEGIN
+  LOCK TABLE order_history IN SHARE MODE;
+  DELETE FROM user_analytics;
+  FOR trade IN
+    SELECT user_id, entry_price, stop_loss, profit_loss, close_reason, closed_at
+    FROM order_history
+    WHERE profit_loss IS NOT NULL AND user_id IS NOT NULL
+    ORDER BY closed_at, id
+  LOOP
+    PERFORM record_trade_analytics(
+      trade.user_id::TEXT,
+      trade.profit_loss,
+      trade_r_multiple(trade.entry_price, trade.stop_loss, trade.profit_loss),
+      trade.close_reason,
+      trade.closed_at
+    );
+    replayed := replayed + 1;
+  END LOOP;
+  RETURN replayed;
+END;
+$$ LANGUAGE plpgsql;
+
+-- One-time backfill of existing history
+SELECT backfill_user_analytics();
@@ -0,0 +1,12 @@
+-- Publish order_history inserts over Supabase Realtime so the API's
+-- leaderboard picks up trades closed directly by the frontend.
+DO $$
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM pg_publication_tables
+    WHERE pubname = 'supabase_realtime' AND schemaname = 'public' AND tablename = 'order_history'
+  ) THEN
+    ALTER PUBLICATION supabase_realtime ADD TABLE order_history;
+  END IF;
+END;
+$$;
@@ -0,0 +1,53 @@
+-- Trailing-stop and one-cancels-other orders.
+-- order_type: 'fixed' (stop_loss + take_profit), 'trailing_stop' (a stop
+-- trail_amount or trail_percent behind the best price; stop_loss is an
+-- optional floor) or 'oco' (trailing stop + take_profit).
+-- trail_extreme is the best price seen since the order opened (highest
+-- for longs, lowest for shorts), advanced by the API's SL/TP engine.
+ALTER TABLE orders
+  ADD COLUMN IF NOT EXISTS order_type TEXT NOT NULL DEFAULT 'fixed',
+  ADD COLUMN IF NOT EXISTS trail_amount NUMERIC,
+  ADD COLUMN IF NOT EXISTS trail_percent NUMERIC,
+  ADD COLUMN IF NOT EXISTS trail_extreme NUMERIC;
+
+-- Trailing orders may have no fixed stop or target
+ALTER TABLE orders ALTER COLUMN stop_loss DROP NOT NULL;
+ALTER TABLE orders ALTER COLUMN take_profit DROP NOT NULL;
+-- close_order_transaction and close_orders_transaction copy both into
+-- order_history, so closing such an order needs them nullable there too
+ALTER TABLE order_history ALTER COLUMN stop_loss DROP NOT NULL;
+ALTER TABLE order_history ALTER COLUMN take_profit DROP NOT NULL;
+
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'orders_order_type_check') THEN
+    ALTER TABLE orders ADD CONSTRAINT orders_order_type_check CHECK (
+      order_type IN ('fixed', 'trailing_stop', 'oco')
+      AND (order_type = 'fixed' OR (trail_amount IS NULL) <> (trail_percent IS NULL))
+    );
+  END IF;
+END;
+$$;
+
+-- Batch update of trailing extremes: `updates` is a JSON array of
+-- {id, trail_extreme}. An extreme only ever moves in the order's favor,
+-- so a late or repeated write can't loosen a stop.
+CREATE OR REPLACE FUNCTION update_trail_extremes(
+  updates JSONB
+) RETURNS INTEGER AS $$
+DECLARE
+  updated INTEGER;
+BEGIN
+  UPDATE orders o
+  SET trail_extreme = CASE
+    WHEN LOWER(COALESCE(o.position_type, 'long')) = 'short'
+      THEN LEAST(COALESCE(o.trail_extreme, u.trail_extreme), u.trail_extreme)
+    ELSE GREATEST(COALESCE(o.trail_extreme, u.trail_extreme), u.trail_extreme)
+  END
+  FROM jsonb_to_recordset(updates) AS u(id TEXT, trail_extreme NUMERIC)
+  WHERE o.id::TEXT = u.id
+    AND o.order_type <> 'fixed';
+  GET DIAGNOSTICS updated = ROW_COUNT;
+  RETURN updated;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,31 @@
+-- Bulk close: skip orders that can't be closed instead of failing the batch.
+-- An order deleted between the existence check and close_order_transaction
+-- (a concurrent close) made that function raise and roll back every close in
+-- the call, and so did an order_id that isn't a valid UUID. Each close now
+-- runs in its own subtransaction and those two errors only skip that item.
+CREATE OR REPLACE FUNCTION close_orders_transaction(
+  closes JSONB
+) RETURNS SETOF order_history AS $$
+DECLARE
+  close_item JSONB;
+  history_record order_history%ROWTYPE;
+BEGIN
+  FOR close_item IN SELECT * FROM jsonb_array_elements(closes)
+  LOOP
+    BEGIN
+      history_record := close_order_transaction(
+        (close_item->>'order_id')::UUID,
+        (close_item->>'close_price')::NUMERIC,
+        (close_item->>'profit_loss')::NUMERIC,
+        COALESCE(close_item->>'close_reason', 'manual')
+      );
+      RETURN NEXT history_record;
+    EXCEPTION
+      -- raise_exception: close_order_transaction found no such order
+      WHEN raise_exception OR invalid_text_representation THEN
+        NULL;
+    END;
+  END LOOP;
+  RETURN;
+END;
+$$ LANGUAGE plpgsql;
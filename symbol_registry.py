@@ -0,0 +1,130 @@
+import os
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import http_client
+import rate_limits
+
+DEFAULT_QUOTE = os.getenv("DEFAULT_QUOTE_ASSET", "USDT").upper()
+SYMBOL_REFRESH_INTERVAL = float(os.getenv("SYMBOL_REFRESH_INTERVAL", "21600"))
+# Base assets shown by /top-cryptos and always streamed
+WATCHLIST = [
+    base.strip().upper()
+    for base in os.getenv("WATCHLIST", "BTC,ETH,BNB,SOL").split(",")
+    if base.strip()
+]
+MAX_WATCHLIST = int(os.getenv("MAX_WATCHLIST", "100"))
+
+_SEPARATORS = ("/", "-", "_")
+
+
+class SymbolInfo(NamedTuple):
+    symbol: str
+    base: str
+    quote: str
+    status: str
+
+
+class SymbolRegistry:
+    """
+    Exchange symbols indexed by pair name and by (base, quote).
+
+    Until exchange info has been loaded, symbols are resolved by appending
+    the default quote asset, which is what every caller did before.
+    """
+
+    def __init__(self, default_quote: str = DEFAULT_QUOTE):
+        self.default_quote = default_quote
+        self.symbols: Dict[str, SymbolInfo] = {}
+        self.pairs: Dict[Tuple[str, str], SymbolInfo] = {}
+        self.loaded_at: Optional[float] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.loaded_at is not None
+
+    def load(self, exchange_info: Dict[str, Any]):
+        """
+        Rebuild the indexes from a Binance /exchangeInfo response
+        """
+        symbols: Dict[str, SymbolInfo] = {}
+        pairs: Dict[Tuple[str, str], SymbolInfo] = {}
+        for item in exchange_info.get("symbols", []):
+            info = SymbolInfo(
+                item["symbol"].upper(),
+                item["baseAsset"].upper(),
+                item["quoteAsset"].upper(),
+                item.get("status", "TRADING")
+            )
+            symbols[info.symbol] = info
+            pairs[(info.base, info.quote)] = info
+        # Swap both indexes at once so readers never see a half-built registry
+        self.symbols, self.pairs = symbols, pairs
+        self.loaded_at = time.time()
+
+    def normalize(self, symbol: str) -> str:
+        """
+        Exchange symbol for BTC, btc, BTCUSDT, BTC/USDT, BTC-USDT or BTC_USDT
+        """
+        cleaned = symbol.strip().upper()
+        for separator in _SEPARATORS:
+            if separator in cleaned:
+                base, _, quote = cleaned.partition(separator)
+                info = self.pairs.get((base, quote))
+                return info.symbol if info else f"{base}{quote}"
+
+        if cleaned in self.symbols:
+            return cleaned
+        info = self.pairs.get((cleaned, self.default_quote))
+        if info:
+            return info.symbol
+        return cleaned if cleaned.endswith(self.default_quote) else f"{cleaned}{self.default_quote}"
+
+    def info(self, symbol: str) -> Optional[SymbolInfo]:
+        return self.symbols.get(self.normalize(symbol))
+
+    def base_of(self, symbol: str) -> str:
+        """
+        Base asset of a symbol, e.g. BTC for BTCUSDT
+        """
+        normalized = self.normalize(symbol)
+        info = self.symbols.get(normalized)
+        if info:
+            return info.base
+        if normalized.endswith(self.default_quote) and normalized != self.default_quote:
+            return normalized[:-len(self.default_quote)]
+        return normalized
+
+    def is_listed(self, symbol: str) -> bool:
+        """
+        True if the exchange trades the symbol (always True before loading)
+        """
+        if not self.loaded:
+            return True
+        info = self.symbols.get(self.normalize(symbol))
+        return info is not None and info.status == "TRADING"
+
+    def resolve_watchlist(self, bases: Optional[List[str]] = None) -> List[str]:
+        """
+        Exchange symbols for a watchlist, de-duplicated, unlisted ones dropped
+        """
+        resolved: List[str] = []
+        for base in (bases if bases is not None else WATCHLIST)[:MAX_WATCHLIST]:
+            symbol = self.normalize(base)
+            if symbol not in resolved and self.is_listed(symbol):
+                resolved.append(symbol)
+        return resolved
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "loaded": self.loaded,
+            "loaded_at": self.loaded_at,
+            "symbols": len(self.symbols),
+            "trading": sum(1 for info in self.symbols.values() if info.status == "TRADING"),
+            "default_quote": self.default_quote,
+            "watchlist": WATCHLIST,
+        }
+
+
+async def fetch_exchange_info(base_url: str) -> Dict[str, Any]:
+    return await http_client.get_json(f"{base_url}/exchangeInfo", priority=rate_limits.LOW)